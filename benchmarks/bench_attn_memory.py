@@ -0,0 +1,105 @@
+"""Benchmark the peak memory of the SAM image encoder with chunked attention.
+
+Builds randomly initialized image encoders (no checkpoint needed) for each
+model size and runs one 1024x1024 forward pass without a limit and with each
+attention memory ceiling, each in a fresh subprocess. On CPU the peak memory
+is the growth of the peak RSS during the forward pass, on CUDA it is the peak
+allocated memory. The output of every limited run is compared with the
+unlimited run, or with the first limited run if the unlimited one fails (e.g.
+killed for running out of memory).
+
+Usage:
+    python benchmarks/bench_attn_memory.py [--model-types vit_b vit_l vit_h] [--limits 1024 256 64] [--device cpu]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def run_encoder(model_type, attn_impl, limit_mb, device, output_path):
+    import torch
+
+    from segment_anything_fb import sam_model_registry
+
+    torch.manual_seed(0)
+    image_encoder = sam_model_registry[model_type](attn_impl=attn_impl).image_encoder
+    with torch.no_grad():
+        for blk in image_encoder.blocks:
+            blk.attn.rel_pos_h.normal_(std=0.02)
+            blk.attn.rel_pos_w.normal_(std=0.02)
+    image_encoder.to(device).eval()
+    image_encoder.set_attn_memory_limit(limit_mb)
+    x = torch.randn(1, 3, image_encoder.img_size, image_encoder.img_size, generator=torch.Generator().manual_seed(0)).to(device)
+
+    with torch.no_grad():
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            base_mb = torch.cuda.memory_allocated(device) / (1024 * 1024)
+        else:
+            base_mb = peak_rss_mb()
+        start_time = time.perf_counter()
+        output = image_encoder(x)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            peak_mb = torch.cuda.max_memory_allocated(device) / (1024 * 1024)
+        else:
+            peak_mb = peak_rss_mb()
+        elapsed = time.perf_counter() - start_time
+
+    torch.save(output.cpu(), output_path)
+    print(f"{elapsed:.3f} {peak_mb - base_mb:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the peak memory of chunked attention in the SAM image encoder")
+    parser.add_argument("--model-types", nargs="+", choices=["vit_b", "vit_l", "vit_h"], default=["vit_b", "vit_l", "vit_h"], help="Encoder sizes")
+    parser.add_argument("--limits", nargs="+", type=int, default=[1024, 256, 64], help="Attention memory ceilings in MB")
+    parser.add_argument("--attn-impl", choices=["eager", "sdpa"], default="eager", help="Attention implementation")
+    parser.add_argument("--device", default="cpu", help="Device")
+    parser.add_argument("--mode", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--output", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    import torch
+
+    if args.mode is not None:
+        run_encoder(args.model_types[0], args.attn_impl, None if args.mode == "none" else int(args.mode),
+                    torch.device(args.device), args.output)
+        return
+
+    print(f"{'model':<6} {'limit [MB]':>10} {'forward [s]':>12} {'peak [MB]':>10} {'max abs diff':>13}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for model_type in args.model_types:
+            reference = None
+            for limit_mb in [None] + args.limits:
+                mode = "none" if limit_mb is None else str(limit_mb)
+                output_path = os.path.join(tmp_dir, f"{model_type}_{mode}.pt")
+                result = subprocess.run([sys.executable, __file__, "--model-types", model_type, "--attn-impl", args.attn_impl,
+                                         "--device", args.device, "--mode", mode, "--output", output_path],
+                                        capture_output=True, text=True)
+                if result.returncode != 0:
+                    print(f"{model_type:<6} {mode:>10} {'failed (exit code ' + str(result.returncode) + ')':>37}")
+                    continue
+                elapsed, peak_mb = (float(v) for v in result.stdout.strip().splitlines()[-1].split())
+                output = torch.load(output_path)
+                if reference is None:
+                    reference = output
+                max_diff = (output - reference).abs().max().item()
+                print(f"{model_type:<6} {mode:>10} {elapsed:>12.2f} {peak_mb:>10.1f} {max_diff:>13.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark the time and peak RSS of `import inpalib`.
+
+"lazy" imports inpalib alone, so only the backend of the first SAM model used
+is imported later. "eager" also imports every SAM backend package, which is
+what importing inpalib used to cost. Each measurement runs in a fresh
+subprocess.
+
+Usage:
+    python benchmarks/bench_import_inpalib.py [--repeat 5]
+"""
+import argparse
+import importlib
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+SAM_BACKEND_PACKAGES = ["segment_anything_fb", "segment_anything_hq", "mobile_sam", "fast_sam"]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def run_import(mode):
+    start_time = time.perf_counter()
+    importlib.import_module("inpalib")
+    if mode == "eager":
+        for package_name in SAM_BACKEND_PACKAGES:
+            importlib.import_module(package_name)
+    elapsed = time.perf_counter() - start_time
+
+    loaded = sum(package_name in sys.modules for package_name in SAM_BACKEND_PACKAGES)
+    print(f"{elapsed:.3f} {peak_rss_mb():.1f} {loaded}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import inpalib")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per mode")
+    parser.add_argument("--mode", choices=["lazy", "eager"], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_import(args.mode)
+        return
+
+    print(f"{'mode':<8} {'import [s]':>11} {'peak RSS [MB]':>14} {'backends loaded':>16}")
+    for mode in ["eager", "lazy"]:
+        results = []
+        for _ in range(args.repeat):
+            result = subprocess.run([sys.executable, __file__, "--mode", mode],
+                                    capture_output=True, text=True, check=True)
+            results.append([float(v) for v in result.stdout.strip().splitlines()[-1].split()])
+        elapsed = statistics.median(r[0] for r in results)
+        rss = statistics.median(r[1] for r in results)
+        print(f"{mode:<8} {elapsed:>11.3f} {rss:>14.1f} {int(results[-1][2]):>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Microbenchmark MaskData concatenation and filtering.
+
+Accumulates batches shaped like the ones of SamAutomaticMaskGenerator (boxes,
+scores, points and RLE lists) with the previous MaskData, which copies all
+columns on every cat and deep copies the RLE lists, and with the current one,
+which appends into buffers of doubling capacity. Then filters the result once
+with a boolean keep mask and once with NMS-style indices, and checks that both
+implementations hold the same data.
+
+Usage:
+    python benchmarks/bench_mask_data.py [--num-batches 16 64 256] [--batch-size 192] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+from copy import deepcopy
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+
+from segment_anything_fb.utils.amg import MaskData  # noqa: E402
+
+
+class PreviousMaskData:
+    def __init__(self, **kwargs):
+        self._stats = dict(**kwargs)
+
+    def __getitem__(self, key):
+        return self._stats[key]
+
+    def items(self):
+        return self._stats.items()
+
+    def filter(self, keep):
+        for k, v in self._stats.items():
+            if v is None:
+                self._stats[k] = None
+            elif isinstance(v, torch.Tensor):
+                self._stats[k] = v[torch.as_tensor(keep, device=v.device)]
+            elif isinstance(v, np.ndarray):
+                self._stats[k] = v[keep.detach().cpu().numpy()]
+            elif isinstance(v, list) and keep.dtype == torch.bool:
+                self._stats[k] = [a for i, a in enumerate(v) if keep[i]]
+            elif isinstance(v, list):
+                self._stats[k] = [v[i] for i in keep]
+
+    def cat(self, new_stats):
+        for k, v in new_stats.items():
+            if k not in self._stats or self._stats[k] is None:
+                self._stats[k] = deepcopy(v)
+            elif isinstance(v, torch.Tensor):
+                self._stats[k] = torch.cat([self._stats[k], v], dim=0)
+            elif isinstance(v, np.ndarray):
+                self._stats[k] = np.concatenate([self._stats[k], v], axis=0)
+            elif isinstance(v, list):
+                self._stats[k] = self._stats[k] + deepcopy(v)
+
+
+def create_batches(num_batches, batch_size):
+    generator = torch.Generator().manual_seed(0)
+    batches = []
+    for _ in range(num_batches):
+        counts = torch.randint(1, 5000, (batch_size, 64), generator=generator).tolist()
+        batches.append(dict(
+            boxes=torch.randint(0, 1024, (batch_size, 4), generator=generator),
+            iou_preds=torch.rand(batch_size, generator=generator),
+            stability_score=torch.rand(batch_size, generator=generator),
+            points=torch.rand(batch_size, 2, generator=generator).numpy(),
+            rles=[{"size": [1024, 1024], "counts": c} for c in counts],
+        ))
+    return batches
+
+
+def run(cls, batches):
+    start_time = time.perf_counter()
+    data = cls()
+    for batch in batches:
+        data.cat(cls(**batch))
+    cat_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    data.filter(data["iou_preds"] > 0.2)
+    data.filter(torch.argsort(data["stability_score"], descending=True)[: len(data["iou_preds"]) // 2])
+    filter_time = time.perf_counter() - start_time
+    return data, cat_time, filter_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark MaskData concatenation and filtering")
+    parser.add_argument("--num-batches", nargs="+", type=int, default=[16, 64, 256], help="Batches to concatenate")
+    parser.add_argument("--batch-size", type=int, default=192, help="Masks per batch (points_per_batch x 3)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per implementation")
+    args = parser.parse_args()
+
+    print(f"{'batches':>7} {'previous cat [ms]':>18} {'current cat [ms]':>17} {'previous filter [ms]':>21} "
+          f"{'current filter [ms]':>20} {'equal':>6}")
+    for num_batches in args.num_batches:
+        batches = create_batches(num_batches, args.batch_size)
+        results = {}
+        for name, cls in [("previous", PreviousMaskData), ("current", MaskData)]:
+            times = [run(cls, batches) for _ in range(args.repeat)]
+            results[name] = (times[-1][0], np.median([t[1] for t in times]), np.median([t[2] for t in times]))
+
+        previous, current = results["previous"][0], results["current"][0]
+        equal = all(
+            np.array_equal(np.asarray(previous[k]), np.asarray(current[k])) if k != "rles" else previous[k] == current[k]
+            for k in batches[0].keys()
+        )
+        print(f"{num_batches:>7} {results['previous'][1] * 1000:>18.2f} {results['current'][1] * 1000:>17.2f} "
+              f"{results['previous'][2] * 1000:>21.2f} {results['current'][2] * 1000:>20.2f} {str(equal):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark the NMS fallback of the automatic mask generator.
+
+Compares the previous per-box loop of torch_nms.nms with the current tiled
+implementation and with torchvision.ops.nms on random overlapping boxes, and
+checks which of them keep the same boxes as torchvision. The previous loop
+offsets both columns of nonzero() by the loop index, so it also drops the next
+box whenever any box overlaps, and does not match. Also times mask NMS over
+bit-packed random blob masks.
+
+Usage:
+    python benchmarks/bench_nms.py [--num-boxes 500 2000 8000] [--device cpu]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+import torch.nn.functional as F  # noqa: E402
+from torchvision.ops import nms as torchvision_nms  # noqa: E402
+from torchvision.ops.boxes import box_iou  # noqa: E402
+
+from segment_anything_fb.utils.torch_nms import mask_nms, nms  # noqa: E402
+
+
+def previous_nms(bboxes, scores, iou_threshold):
+    order = torch.argsort(-scores).to(bboxes.device)
+    indices = torch.arange(bboxes.shape[0]).to(bboxes.device)
+    keep = torch.ones_like(indices, dtype=torch.bool).to(bboxes.device)
+    for i in indices:
+        if keep[i]:
+            bbox = bboxes[order[i]]
+            iou = box_iou(bbox[None, ...], (bboxes[order[i + 1:]]) * keep[i + 1:][..., None])
+            overlapped = torch.nonzero(iou > iou_threshold)
+            keep[overlapped + i + 1] = 0
+    return order[keep]
+
+
+def create_boxes(num_boxes, device):
+    generator = torch.Generator().manual_seed(0)
+    xy = torch.rand(num_boxes, 2, generator=generator) * 1024
+    wh = torch.rand(num_boxes, 2, generator=generator) * 256 + 16
+    scores = torch.rand(num_boxes, generator=generator)
+    return torch.cat([xy, xy + wh], dim=1).to(device), scores.to(device)
+
+
+def create_packed_masks(num_masks, height, width):
+    # Smooth noise thresholded at zero gives blobs; every mask is duplicated
+    # with a few pixels flipped to give mask NMS something to remove
+    generator = torch.Generator().manual_seed(0)
+    noise = torch.randn(num_masks // 2, 1, max(1, height // 64), max(1, width // 64), generator=generator)
+    masks = F.interpolate(noise, (height, width), mode="bilinear", align_corners=False)[:, 0] > 0.5
+    noisy = masks ^ (torch.rand(masks.shape, generator=generator) > 0.99)
+    masks = torch.cat([masks, noisy]).numpy()
+    packed = np.stack([np.packbits(mask, axis=-1).reshape(-1) for mask in masks])
+    return torch.as_tensor(packed), torch.rand(len(masks), generator=generator)
+
+
+def timed(func, *args, repeat=3):
+    func(*args)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        output = func(*args)
+    return output, (time.perf_counter() - start_time) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NMS fallback")
+    parser.add_argument("--num-boxes", nargs="+", type=int, default=[500, 2000, 8000], help="Boxes per run")
+    parser.add_argument("--iou-threshold", type=float, default=0.7, help="IoU threshold")
+    parser.add_argument("--num-masks", type=int, default=128, help="Masks for mask NMS")
+    parser.add_argument("--mask-size", default="1000x1000", help="Mask size WxH for mask NMS")
+    parser.add_argument("--device", default="cpu", help="Device")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    print(f"{'boxes':>6} {'kept':>6} {'previous [ms]':>14} {'current [ms]':>13} {'torchvision [ms]':>17} "
+          f"{'previous equal':>15} {'current equal':>14}")
+    for num_boxes in args.num_boxes:
+        boxes, scores = create_boxes(num_boxes, device)
+        previous_keep, previous_time = timed(previous_nms, boxes, scores, args.iou_threshold, repeat=1)
+        current_keep, current_time = timed(nms, boxes, scores, args.iou_threshold)
+        torchvision_keep, torchvision_time = timed(torchvision_nms, boxes, scores, args.iou_threshold)
+        previous_equal = torch.equal(previous_keep, torchvision_keep)
+        current_equal = torch.equal(current_keep, torchvision_keep)
+        print(f"{num_boxes:>6} {len(current_keep):>6} {previous_time * 1000:>14.1f} {current_time * 1000:>13.1f} "
+              f"{torchvision_time * 1000:>17.1f} {str(previous_equal):>15} {str(current_equal):>14}")
+
+    width, height = (int(v) for v in args.mask_size.split("x"))
+    packed_masks, mask_scores = create_packed_masks(args.num_masks, height, width)
+    packed_masks, mask_scores = packed_masks.to(device), mask_scores.to(device)
+    mask_keep, mask_time = timed(mask_nms, packed_masks, mask_scores, args.iou_threshold)
+    print(f"mask NMS {args.mask_size}: {len(mask_keep)} of {len(packed_masks)} masks kept in {mask_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
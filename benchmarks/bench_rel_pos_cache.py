@@ -0,0 +1,66 @@
+"""Benchmark the ViT image encoder with and without cached relative-position tables.
+
+Builds a randomly initialized SAM image encoder (no checkpoint needed) and times
+forward passes on CPU with Attention.cache_rel_pos disabled and enabled.
+
+Usage:
+    python benchmarks/bench_rel_pos_cache.py [--model-type vit_b] [--attn-impl eager] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import torch  # noqa: E402
+
+from segment_anything_fb import sam_model_registry  # noqa: E402
+from segment_anything_fb.modeling.image_encoder import Attention  # noqa: E402
+
+
+def set_cache_rel_pos(image_encoder, enabled):
+    for module in image_encoder.modules():
+        if isinstance(module, Attention):
+            module.cache_rel_pos = enabled
+            module._rel_pos_tables.clear()
+
+
+def time_forward(image_encoder, x, repeat):
+    image_encoder(x)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        output = image_encoder(x)
+    return output, (time.perf_counter() - start_time) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cached relative-position tables on CPU")
+    parser.add_argument("--model-type", choices=["vit_b", "vit_l", "vit_h"], default="vit_b", help="Encoder size")
+    parser.add_argument("--attn-impl", choices=["eager", "sdpa"], default="eager", help="Attention implementation")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed forward passes per setting")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    image_encoder = sam_model_registry[args.model_type](attn_impl=args.attn_impl).image_encoder.eval()
+    torch.manual_seed(0)
+    x = torch.randn(1, 3, image_encoder.img_size, image_encoder.img_size)
+
+    with torch.no_grad():
+        set_cache_rel_pos(image_encoder, False)
+        uncached_output, uncached_time = time_forward(image_encoder, x, args.repeat)
+        set_cache_rel_pos(image_encoder, True)
+        cached_output, cached_time = time_forward(image_encoder, x, args.repeat)
+
+    max_diff = (uncached_output - cached_output).abs().max().item()
+    print(f"{args.model_type} {args.attn_impl} on CPU ({torch.get_num_threads()} threads)")
+    print(f"  without cache: {uncached_time * 1000:.1f} ms/forward")
+    print(f"  with cache:    {cached_time * 1000:.1f} ms/forward ({(1 - cached_time / uncached_time) * 100:.1f}% faster)")
+    print(f"  max abs diff:  {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
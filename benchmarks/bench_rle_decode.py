@@ -0,0 +1,94 @@
+"""Benchmark the RLE decoder and the packed output mode of the automatic mask generator.
+
+Compares the previous per-run loop of rle_to_mask with the current np.repeat
+decoder on RLEs of random blob masks, checks that both decode the same masks,
+and reports the memory per mask of the 'binary_mask' and 'packed' output modes.
+The peak memory of rle_to_packed_mask is compared with packing a decoded mask,
+as it was done before.
+
+Usage:
+    python benchmarks/bench_rle_decode.py [--sizes 1000x1000 4000x3000] [--num-masks 32]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+import torch.nn.functional as F  # noqa: E402
+
+from segment_anything_fb.utils.amg import (mask_to_rle_pytorch, packed_mask_to_mask, rle_to_mask,  # noqa: E402
+                                           rle_to_packed_mask)
+
+
+def previous_rle_to_mask(rle):
+    h, w = rle["size"]
+    mask = np.empty(h * w, dtype=bool)
+    idx = 0
+    parity = False
+    for count in rle["counts"]:
+        mask[idx: idx + count] = parity
+        idx += count
+        parity ^= True
+    mask = mask.reshape(w, h)
+    return mask.transpose()
+
+
+def previous_rle_to_packed_mask(rle):
+    return np.packbits(rle_to_mask(rle), axis=-1)
+
+
+def peak_memory(func, rle):
+    tracemalloc.start()
+    func(rle)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def create_rles(num_masks, height, width):
+    # Smooth noise thresholded at zero gives blobs with realistic run counts
+    generator = torch.Generator().manual_seed(0)
+    noise = torch.randn(num_masks, 1, max(1, height // 64), max(1, width // 64), generator=generator)
+    return mask_to_rle_pytorch(F.interpolate(noise, (height, width), mode="bilinear", align_corners=False)[:, 0] > 0.5)
+
+
+def timed(func, rles, repeat):
+    [func(rle) for rle in rles]
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        output = [func(rle) for rle in rles]
+    return output, (time.perf_counter() - start_time) / repeat / len(rles)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RLE decoder and the packed output mode")
+    parser.add_argument("--sizes", nargs="+", default=["1000x1000", "4000x3000"], help="Mask sizes WxH")
+    parser.add_argument("--num-masks", type=int, default=32, help="Masks per size")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per decoder")
+    args = parser.parse_args()
+
+    print(f"{'size':<10} {'previous [ms]':>14} {'current [ms]':>13} {'packed [ms]':>12} {'equal':>6} "
+          f"{'binary [MB]':>12} {'packed [MB]':>12} {'previous packed peak [MB]':>26} {'packed peak [MB]':>17}")
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        rles = create_rles(args.num_masks, height, width)
+        previous_masks, previous_time = timed(previous_rle_to_mask, rles, args.repeat)
+        current_masks, current_time = timed(rle_to_mask, rles, args.repeat)
+        packed_masks, packed_time = timed(rle_to_packed_mask, rles, args.repeat)
+        equal = all(np.array_equal(a, b) and np.array_equal(a, packed_mask_to_mask(p, width))
+                    for a, b, p in zip(previous_masks, current_masks, packed_masks))
+        binary_mb = current_masks[0].nbytes / (1024 * 1024)
+        packed_mb = packed_masks[0].nbytes / (1024 * 1024)
+        previous_peak_mb = peak_memory(previous_rle_to_packed_mask, rles[0])
+        packed_peak_mb = peak_memory(rle_to_packed_mask, rles[0])
+        print(f"{size:<10} {previous_time * 1000:>14.2f} {current_time * 1000:>13.2f} {packed_time * 1000:>12.2f} {str(equal):>6} "
+              f"{binary_mb:>12.2f} {packed_mb:>12.2f} {previous_peak_mb:>26.2f} {packed_peak_mb:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
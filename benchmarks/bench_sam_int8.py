@@ -0,0 +1,119 @@
+"""Compare int8 dynamic quantized SAM models with fp32 on CPU.
+
+For every checkpoint, the fp32 model and the int8 model (created and cached in
+models/fast_checkpoints on first use) run SamPredictor on the same images with
+a fixed grid of point prompts. The report lists the set_image time, the peak
+RSS of each run and the mask IoU of int8 against fp32. Each model runs in a
+fresh subprocess so peak RSS is not shared.
+
+Usage:
+    python benchmarks/bench_sam_int8.py models/sam_vit_b_01ec64.pth [...] --images path/to/images
+"""
+import argparse
+import glob
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def get_image_paths(images_dir):
+    return sorted(p for p in glob.glob(os.path.join(images_dir, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def get_point_grid(height, width, n_per_side):
+    import numpy as np
+
+    offset = 1 / (2 * n_per_side)
+    points_one_side = np.linspace(offset, 1 - offset, n_per_side)
+    points_x, points_y = np.meshgrid(points_one_side * width, points_one_side * height)
+    return np.stack([points_x.reshape(-1), points_y.reshape(-1)], axis=-1)
+
+
+def run_model(sam_checkpoint, mode, images_dir, n_per_side, output_path):
+    import cv2
+    import numpy as np
+    import torch
+
+    from ia_config import IAConfig
+    from ia_sam_manager import get_sam_predictor
+
+    IAConfig.global_args.update(sam_cpu=True, sam_int8=(mode == "int8"))
+    torch.set_grad_enabled(False)
+
+    predictor = get_sam_predictor(sam_checkpoint)
+
+    set_image_times = []
+    masks = {}
+    for image_index, image_path in enumerate(get_image_paths(images_dir)):
+        image = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+        start_time = time.perf_counter()
+        predictor.set_image(image)
+        set_image_times.append(time.perf_counter() - start_time)
+
+        for point_index, point in enumerate(get_point_grid(*image.shape[:2], n_per_side)):
+            point_masks, scores, _ = predictor.predict(point_coords=point[None, :], point_labels=np.array([1]), multimask_output=True)
+            masks[f"{image_index}_{point_index}"] = np.packbits(point_masks[np.argmax(scores)])
+
+    np.savez_compressed(output_path, **masks)
+    print(f"{float(np.median(set_image_times)):.3f} {peak_rss_mb():.1f}")
+
+
+def mask_iou(packed_a, packed_b):
+    import numpy as np
+
+    mask_a = np.unpackbits(packed_a).astype(bool)
+    mask_b = np.unpackbits(packed_b).astype(bool)
+    union = np.logical_or(mask_a, mask_b).sum()
+    return 1.0 if union == 0 else np.logical_and(mask_a, mask_b).sum() / union
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark int8 dynamic quantized SAM models on CPU")
+    parser.add_argument("checkpoints", nargs="+", help="SAM checkpoint paths")
+    parser.add_argument("--images", required=True, help="Directory with the fixed image set")
+    parser.add_argument("--points-per-side", type=int, default=4, help="Point prompts per image side")
+    parser.add_argument("--mode", choices=["fp32", "int8"], default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--output", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_model(args.checkpoints[0], args.mode, args.images, args.points_per_side, args.output)
+        return
+
+    import numpy as np
+
+    print(f"{'checkpoint':<24} {'mode':<5} {'set_image [s]':>14} {'peak RSS [MB]':>14} {'mean IoU':>9} {'min IoU':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for sam_checkpoint in args.checkpoints:
+            results = {}
+            for mode in ["fp32", "int8"]:
+                output_path = os.path.join(tmp_dir, f"{mode}.npz")
+                result = subprocess.run([sys.executable, __file__, sam_checkpoint, "--images", args.images,
+                                         "--points-per-side", str(args.points_per_side), "--mode", mode, "--output", output_path],
+                                        capture_output=True, text=True, check=True)
+                elapsed, rss = result.stdout.strip().splitlines()[-1].split()
+                results[mode] = (float(elapsed), float(rss), np.load(output_path))
+
+            fp32_masks, int8_masks = results["fp32"][2], results["int8"][2]
+            ious = [mask_iou(fp32_masks[k], int8_masks[k]) for k in fp32_masks.files]
+            for mode in ["fp32", "int8"]:
+                elapsed, rss, _ = results[mode]
+                iou_columns = f"{np.mean(ious):>9.4f} {np.min(ious):>8.4f}" if mode == "int8" and len(ious) > 0 else ""
+                print(f"{os.path.basename(sam_checkpoint):<24} {mode:<5} {elapsed:>14.3f} {rss:>14.1f} {iou_columns}")
+
+
+if __name__ == "__main__":
+    main()
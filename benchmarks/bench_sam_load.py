@@ -0,0 +1,69 @@
+"""Benchmark SAM checkpoint load time and peak RSS.
+
+Compares the legacy loading path (random initialization, heap copy of the
+checkpoint, copying load_state_dict) with the builders' memory-mapped path.
+Each measurement runs in a fresh subprocess so peak RSS is not shared.
+
+Usage:
+    python benchmarks/bench_sam_load.py models/sam_vit_h_4b8939.pth [models/mobile_sam.pt ...]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def load(sam_checkpoint, mode):
+    import torch
+
+    from ia_sam_manager import get_sam_backend
+
+    backend = get_sam_backend(sam_checkpoint)
+    build_sam = backend["model_registry"][backend["model_type"]]
+
+    start_time = time.perf_counter()
+    if mode == "legacy":
+        sam = build_sam(checkpoint=None)
+        with open(sam_checkpoint, "rb") as f:
+            state_dict = torch.load(f, map_location="cpu")
+        sam.load_state_dict(state_dict, strict=False)
+        del state_dict
+    else:
+        sam = build_sam(checkpoint=sam_checkpoint)
+    elapsed = time.perf_counter() - start_time
+
+    print(f"{elapsed:.3f} {peak_rss_mb():.1f}")
+    return sam
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SAM checkpoint loading")
+    parser.add_argument("checkpoints", nargs="+", help="SAM checkpoint paths")
+    parser.add_argument("--mode", choices=["legacy", "fast"], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        load(args.checkpoints[0], args.mode)
+        return
+
+    print(f"{'checkpoint':<28} {'mode':<8} {'load [s]':>9} {'peak RSS [MB]':>14}")
+    for sam_checkpoint in args.checkpoints:
+        for mode in ["legacy", "fast"]:
+            result = subprocess.run([sys.executable, __file__, sam_checkpoint, "--mode", mode],
+                                    capture_output=True, text=True, check=True)
+            elapsed, rss = result.stdout.strip().splitlines()[-1].split()
+            print(f"{os.path.basename(sam_checkpoint):<28} {mode:<8} {float(elapsed):>9.3f} {float(rss):>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
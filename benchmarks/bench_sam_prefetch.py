@@ -0,0 +1,92 @@
+"""Benchmark the latency hidden by SAM model prefetching.
+
+For a SAM checkpoint, measures the first run (model load plus one image
+encoder pass through SamPredictor.set_image) without a prefetch ("cold") and
+after a prefetch has finished ("prefetched"). With --cached-checkpoint, also
+measures how long get_sam_model takes for that already cached model while
+the prefetch is loading and warming up the other one ("foreground").
+Each measurement runs in a fresh subprocess on CPU.
+
+Usage:
+    python benchmarks/bench_sam_prefetch.py models/sam_vit_b_01ec64.pth [--cached-checkpoint models/mobile_sam.pt]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def first_run(sam_checkpoint):
+    import numpy as np
+
+    from ia_sam_manager import get_sam_backend, get_sam_model
+    from ia_sam_prefetch import sam_prefetcher
+
+    image = np.random.default_rng(0).integers(0, 256, (1024, 1024, 3), dtype=np.uint8)
+    start_time = time.perf_counter()
+    with sam_prefetcher.foreground():
+        sam_prefetcher.wait(sam_checkpoint)
+        predictor = get_sam_backend(sam_checkpoint)["predictor"](get_sam_model(sam_checkpoint))
+        predictor.set_image(image)
+    return time.perf_counter() - start_time
+
+
+def run(sam_checkpoint, cached_checkpoint, mode):
+    from ia_config import IAConfig
+    from ia_sam_manager import get_sam_model
+    from ia_sam_prefetch import sam_prefetcher
+
+    IAConfig.global_args.update(sam_cpu=True, sam_autotune=False)
+    if mode == "cold":
+        print(f"{first_run(sam_checkpoint):.3f}")
+    elif mode == "prefetched":
+        sam_prefetcher.prefetch(sam_checkpoint)
+        # The user picks the model and uploads an image before running it
+        sam_prefetcher._threads[sam_checkpoint].join()
+        print(f"{first_run(sam_checkpoint):.3f}")
+    elif mode == "foreground":
+        get_sam_model(cached_checkpoint)
+        sam_prefetcher.prefetch(sam_checkpoint)
+        thread = sam_prefetcher._threads[sam_checkpoint]
+        latencies = []
+        while thread.is_alive():
+            start_time = time.perf_counter()
+            get_sam_model(cached_checkpoint)
+            latencies.append(time.perf_counter() - start_time)
+            time.sleep(0.01)
+        print(f"{max(latencies):.6f} {len(latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the latency hidden by SAM model prefetching")
+    parser.add_argument("checkpoint", help="SAM checkpoint path to prefetch")
+    parser.add_argument("--cached-checkpoint", default=None, help="Already cached SAM checkpoint used in the foreground")
+    parser.add_argument("--mode", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run(args.checkpoint, args.cached_checkpoint, args.mode)
+        return
+
+    def run_mode(mode):
+        command = [sys.executable, __file__, args.checkpoint, "--mode", mode]
+        if args.cached_checkpoint is not None:
+            command += ["--cached-checkpoint", args.cached_checkpoint]
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        return result.stdout.strip().splitlines()[-1].split()
+
+    cold_time = float(run_mode("cold")[0])
+    prefetched_time = float(run_mode("prefetched")[0])
+    print(f"{os.path.basename(args.checkpoint)} first run: cold {cold_time:.2f}s, prefetched {prefetched_time:.2f}s, "
+          f"saved {cold_time - prefetched_time:.2f}s")
+    if args.cached_checkpoint is not None:
+        max_latency, num_calls = run_mode("foreground")
+        print(f"get_sam_model({os.path.basename(args.cached_checkpoint)}) during the prefetch: "
+              f"max {float(max_latency) * 1000:.2f} ms over {num_calls} calls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark the image preprocessing of SamPredictor.set_image.
+
+Compares the previous path (PIL resize, contiguous copy, normalize then pad)
+with the current one (PIL resize, permuted view, normalize into the padded
+buffer) and with the current one using the opt-in cv2 resize, on random images
+of several sizes, without running the image encoder. Reports the time of each
+path and the max abs difference of the encoder input to the previous path.
+
+Usage:
+    python benchmarks/bench_set_image_preprocess.py [--sizes 1024x768 4000x3000] [--repeat 10]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+import torch.nn.functional as F  # noqa: E402
+from torchvision.transforms.functional import resize, to_pil_image  # noqa: E402
+
+from segment_anything_fb.utils.transforms import ResizeLongestSide  # noqa: E402
+
+PIXEL_MEAN = torch.Tensor([123.675, 116.28, 103.53]).view(-1, 1, 1)
+PIXEL_STD = torch.Tensor([58.395, 57.12, 57.375]).view(-1, 1, 1)
+IMG_SIZE = 1024
+
+
+def previous_preprocess(image):
+    target_size = ResizeLongestSide.get_preprocess_shape(image.shape[0], image.shape[1], IMG_SIZE)
+    input_image = np.array(resize(to_pil_image(image), target_size))
+    x = torch.as_tensor(input_image).permute(2, 0, 1).contiguous()[None, :, :, :]
+    x = (x - PIXEL_MEAN) / PIXEL_STD
+    h, w = x.shape[-2:]
+    return F.pad(x, (0, IMG_SIZE - w, 0, IMG_SIZE - h))
+
+
+def current_preprocess(image, use_cv2=False):
+    input_image = ResizeLongestSide(IMG_SIZE, use_cv2=use_cv2).apply_image(image)
+    x = torch.as_tensor(input_image).permute(2, 0, 1)[None, :, :, :]
+    h, w = x.shape[-2:]
+    padded = torch.zeros((*x.shape[:-2], IMG_SIZE, IMG_SIZE), dtype=PIXEL_MEAN.dtype)
+    padded[..., :h, :w].copy_(x).sub_(PIXEL_MEAN).div_(PIXEL_STD)
+    return padded
+
+
+def cv2_preprocess(image):
+    return current_preprocess(image, use_cv2=True)
+
+
+def timed(func, image, repeat):
+    func(image)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        output = func(image)
+    return output, (time.perf_counter() - start_time) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the set_image preprocessing")
+    parser.add_argument("--sizes", nargs="+", default=["1024x768", "2048x1536", "4000x3000"], help="Image sizes WxH")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per path")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':<10} {'previous [ms]':>14} {'current [ms]':>13} {'max abs diff':>13} {'cv2 [ms]':>9} {'max abs diff':>13}")
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        image = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        previous_output, previous_time = timed(previous_preprocess, image, args.repeat)
+        current_output, current_time = timed(current_preprocess, image, args.repeat)
+        cv2_output, cv2_time = timed(cv2_preprocess, image, args.repeat)
+        max_diff = (previous_output - current_output).abs().max().item()
+        cv2_max_diff = (previous_output - cv2_output).abs().max().item()
+        print(f"{size:<10} {previous_time * 1000:>14.1f} {current_time * 1000:>13.1f} {max_diff:>13.2e} "
+              f"{cv2_time * 1000:>9.1f} {cv2_max_diff:>13.2e}")
+
+
+if __name__ == "__main__":
+    main()
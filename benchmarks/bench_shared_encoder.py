@@ -0,0 +1,77 @@
+"""Benchmark loading SAM-HQ next to SAM with and without a shared image encoder.
+
+Loads a SAM checkpoint, then a SAM-HQ checkpoint with the same ViT, either
+attaching the already loaded image encoder ("shared") or building the full
+model ("separate"). Reports the time to load the second model and read its
+weights (memory-mapped weights are only read on first use), and the RSS once
+the weights of both models have been read. Each measurement runs in a
+fresh subprocess.
+
+Usage:
+    python benchmarks/bench_shared_encoder.py models/sam_vit_h_4b8939.pth models/sam_hq_vit_h.pth
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def touch_weights(sam):
+    import torch
+
+    with torch.no_grad():
+        for tensor in sam.state_dict().values():
+            tensor.sum()
+
+
+def load(sam_checkpoint, sam_hq_checkpoint, mode):
+    import torch
+
+    from ia_sam_manager import build_sam_model, get_sam_backend
+    from ia_sam_shared_encoder import shared_encoder_registry
+
+    device = torch.device("cpu")
+    sam, encoder_key = build_sam_model(sam_checkpoint, get_sam_backend(sam_checkpoint), device, "float32")
+    shared_encoder_registry.register(sam, encoder_key)
+    touch_weights(sam)
+
+    backend = get_sam_backend(sam_hq_checkpoint)
+    start_time = time.perf_counter()
+    if mode == "shared":
+        sam_hq, _ = build_sam_model(sam_hq_checkpoint, backend, device, "float32")
+    else:
+        sam_hq = backend["model_registry"][backend["model_type"]](checkpoint=sam_hq_checkpoint)
+    touch_weights(sam_hq)
+    load_time = time.perf_counter() - start_time
+    print(f"{load_time:.3f} {rss_mb():.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading SAM-HQ next to SAM with a shared image encoder")
+    parser.add_argument("sam_checkpoint", help="SAM checkpoint path")
+    parser.add_argument("sam_hq_checkpoint", help="SAM-HQ checkpoint path with the same ViT")
+    parser.add_argument("--mode", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        load(args.sam_checkpoint, args.sam_hq_checkpoint, args.mode)
+        return
+
+    print(f"{'checkpoint':<28} {'mode':<9} {'load [s]':>9} {'RSS [MB]':>9}")
+    for mode in ["separate", "shared"]:
+        result = subprocess.run([sys.executable, __file__, args.sam_checkpoint, args.sam_hq_checkpoint, "--mode", mode],
+                                capture_output=True, text=True, check=True)
+        load_time, rss = result.stdout.split()[-2:]
+        print(f"{os.path.basename(args.sam_hq_checkpoint):<28} {mode:<9} {float(load_time):>9.3f} {float(rss):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
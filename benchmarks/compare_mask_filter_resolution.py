@@ -0,0 +1,159 @@
+"""Compare SAM masks filtered at reduced resolution against the original behavior.
+
+For every checkpoint, SamAutomaticMaskGenerator runs on the reference images
+once with --sam-mask-filter-resolution original and once with each reduced
+mode, each in a fresh subprocess. Every original mask is matched to the mask
+with the highest IoU. The report lists the generate time, the peak memory
+(peak RSS growth on CPU, peak allocated memory on CUDA), the mean and minimum
+matched IoU, the fraction of masks matched with IoU >= 0.95, and the drift of
+the mask count. --pred-iou-thresh and --stability-score-thresh override the
+thresholds of the app, e.g. to keep masks of randomly initialized test
+checkpoints.
+
+Usage:
+    python benchmarks/compare_mask_filter_resolution.py models/sam_vit_b_01ec64.pth [...] --images path/to/images [--long-side 4000]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from compare_sam_precision import get_image_paths, load_masks, matched_ious  # noqa: E402
+
+MODES = ["original", "input", "low_res"]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def run_model(sam_checkpoint, mode, images_dir, long_side, sam_cpu, output_path, pred_iou_thresh=None, stability_score_thresh=None):
+    import cv2
+    import numpy as np
+    import torch
+
+    from ia_config import IAConfig
+    from ia_sam_manager import get_sam_device, get_sam_mask_generator
+
+    IAConfig.global_args.update(sam_cpu=sam_cpu, sam_mask_filter_resolution=mode)
+    torch.set_grad_enabled(False)
+
+    sam_mask_generator = get_sam_mask_generator(sam_checkpoint)
+    if pred_iou_thresh is not None:
+        sam_mask_generator.pred_iou_thresh = pred_iou_thresh
+    if stability_score_thresh is not None:
+        sam_mask_generator.stability_score_thresh = stability_score_thresh
+    device = get_sam_device(sam_checkpoint)
+
+    images = []
+    for image_path in get_image_paths(images_dir):
+        image = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+        if long_side is not None:
+            scale = long_side / max(image.shape[:2])
+            image = cv2.resize(image, (round(image.shape[1] * scale), round(image.shape[0] * scale)), interpolation=cv2.INTER_CUBIC)
+        images.append(image)
+
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        base_mb = torch.cuda.memory_allocated(device) / (1024 * 1024)
+    else:
+        base_mb = peak_rss_mb()
+
+    generate_times = []
+    masks = {}
+    for image_index, image in enumerate(images):
+        start_time = time.perf_counter()
+        sam_masks = sam_mask_generator.generate(image)
+        generate_times.append(time.perf_counter() - start_time)
+
+        masks[f"{image_index}_shape"] = np.array(image.shape[:2])
+        masks[f"{image_index}_count"] = np.array(len(sam_masks))
+        for mask_index, sam_mask in enumerate(sam_masks):
+            masks[f"{image_index}_{mask_index}"] = np.packbits(sam_mask["segmentation"])
+
+    if device.type == "cuda":
+        peak_mb = torch.cuda.max_memory_allocated(device) / (1024 * 1024)
+    else:
+        peak_mb = peak_rss_mb()
+
+    np.savez_compressed(output_path, **masks)
+    print(f"{float(np.median(generate_times)) if len(generate_times) > 0 else 0.0:.3f} {peak_mb - base_mb:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SAM masks filtered at reduced resolution with the original behavior")
+    parser.add_argument("checkpoints", nargs="+", help="SAM checkpoint paths")
+    parser.add_argument("--images", required=True, help="Directory with the reference images")
+    parser.add_argument("--modes", nargs="+", choices=MODES[1:], default=MODES[1:], help="Reduced resolutions to compare")
+    parser.add_argument("--long-side", type=int, default=None, help="Resize the images to this long side, e.g. 4000 for 12 MP")
+    parser.add_argument("--sam-cpu", action="store_true", help="Run Segment Anything on CPU")
+    parser.add_argument("--pred-iou-thresh", type=float, default=None, help="Override the predicted IoU threshold")
+    parser.add_argument("--stability-score-thresh", type=float, default=None, help="Override the stability score threshold")
+    parser.add_argument("--mode", choices=MODES, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--output", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_model(args.checkpoints[0], args.mode, args.images, args.long_side, args.sam_cpu, args.output,
+                  args.pred_iou_thresh, args.stability_score_thresh)
+        return
+
+    import numpy as np
+
+    num_images = len(get_image_paths(args.images))
+    print(f"{'checkpoint':<24} {'mode':<9} {'generate [s]':>13} {'peak [MB]':>10} {'masks':>6} {'count drift':>12} "
+          f"{'mean IoU':>9} {'min IoU':>8} {'IoU>=0.95':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for sam_checkpoint in args.checkpoints:
+            results = {}
+            for mode in ["original"] + args.modes:
+                output_path = os.path.join(tmp_dir, f"{mode}.npz")
+                cmd = [sys.executable, __file__, sam_checkpoint, "--images", args.images, "--mode", mode, "--output", output_path]
+                if args.long_side is not None:
+                    cmd.extend(["--long-side", str(args.long_side)])
+                if args.sam_cpu:
+                    cmd.append("--sam-cpu")
+                for option, value in [("--pred-iou-thresh", args.pred_iou_thresh), ("--stability-score-thresh", args.stability_score_thresh)]:
+                    if value is not None:
+                        cmd.extend([option, str(value)])
+                result = subprocess.run(cmd, capture_output=True, text=True)
+                if result.returncode != 0:
+                    # e.g. out of memory at the original resolution; reported below
+                    continue
+                generate_time, peak_mb = (float(v) for v in result.stdout.strip().splitlines()[-1].split())
+                results[mode] = (generate_time, peak_mb, np.load(output_path))
+
+            name = os.path.basename(sam_checkpoint)
+            reference = results["original"][2] if "original" in results else None
+            for mode in ["original"] + args.modes:
+                if mode not in results:
+                    print(f"{name:<24} {mode:<9} {'failed':>13}")
+                    continue
+                other = results[mode][2]
+                other_count = sum(int(other[f"{i}_count"]) for i in range(num_images))
+                if reference is None or mode == "original":
+                    print(f"{name:<24} {mode:<9} {results[mode][0]:>13.3f} {results[mode][1]:>10.1f} {other_count:>6}")
+                    continue
+                ious = []
+                count_drift = 0
+                for image_index in range(num_images):
+                    reference_masks = load_masks(reference, image_index)
+                    masks = load_masks(other, image_index)
+                    ious.extend(matched_ious(reference_masks, masks).tolist())
+                    count_drift += abs(len(masks) - len(reference_masks))
+
+                iou_columns = (f"{np.mean(ious):>9.4f} {np.min(ious):>8.4f} {np.mean(np.array(ious) >= 0.95):>10.1%}"
+                               if len(ious) > 0 else "")
+                print(f"{name:<24} {mode:<9} {results[mode][0]:>13.3f} {results[mode][1]:>10.1f} {other_count:>6} {count_drift:>12} "
+                      f"{iou_columns}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Compare SAM masks generated with a reduced precision image encoder against fp32.
+
+For every checkpoint, SamAutomaticMaskGenerator runs on the reference images
+once with --sam-precision fp32 and once with the given precision, each in a
+fresh subprocess. Every fp32 mask is matched to the reduced precision mask with
+the highest IoU. The report lists the generate time, the mean and minimum
+matched IoU, and the drift of the mask count.
+
+Usage:
+    python benchmarks/compare_sam_precision.py models/sam_vit_b_01ec64.pth [...] --images path/to/images [--precision auto]
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def get_image_paths(images_dir):
+    return sorted(p for p in glob.glob(os.path.join(images_dir, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def run_model(sam_checkpoint, precision, images_dir, sam_cpu, output_path):
+    import cv2
+    import numpy as np
+    import torch
+
+    from ia_config import IAConfig
+    from ia_sam_manager import get_sam_mask_generator
+
+    IAConfig.global_args.update(sam_cpu=sam_cpu, sam_precision=precision)
+    torch.set_grad_enabled(False)
+
+    sam_mask_generator = get_sam_mask_generator(sam_checkpoint)
+
+    generate_times = []
+    masks = {}
+    for image_index, image_path in enumerate(get_image_paths(images_dir)):
+        image = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+        start_time = time.perf_counter()
+        sam_masks = sam_mask_generator.generate(image)
+        generate_times.append(time.perf_counter() - start_time)
+
+        masks[f"{image_index}_shape"] = np.array(image.shape[:2])
+        masks[f"{image_index}_count"] = np.array(len(sam_masks))
+        for mask_index, sam_mask in enumerate(sam_masks):
+            masks[f"{image_index}_{mask_index}"] = np.packbits(sam_mask["segmentation"])
+
+    np.savez_compressed(output_path, **masks)
+    print(f"{float(np.median(generate_times)) if len(generate_times) > 0 else 0.0:.3f}")
+
+
+def load_masks(npz, image_index):
+    import numpy as np
+
+    height, width = npz[f"{image_index}_shape"]
+    count = int(npz[f"{image_index}_count"])
+    masks = [np.unpackbits(npz[f"{image_index}_{i}"])[:height * width].astype(bool) for i in range(count)]
+    return np.stack(masks) if count > 0 else np.zeros((0, height * width), dtype=bool)
+
+
+def matched_ious(reference_masks, masks):
+    """IoU of every reference mask with its best matching mask."""
+    import numpy as np
+
+    if len(reference_masks) == 0:
+        return np.zeros(0)
+    if len(masks) == 0:
+        return np.zeros(len(reference_masks))
+    reference = reference_masks.astype(np.float32)
+    other = masks.astype(np.float32)
+    intersections = reference @ other.T
+    unions = reference.sum(axis=1)[:, None] + other.sum(axis=1)[None, :] - intersections
+    return (intersections / np.maximum(unions, 1)).max(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare reduced precision SAM masks with fp32")
+    parser.add_argument("checkpoints", nargs="+", help="SAM checkpoint paths")
+    parser.add_argument("--images", required=True, help="Directory with the reference images")
+    parser.add_argument("--precision", choices=["auto", "bf16", "fp16"], default="auto", help="Precision to compare with fp32")
+    parser.add_argument("--sam-cpu", action="store_true", help="Run Segment Anything on CPU")
+    parser.add_argument("--mode", choices=["fp32", "auto", "bf16", "fp16"], default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--output", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_model(args.checkpoints[0], args.mode, args.images, args.sam_cpu, args.output)
+        return
+
+    import numpy as np
+
+    num_images = len(get_image_paths(args.images))
+    print(f"{'checkpoint':<24} {'precision':<9} {'generate [s]':>13} {'masks':>6} {'count drift':>12} {'mean IoU':>9} {'min IoU':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for sam_checkpoint in args.checkpoints:
+            results = {}
+            for precision in ["fp32", args.precision]:
+                output_path = os.path.join(tmp_dir, f"{precision}.npz")
+                cmd = [sys.executable, __file__, sam_checkpoint, "--images", args.images, "--mode", precision, "--output", output_path]
+                if args.sam_cpu:
+                    cmd.append("--sam-cpu")
+                result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+                results[precision] = (float(result.stdout.strip().splitlines()[-1]), np.load(output_path))
+
+            reference, other = results["fp32"][1], results[args.precision][1]
+            ious = []
+            reference_count = other_count = count_drift = 0
+            for image_index in range(num_images):
+                reference_masks = load_masks(reference, image_index)
+                masks = load_masks(other, image_index)
+                ious.extend(matched_ious(reference_masks, masks).tolist())
+                reference_count += len(reference_masks)
+                other_count += len(masks)
+                count_drift += abs(len(masks) - len(reference_masks))
+
+            name = os.path.basename(sam_checkpoint)
+            print(f"{name:<24} {'fp32':<9} {results['fp32'][0]:>13.3f} {reference_count:>6}")
+            iou_columns = f"{np.mean(ious):>9.4f} {np.min(ious):>8.4f}" if len(ious) > 0 else ""
+            print(f"{name:<24} {args.precision:<9} {results[args.precision][0]:>13.3f} {other_count:>6} {count_drift:>12} {iou_columns}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Verify the SDPA attention path of ImageEncoderViT against the eager path.
+
+Compares single attention layers (windowed 14x14 and global 64x64 with random
+relative positional embeddings) and, if a checkpoint is given, the whole image
+encoder. Reports the max abs difference and the time of each path.
+
+Usage:
+    python benchmarks/verify_sdpa_attention.py [--checkpoint models/sam_vit_b_01ec64.pth] [--device cuda]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..")))
+
+import torch  # noqa: E402
+
+from segment_anything_fb.modeling.image_encoder import Attention  # noqa: E402
+
+
+def timed(func, device, repeat=3):
+    func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        output = func()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return output, (time.perf_counter() - start_time) / repeat
+
+
+def compare(name, eager_func, sdpa_func, device, atol):
+    eager_output, eager_time = timed(eager_func, device)
+    sdpa_output, sdpa_time = timed(sdpa_func, device)
+    max_diff = (eager_output.float() - sdpa_output.float()).abs().max().item()
+    status = "OK" if max_diff <= atol else "FAIL"
+    print(f"{name:<28} max abs diff {max_diff:.2e} (atol {atol:.0e}) {status}  eager {eager_time * 1000:.1f}ms  sdpa {sdpa_time * 1000:.1f}ms")
+    return max_diff <= atol
+
+
+def verify_attention(dim, num_heads, size, device, dtype, atol):
+    torch.manual_seed(0)
+    eager_attn = Attention(dim, num_heads=num_heads, use_rel_pos=True, input_size=(size, size), attn_impl="eager")
+    with torch.no_grad():
+        eager_attn.rel_pos_h.normal_(std=0.02)
+        eager_attn.rel_pos_w.normal_(std=0.02)
+    sdpa_attn = Attention(dim, num_heads=num_heads, use_rel_pos=True, input_size=(size, size), attn_impl="sdpa")
+    sdpa_attn.load_state_dict(eager_attn.state_dict())
+    eager_attn.to(device=device, dtype=dtype).eval()
+    sdpa_attn.to(device=device, dtype=dtype).eval()
+
+    x = torch.randn(1, size, size, dim, device=device, dtype=dtype)
+    with torch.no_grad():
+        return compare(f"attention {size}x{size} {str(dtype)[6:]}", lambda: eager_attn(x), lambda: sdpa_attn(x), device, atol)
+
+
+def verify_encoder(sam_checkpoint, device, atol):
+    from ia_sam_manager import get_sam_backend
+
+    backend = get_sam_backend(sam_checkpoint)
+    build_sam = backend["model_registry"][backend["model_type"]]
+    eager_encoder = build_sam(checkpoint=sam_checkpoint, attn_impl="eager").image_encoder.to(device)
+    sdpa_encoder = build_sam(checkpoint=sam_checkpoint, attn_impl="sdpa").image_encoder.to(device)
+
+    def first(output):
+        return output[0] if isinstance(output, (list, tuple)) else output
+
+    torch.manual_seed(0)
+    x = torch.randn(1, 3, 1024, 1024, device=device)
+    with torch.no_grad():
+        return compare(f"encoder {os.path.basename(sam_checkpoint)}",
+                       lambda: first(eager_encoder(x)), lambda: first(sdpa_encoder(x)), device, atol)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify SDPA attention against the eager path")
+    parser.add_argument("--checkpoint", default=None, help="SAM ViT checkpoint to compare the whole image encoder")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="Device")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    ok = True
+    ok &= verify_attention(768, 12, 14, device, torch.float32, 1e-4)
+    ok &= verify_attention(768, 12, 64, device, torch.float32, 1e-4)
+    if device.type == "cuda":
+        ok &= verify_attention(1280, 16, 64, device, torch.float16, 1e-2)
+    if args.checkpoint is not None:
+        ok &= verify_encoder(args.checkpoint, device, 1e-3)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
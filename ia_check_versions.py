@@ -70,5 +70,12 @@ class IACheckVersions:
         else:
             return False
 
+    @cached_property
+    def onnxruntime_is_available(self):
+        if find_spec("onnxruntime") is not None and find_spec("onnx") is not None:
+            return True
+        else:
+            return False
+
 
 ia_check_versions = IACheckVersions()
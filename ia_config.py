@@ -1,6 +1,8 @@
+import atexit
 import configparser
 # import json
 import os
+import threading
 from types import SimpleNamespace
 
 from ia_ui_items import get_inp_model_ids, get_sam_model_ids
@@ -38,41 +40,117 @@ class IAConfig:
 ia_config = IAConfig()
 
 
-def setup_ia_config_ini():
-    ia_config_ini = configparser.ConfigParser(defaults={})
-    if os.path.isfile(IAConfig.PATHS.INI):
-        ia_config_ini.read(IAConfig.PATHS.INI, encoding="utf-8")
+class IAConfigStore:
+    """Thread-safe in-memory copy of ia_config.ini.
 
-    changed = False
-    for key, ids_info in ia_config.ids_dict.items():
-        if not ia_config_ini.has_option(IAConfig.SECTIONS.DEFAULT, key):
-            if len(ids_info["list"]) > ids_info["index"]:
-                ia_config_ini[IAConfig.SECTIONS.DEFAULT][key] = ids_info["list"][ids_info["index"]]
-                changed = True
-        else:
-            if len(ids_info["list"]) > ids_info["index"] and ia_config_ini[IAConfig.SECTIONS.DEFAULT][key] != ids_info["list"][ids_info["index"]]:
-                ia_config_ini[IAConfig.SECTIONS.DEFAULT][key] = ids_info["list"][ids_info["index"]]
-                changed = True
+    The file is parsed again only when its mtime changes. Writes update the
+    in-memory copy and are flushed to disk by a debounced background timer, so
+    reading and writing the config does not touch the disk on every request.
+    """
 
-    if changed:
-        with open(IAConfig.PATHS.INI, "w", encoding="utf-8") as f:
-            ia_config_ini.write(f)
+    FLUSH_DELAY = 1.0
 
+    def __init__(self, ini_path):
+        self.ini_path = ini_path
+        self._lock = threading.RLock()
+        self._config_ini = None
+        self._mtime_ns = None
+        self._dirty = False
+        self._flush_timer = None
+        atexit.register(self.flush)
 
-def get_ia_config(key, section=IAConfig.SECTIONS.DEFAULT):
-    setup_ia_config_ini()
+    def _get_mtime_ns(self):
+        try:
+            return os.stat(self.ini_path).st_mtime_ns
+        except OSError:
+            return None
 
-    ia_config_ini = configparser.ConfigParser(defaults={})
-    ia_config_ini.read(IAConfig.PATHS.INI, encoding="utf-8")
+    def _apply_defaults(self):
+        changed = False
+        for key, ids_info in ia_config.ids_dict.items():
+            if len(ids_info["list"]) > ids_info["index"]:
+                default_value = ids_info["list"][ids_info["index"]]
+                if (not self._config_ini.has_option(IAConfig.SECTIONS.DEFAULT, key) or
+                        self._config_ini[IAConfig.SECTIONS.DEFAULT][key] != default_value):
+                    self._config_ini[IAConfig.SECTIONS.DEFAULT][key] = default_value
+                    changed = True
+        return changed
+
+    def load(self):
+        """Get the parsed config, re-reading the file if it changed on disk.
+
+        Returns:
+            configparser.ConfigParser: parsed config
+        """
+        with self._lock:
+            mtime_ns = self._get_mtime_ns()
+            if self._config_ini is None or (not self._dirty and mtime_ns != self._mtime_ns):
+                self._config_ini = configparser.ConfigParser(defaults={})
+                if mtime_ns is not None:
+                    self._config_ini.read(self.ini_path, encoding="utf-8")
+                self._mtime_ns = mtime_ns
+                if self._apply_defaults():
+                    self._schedule_flush()
+            return self._config_ini
+
+    def get(self, key, section=IAConfig.SECTIONS.DEFAULT):
+        with self._lock:
+            config_ini = self.load()
+            if config_ini.has_option(section, key):
+                return config_ini[section][key]
+
+            section = IAConfig.SECTIONS.DEFAULT
+            if config_ini.has_option(section, key):
+                return config_ini[section][key]
+
+            return None
+
+    def set(self, key, value, section=IAConfig.SECTIONS.DEFAULT):
+        with self._lock:
+            config_ini = self.load()
+            if config_ini.has_option(section, key) and config_ini[section][key] == value:
+                return
+
+            if section != IAConfig.SECTIONS.DEFAULT and not config_ini.has_section(section):
+                config_ini[section] = {}
+
+            config_ini[section][key] = value
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        self._dirty = True
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+        self._flush_timer = threading.Timer(IAConfigStore.FLUSH_DELAY, self.flush)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def flush(self):
+        """Write pending changes to the file."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return
+
+            tmp_path = self.ini_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                self._config_ini.write(f)
+            os.replace(tmp_path, self.ini_path)
+            self._mtime_ns = self._get_mtime_ns()
+            self._dirty = False
+
+
+ia_config_store = IAConfigStore(IAConfig.PATHS.INI)
 
-    if ia_config_ini.has_option(section, key):
-        return ia_config_ini[section][key]
 
-    section = IAConfig.SECTIONS.DEFAULT
-    if ia_config_ini.has_option(section, key):
-        return ia_config_ini[section][key]
+def setup_ia_config_ini():
+    ia_config_store.load()
 
-    return None
+
+def get_ia_config(key, section=IAConfig.SECTIONS.DEFAULT):
+    return ia_config_store.get(key, section)
 
 
 def get_ia_config_index(key, section=IAConfig.SECTIONS.DEFAULT):
@@ -94,22 +172,4 @@ def get_ia_config_index(key, section=IAConfig.SECTIONS.DEFAULT):
 
 
 def set_ia_config(key, value, section=IAConfig.SECTIONS.DEFAULT):
-    setup_ia_config_ini()
-
-    ia_config_ini = configparser.ConfigParser(defaults={})
-    ia_config_ini.read(IAConfig.PATHS.INI, encoding="utf-8")
-
-    if ia_config_ini.has_option(section, key) and ia_config_ini[section][key] == value:
-        return
-
-    if section != IAConfig.SECTIONS.DEFAULT and not ia_config_ini.has_section(section):
-        ia_config_ini[section] = {}
-
-    try:
-        ia_config_ini[section][key] = value
-    except Exception:
-        ia_config_ini[section] = {}
-        ia_config_ini[section][key] = value
-
-    with open(IAConfig.PATHS.INI, "w", encoding="utf-8") as f:
-        ia_config_ini.write(f)
+    ia_config_store.set(key, value, section)
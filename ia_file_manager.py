@@ -1,6 +1,9 @@
+import json
 import os
+import threading
 from datetime import datetime
 from huggingface_hub import snapshot_download
+from huggingface_hub import constants as hf_constants
 from ia_logging import ia_logging
 
 
@@ -49,6 +52,168 @@ class IAFileManager:
 ia_file_manager = IAFileManager()
 
 
+class IAInpModelIndex:
+    """On-disk index of inpainting model repos in the HuggingFace cache.
+
+    The `models--{org}--{name}` directories of the cache are listed again only
+    when the mtime of the cache directory changed since the last refresh. Every
+    repo is stamped with the mtimes of its directory, its `refs/`, its
+    `snapshots/` and each snapshot directory, and is only inspected again when
+    its stamp changed. Downloads through `download_model_from_hf` update the
+    index directly.
+    """
+
+    INDEX_NAME = "inp_model_index.json"
+    FORMAT_VERSION = 2
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self._index = None
+        self._repo_ids = None
+
+    @property
+    def cache_dir(self) -> str:
+        """Get HuggingFace Hub cache directory.
+
+        Returns:
+            str: HuggingFace Hub cache directory
+        """
+        return getattr(hf_constants, "HF_HUB_CACHE", None) or hf_constants.HUGGINGFACE_HUB_CACHE
+
+    @property
+    def index_path(self) -> str:
+        """Get index file path.
+
+        Returns:
+            str: index file path
+        """
+        return os.path.join(ia_file_manager.models_dir, IAInpModelIndex.INDEX_NAME)
+
+    @staticmethod
+    def is_inpaint_repo(repo_id: str) -> bool:
+        return "inpaint" in repo_id.lower()
+
+    @staticmethod
+    def get_repo_stamp(repo_dir: str) -> list:
+        stamp = []
+        for dir_path in [repo_dir, os.path.join(repo_dir, "refs"), os.path.join(repo_dir, "snapshots")]:
+            try:
+                stamp.append(os.stat(dir_path).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        # Files added to an existing snapshot only change the mtime of the snapshot directory
+        if stamp[-1] is not None:
+            with os.scandir(os.path.join(repo_dir, "snapshots")) as it:
+                stamp.extend(sorted([dir_entry.name, dir_entry.stat().st_mtime_ns] for dir_entry in it if dir_entry.is_dir()))
+        return stamp
+
+    @staticmethod
+    def get_repo_entry(repo_dir: str, stamp: list) -> dict:
+        repo_id = os.path.basename(repo_dir)[len("models--"):].replace("--", "/")
+        snapshots_dir = os.path.join(repo_dir, "snapshots")
+        has_snapshot = os.path.isdir(snapshots_dir) and any(
+            dir_entry.is_dir() and len(os.listdir(dir_entry.path)) > 0 for dir_entry in os.scandir(snapshots_dir))
+        return dict(repo_id=repo_id, stamp=stamp, has_snapshot=has_snapshot)
+
+    def _read_index(self) -> dict:
+        index = dict(format_version=IAInpModelIndex.FORMAT_VERSION, cache_dir=self.cache_dir, cache_mtime_ns=None, repos={})
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    saved_index = json.load(f)
+                if (saved_index.get("format_version") == IAInpModelIndex.FORMAT_VERSION and
+                        saved_index.get("cache_dir") == self.cache_dir):
+                    index.update(saved_index)
+            except Exception as e:
+                ia_logging.warning(f"Failed to read {self.index_path}: {e}")
+        return index
+
+    def _write_index(self) -> None:
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._index, f, indent=2)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            ia_logging.warning(f"Failed to write {self.index_path}: {e}")
+
+    def _update_repo_ids(self) -> None:
+        repo_ids = [entry["repo_id"] for entry in self._index["repos"].values()
+                    if entry["has_snapshot"] and self.is_inpaint_repo(entry["repo_id"])]
+        self._repo_ids = sorted(repo_ids, reverse=True, key=lambda x: x.split("/")[-1])
+
+    def refresh(self) -> None:
+        """Refresh the index from the mtimes of the cache directories."""
+        with self.lock:
+            if self._index is None:
+                self._index = self._read_index()
+
+            try:
+                cache_mtime_ns = os.stat(self.cache_dir).st_mtime_ns
+            except OSError:
+                cache_mtime_ns = None
+            if cache_mtime_ns is None:
+                dir_names = []
+            elif cache_mtime_ns == self._index["cache_mtime_ns"]:
+                dir_names = list(self._index["repos"].keys())
+            else:
+                with os.scandir(self.cache_dir) as it:
+                    dir_names = [dir_entry.name for dir_entry in it
+                                 if dir_entry.name.startswith("models--") and dir_entry.is_dir()]
+
+            repos = {}
+            for dir_name in dir_names:
+                repo_dir = os.path.join(self.cache_dir, dir_name)
+                if not os.path.isdir(repo_dir):
+                    continue
+                stamp = self.get_repo_stamp(repo_dir)
+                entry = self._index["repos"].get(dir_name, None)
+                if entry is None or entry["stamp"] != stamp:
+                    entry = self.get_repo_entry(repo_dir, stamp)
+                repos[dir_name] = entry
+
+            changed = cache_mtime_ns != self._index["cache_mtime_ns"] or repos != self._index["repos"]
+            if changed or self._repo_ids is None:
+                self._index.update(cache_mtime_ns=cache_mtime_ns, repos=repos)
+                self._update_repo_ids()
+            if changed:
+                self._write_index()
+
+    def add(self, hf_model_id: str) -> None:
+        """Record a repo that was downloaded into the cache.
+
+        Args:
+            hf_model_id (str): HuggingFace model id
+        """
+        self.refresh()
+        dir_name = "models--" + hf_model_id.replace("/", "--")
+        repo_dir = os.path.join(self.cache_dir, dir_name)
+        if not os.path.isdir(repo_dir):
+            return
+        with self.lock:
+            entry = self.get_repo_entry(repo_dir, self.get_repo_stamp(repo_dir))
+            if self._index["repos"].get(dir_name, None) == entry:
+                return
+            self._index["repos"][dir_name] = entry
+            self._update_repo_ids()
+            self._write_index()
+
+    def get_repo_ids(self) -> list:
+        """Get the ids of the inpainting model repos in the cache.
+
+        The index is validated against the cache on every call, which only
+        stats the known repos unless the cache directory changed.
+
+        Returns:
+            list: model ids list
+        """
+        self.refresh()
+        return list(self._repo_ids)
+
+
+ia_inp_model_index = IAInpModelIndex()
+
+
 def download_model_from_hf(hf_model_id, local_files_only=False):
     """Download model from HuggingFace Hub.
 
@@ -68,4 +233,5 @@ def download_model_from_hf(hf_model_id, local_files_only=False):
     except Exception as e:
         return str(e)
 
+    ia_inp_model_index.add(hf_model_id)
     return IAFileManager.DOWNLOAD_COMPLETE
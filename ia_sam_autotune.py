@@ -0,0 +1,291 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+from ia_config import IAConfig, get_ia_config, set_ia_config
+from ia_file_manager import ia_file_manager
+from ia_logging import ia_logging
+
+
+class IASamAutotune:
+    """Per-machine CPU execution settings of SAM mask generators.
+
+    The best torch.set_num_threads, torch.set_num_interop_threads and
+    points_per_batch found by `python ia_sam_autotune.py` are stored in
+    ia_config.ini, in a section per machine keyed by SAM model ID and variant
+    (dtype and runtime, e.g. float32, qint8 or onnx-int8).
+    """
+
+    SECTION_PREFIX = "AUTOTUNE"
+    KEYS = ("num_threads", "interop_threads", "points_per_batch")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self._machine_id = None
+        self._applied_interop_threads = None
+
+    @property
+    def machine_id(self) -> str:
+        """Get an ID of this machine's CPU and torch build.
+
+        Returns:
+            str: machine ID
+        """
+        if self._machine_id is None:
+            cpu_name = platform.processor()
+            if os.path.isfile("/proc/cpuinfo"):
+                with open("/proc/cpuinfo", "r", encoding="utf-8", errors="ignore") as f:
+                    cpu_name = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu_name)
+            machine_info = "|".join([platform.system(), platform.machine(), cpu_name, str(os.cpu_count()), torch.__version__])
+            self._machine_id = f"{platform.machine()}-{os.cpu_count()}cpu-{hashlib.sha1(machine_info.encode()).hexdigest()[:8]}"
+        return self._machine_id
+
+    @property
+    def section(self) -> str:
+        """Get the config section of this machine.
+
+        Returns:
+            str: config section
+        """
+        return f"{IASamAutotune.SECTION_PREFIX}.{self.machine_id}"
+
+    @staticmethod
+    def get_key(sam_checkpoint: str, dtype: str) -> str:
+        return f"{os.path.basename(sam_checkpoint)}@{dtype}"
+
+    def get_settings(self, sam_checkpoint: str, dtype: str) -> dict:
+        """Get the tuned settings of a SAM model on this machine.
+
+        Args:
+            sam_checkpoint (str): SAM checkpoint path
+            dtype (str): model variant, as in the SAM model cache key
+
+        Returns:
+            dict or None: num_threads, interop_threads and points_per_batch
+        """
+        value = get_ia_config(self.get_key(sam_checkpoint, dtype), self.section)
+        if value is None:
+            return None
+        try:
+            settings = json.loads(value)
+        except ValueError:
+            ia_logging.warning(f"Invalid autotune settings for {os.path.basename(sam_checkpoint)}: {value}")
+            return None
+        if not isinstance(settings, dict):
+            return None
+        return {key: int(settings[key]) for key in IASamAutotune.KEYS if settings.get(key, None) is not None}
+
+    def save_settings(self, sam_checkpoint: str, dtype: str, settings: dict) -> None:
+        """Store the tuned settings of a SAM model on this machine.
+
+        Args:
+            sam_checkpoint (str): SAM checkpoint path
+            dtype (str): model variant, as in the SAM model cache key
+            settings (dict): num_threads, interop_threads and points_per_batch
+        """
+        value = json.dumps({key: int(settings[key]) for key in IASamAutotune.KEYS if key in settings}, sort_keys=True)
+        set_ia_config(self.get_key(sam_checkpoint, dtype), value, self.section)
+
+    @contextmanager
+    def threads(self, settings: dict):
+        """Run with the tuned thread counts, restoring the previous torch thread count afterwards.
+
+        The inter-op thread count can only be set before torch runs any
+        inter-op parallel work, so it is applied once and kept.
+
+        Args:
+            settings (dict): tuned settings
+        """
+        if settings is None:
+            yield
+            return
+
+        previous_num_threads = torch.get_num_threads()
+        with self.lock:
+            num_threads = settings.get("num_threads", None)
+            if num_threads is not None and previous_num_threads != num_threads:
+                ia_logging.info(f"Setting torch CPU threads to {num_threads} (autotuned)")
+                torch.set_num_threads(num_threads)
+
+            interop_threads = settings.get("interop_threads", None)
+            if (interop_threads is not None and self._applied_interop_threads is None and
+                    torch.get_num_interop_threads() != interop_threads):
+                try:
+                    torch.set_num_interop_threads(interop_threads)
+                    ia_logging.info(f"Setting torch inter-op threads to {interop_threads} (autotuned)")
+                except RuntimeError as e:
+                    ia_logging.warning(f"Failed to set torch inter-op threads to {interop_threads}: {e}")
+            self._applied_interop_threads = torch.get_num_interop_threads()
+
+        try:
+            yield
+        finally:
+            if torch.get_num_threads() != previous_num_threads:
+                torch.set_num_threads(previous_num_threads)
+
+
+ia_sam_autotune = IASamAutotune()
+
+
+def create_synthetic_image(image_size: int, seed: int = 0):
+    """Create a synthetic RGB image with random shapes on a gradient background.
+
+    Args:
+        image_size (int): long side of the image
+        seed (int): random seed
+
+    Returns:
+        np.ndarray: image in HWC uint8 format
+    """
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    height, width = image_size * 3 // 4, image_size
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    image = np.broadcast_to(gradient * rng.uniform(0.2, 1.0, size=(1, 1, 3)), (height, width, 3)).astype(np.uint8).copy()
+    for _ in range(24):
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        size = int(rng.integers(image_size // 32, image_size // 6))
+        if rng.random() < 0.5:
+            cv2.circle(image, center, size, color, thickness=-1)
+        else:
+            cv2.rectangle(image, center, (center[0] + size, center[1] + size * 2 // 3), color, thickness=-1)
+    return image
+
+
+def run_trial(sam_checkpoint: str, num_threads: int, interop_threads: int, points_per_batch_list: list,
+              image_size: int, repeat: int, sam_int8: bool = False) -> None:
+    """Time SamAutomaticMaskGenerator.generate for each points_per_batch and print the results as JSON lines.
+
+    Runs in a fresh subprocess, since the inter-op thread count is fixed once torch has started,
+    so the thread counts set here do not leak into any other process.
+    """
+    torch.set_num_interop_threads(interop_threads)
+    torch.set_num_threads(num_threads)
+    torch.set_grad_enabled(False)
+
+    from ia_sam_manager import get_sam_backend, get_sam_model
+
+    IAConfig.global_args.update(sam_cpu=True, sam_int8=sam_int8, sam_autotune=False)
+    backend = get_sam_backend(sam_checkpoint)
+    sam = get_sam_model(sam_checkpoint)
+    image = create_synthetic_image(image_size)
+
+    for points_per_batch in points_per_batch_list:
+        sam_mask_generator = backend["mask_generator"](
+            model=sam, points_per_batch=points_per_batch if backend["points_per_batch"] is not None else None,
+            pred_iou_thresh=0.88, stability_score_thresh=0.95)
+        sam_mask_generator.generate(image)
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            sam_mask_generator.generate(image)
+        elapsed = (time.perf_counter() - start_time) / repeat
+        print(json.dumps(dict(num_threads=num_threads, interop_threads=interop_threads,
+                              points_per_batch=points_per_batch, time=elapsed)), flush=True)
+
+
+def autotune_sam_model(sam_checkpoint: str, num_threads_list: list, interop_threads_list: list,
+                       points_per_batch_list: list, image_size: int = 1024, repeat: int = 1, sam_int8: bool = False) -> dict:
+    """Find the fastest CPU settings of a SAM model on this machine and store them in the config.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        num_threads_list (list): candidate torch.set_num_threads values
+        interop_threads_list (list): candidate torch.set_num_interop_threads values
+        points_per_batch_list (list): candidate points_per_batch values
+        image_size (int): long side of the synthetic image
+        repeat (int): timed runs per setting
+        sam_int8 (bool): tune the int8 dynamic quantized model (--sam-int8)
+
+    Returns:
+        dict or None: best settings and their time per image
+    """
+    from ia_sam_manager import get_sam_backend, get_sam_variant
+
+    IAConfig.global_args.update(sam_cpu=True, sam_int8=sam_int8, sam_autotune=False)
+    dtype = get_sam_variant(sam_checkpoint)["dtype"]
+    if get_sam_backend(sam_checkpoint)["predictor"] is None:
+        # FastSAM does not use points_per_batch, only the thread counts are tuned
+        points_per_batch_list = points_per_batch_list[:1]
+
+    results = []
+    for interop_threads in interop_threads_list:
+        for num_threads in num_threads_list:
+            cmd = [sys.executable, __file__, os.path.basename(sam_checkpoint), "--trial",
+                   "--num-threads", str(num_threads), "--interop-threads", str(interop_threads),
+                   "--points-per-batch", ",".join(str(v) for v in points_per_batch_list),
+                   "--image-size", str(image_size), "--repeat", str(repeat)] + (["--sam-int8"] if sam_int8 else [])
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode != 0:
+                error = proc.stderr.strip().splitlines()[-1] if len(proc.stderr.strip()) > 0 else f"exit code {proc.returncode}"
+                ia_logging.warning(f"Autotune trial failed ({num_threads} threads, {interop_threads} inter-op): {error}")
+                continue
+            for line in proc.stdout.splitlines():
+                if line.startswith("{"):
+                    result = json.loads(line)
+                    ia_logging.info(f"{os.path.basename(sam_checkpoint)}: threads={result['num_threads']} "
+                                    f"interop={result['interop_threads']} points_per_batch={result['points_per_batch']} "
+                                    f"{result['time']:.2f}s/image")
+                    results.append(result)
+
+    if len(results) == 0:
+        return None
+
+    best = min(results, key=lambda x: x["time"])
+    ia_sam_autotune.save_settings(sam_checkpoint, dtype, best)
+    return best
+
+
+def parse_int_list(value: str) -> list:
+    return [int(v) for v in value.split(",") if len(v.strip()) > 0]
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    default_threads = sorted(set([v for v in (1, 2, 4, 8, 16, 32, 64) if v < cpu_count] + [cpu_count]))
+    default_interop = sorted(set([v for v in (1, 2, 4) if v <= cpu_count]))
+
+    parser = argparse.ArgumentParser(description="Tune the CPU thread counts and points_per_batch of SAM models on this machine")
+    parser.add_argument("sam_model_ids", nargs="*", help="SAM model IDs to tune (default: all downloaded)")
+    parser.add_argument("--num-threads", type=parse_int_list, default=default_threads, help="Comma separated torch threads to try")
+    parser.add_argument("--interop-threads", type=parse_int_list, default=default_interop, help="Comma separated inter-op threads to try")
+    parser.add_argument("--points-per-batch", type=parse_int_list, default=[16, 32, 64, 128], help="Comma separated points_per_batch to try")
+    parser.add_argument("--image-size", type=int, default=1024, help="Long side of the synthetic image")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per setting")
+    parser.add_argument("--sam-int8", action="store_true", help="Tune with int8 dynamic quantization (--sam-int8).")
+    parser.add_argument("--trial", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial:
+        run_trial(os.path.join(ia_file_manager.models_dir, args.sam_model_ids[0]), args.num_threads[0], args.interop_threads[0],
+                  args.points_per_batch, args.image_size, args.repeat, args.sam_int8)
+        return
+
+    from ia_ui_items import get_sam_model_ids
+
+    sam_model_ids = args.sam_model_ids if len(args.sam_model_ids) > 0 else get_sam_model_ids()
+    for sam_model_id in sam_model_ids:
+        sam_checkpoint = os.path.join(ia_file_manager.models_dir, sam_model_id)
+        if not os.path.isfile(sam_checkpoint):
+            continue
+        ia_logging.info(f"Autotuning {sam_model_id} on {ia_sam_autotune.machine_id}")
+        best = autotune_sam_model(sam_checkpoint, args.num_threads, args.interop_threads, args.points_per_batch,
+                                  args.image_size, args.repeat, args.sam_int8)
+        if best is not None:
+            ia_logging.info(f"Best for {sam_model_id}: threads={best['num_threads']} interop={best['interop_threads']} "
+                            f"points_per_batch={best['points_per_batch']} ({best['time']:.2f}s/image)")
+
+
+if __name__ == "__main__":
+    main()
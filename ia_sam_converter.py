@@ -0,0 +1,386 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import sys
+import threading
+from functools import lru_cache
+
+import torch
+
+from ia_file_manager import ia_file_manager
+from ia_logging import ia_logging
+
+
+class IASamConverter:
+    FORMAT_VERSION = 1
+    DIR_NAME = "fast_checkpoints"
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+
+    @property
+    def fast_checkpoints_dir(self) -> str:
+        """Get fast checkpoints directory.
+
+        Returns:
+            str: fast checkpoints directory
+        """
+        fast_checkpoints_dir = os.path.join(ia_file_manager.models_dir, IASamConverter.DIR_NAME)
+        if not os.path.isdir(fast_checkpoints_dir):
+            os.makedirs(fast_checkpoints_dir, exist_ok=True)
+        return fast_checkpoints_dir
+
+    @property
+    def manifest_path(self) -> str:
+        """Get manifest file path.
+
+        Returns:
+            str: manifest file path
+        """
+        return os.path.join(self.fast_checkpoints_dir, IASamConverter.MANIFEST_NAME)
+
+    def read_manifest(self) -> dict:
+        """Read the manifest of converted checkpoints.
+
+        Returns:
+            dict: manifest with "sources" (checkpoint stat -> hash) and "artifacts" (hash -> artifacts)
+        """
+        manifest = dict(sources={}, artifacts={})
+        if os.path.isfile(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    manifest.update(json.load(f))
+            except Exception as e:
+                ia_logging.warning(f"Failed to read {self.manifest_path}: {e}")
+        return manifest
+
+    def write_manifest(self, manifest: dict) -> None:
+        """Write the manifest of converted checkpoints.
+
+        Args:
+            manifest (dict): manifest
+        """
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+
+ia_sam_converter = IASamConverter()
+
+
+def get_file_hash(file_path, chunk_size=16 * 1024 * 1024):
+    """Get SHA-256 hash of a file.
+
+    Args:
+        file_path (str): file path
+        chunk_size (int, optional): read chunk size. Defaults to 16 MB.
+
+    Returns:
+        str: hex digest
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_backend_code_hash(package_name):
+    """Get a hash of the source code of a SAM backend package.
+
+    Converted checkpoints pickle the model modules, so they are only valid for
+    the code they were created with.
+
+    Args:
+        package_name (str): backend package name
+
+    Returns:
+        str: hex digest
+    """
+    package_dir = os.path.dirname(sys.modules[package_name].__file__)
+    sha256 = hashlib.sha256()
+    for root, dirs, files in os.walk(package_dir):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name.endswith(".py"):
+                with open(os.path.join(root, file_name), "rb") as f:
+                    sha256.update(f.read())
+    return sha256.hexdigest()
+
+
+def get_source_key(sam_checkpoint):
+    """Get the manifest key of a source checkpoint from its path, size and mtime.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        str: source key
+    """
+    stat = os.stat(sam_checkpoint)
+    return f"{os.path.realpath(sam_checkpoint)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def get_target_dtype(device):
+    """Get the image encoder dtype of converted checkpoints for a device.
+
+    Args:
+        device (torch.device): target device
+
+    Returns:
+        torch.dtype: fp16/bf16 for CUDA, fp32 otherwise
+    """
+    if torch.device(device).type == "cuda":
+        if torch.cuda.is_available() and torch.cuda.is_bf16_supported():
+            return torch.bfloat16
+        return torch.float16
+    return torch.float32
+
+
+def get_artifact_key(device, quantized=False):
+    """Get the manifest key of a converted artifact.
+
+    Args:
+        device (torch.device): target device
+        quantized (bool, optional): int8 dynamic quantized artifact. Defaults to False.
+
+    Returns:
+        str: artifact key
+    """
+    dtype = "qint8" if quantized else str(get_target_dtype(device)).replace("torch.", "")
+    return f"{torch.device(device).type}-{dtype}"
+
+
+def get_backend_package(backend):
+    """Get the package name of a SAM backend.
+
+    Args:
+        backend (dict): SAM backend information
+
+    Returns:
+        str: package name
+    """
+    build_sam = backend["model_registry"][backend["model_type"]]
+    return build_sam.__module__.split(".")[0]
+
+
+def fuse_conv_bn(model):
+    """Fuse TinyViT Conv2d_BN modules into single convolutions.
+
+    Args:
+        model (torch.nn.Module): model
+
+    Returns:
+        int: number of fused modules
+    """
+    from mobile_sam.modeling.tiny_vit_sam import Conv2d_BN
+
+    fused_count = 0
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, Conv2d_BN):
+                setattr(module, name, child.fuse())
+                fused_count += 1
+    return fused_count
+
+
+def quantize_sam_model(sam):
+    """Apply int8 dynamic quantization to the Linear layers of the image encoder and mask decoder.
+
+    The mask decoder includes its two-way transformer. Weights are stored in int8
+    and activations are quantized on the fly, which only runs on CPU.
+
+    Args:
+        sam (torch.nn.Module): SAM model on CPU
+
+    Returns:
+        torch.nn.Module: quantized SAM model
+    """
+    quantization = getattr(torch, "ao", torch).quantization
+    for name in ["image_encoder", "mask_decoder"]:
+        module = getattr(sam, name)
+        quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return sam
+
+
+def _cast_encoder_input(module, args):
+    dtype = next(module.parameters()).dtype
+    return tuple(arg.to(dtype) if torch.is_tensor(arg) and arg.is_floating_point() else arg for arg in args)
+
+
+def _cast_to_float32(output):
+    if torch.is_tensor(output):
+        return output.float()
+    elif isinstance(output, (list, tuple)):
+        return type(output)(_cast_to_float32(item) for item in output)
+    return output
+
+
+def _cast_encoder_output(module, args, output):
+    return _cast_to_float32(output)
+
+
+def register_encoder_dtype_hooks(sam):
+    """Cast the inputs of a reduced precision image encoder to its dtype, and its outputs back to fp32.
+
+    Args:
+        sam (torch.nn.Module): SAM model
+    """
+    image_encoder = sam.image_encoder
+    if next(image_encoder.parameters()).dtype != torch.float32:
+        image_encoder.register_forward_pre_hook(_cast_encoder_input)
+        image_encoder.register_forward_hook(_cast_encoder_output)
+
+
+def convert_sam_checkpoint(sam_checkpoint, backend, device, quantized=False):
+    """Convert a SAM checkpoint into an inference-ready fast checkpoint.
+
+    The converted model is built and loaded once, has its image encoder cast to the
+    target dtype (or its Linear layers quantized to int8), has eval-mode buffers
+    computed and, for MobileSAM, has Conv2d_BN modules fused. The whole module is
+    saved so later loads skip building the model.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        backend (dict): SAM backend information
+        device (torch.device): target device
+        quantized (bool, optional): int8 dynamic quantization, CPU only. Defaults to False.
+
+    Returns:
+        str or None: converted checkpoint path
+    """
+    if backend["predictor"] is None:
+        ia_logging.info(f"Skipping conversion of {os.path.basename(sam_checkpoint)} (not supported)")
+        return None
+
+    if quantized and torch.device(device).type != "cpu":
+        raise ValueError("int8 dynamic quantization is only supported on CPU")
+
+    source_hash = get_file_hash(sam_checkpoint)
+    artifact_key = get_artifact_key(device, quantized)
+    package_name = get_backend_package(backend)
+    dtype = get_target_dtype(device)
+
+    ia_logging.info(f"Converting {os.path.basename(sam_checkpoint)} ({artifact_key})")
+    sam = backend["model_registry"][backend["model_type"]](checkpoint=sam_checkpoint)
+    fused_count = fuse_conv_bn(sam) if package_name == "mobile_sam" else 0
+    sam.image_encoder.to(dtype=dtype)
+    sam.eval()
+    if quantized:
+        quantize_sam_model(sam)
+
+    stem = os.path.splitext(os.path.basename(sam_checkpoint))[0]
+    artifact_name = f"{stem}.{artifact_key}.pt"
+    artifact_path = os.path.join(ia_sam_converter.fast_checkpoints_dir, artifact_name)
+    torch.save(sam, artifact_path + ".tmp")
+    os.replace(artifact_path + ".tmp", artifact_path)
+
+    with ia_sam_converter.lock:
+        manifest = ia_sam_converter.read_manifest()
+        manifest["sources"][get_source_key(sam_checkpoint)] = source_hash
+        artifacts = manifest["artifacts"].setdefault(source_hash, {})
+        artifacts[artifact_key] = dict(
+            file=artifact_name,
+            source=os.path.basename(sam_checkpoint),
+            dtype="qint8" if quantized else str(dtype).replace("torch.", ""),
+            fused_conv_bn=fused_count,
+            format_version=IASamConverter.FORMAT_VERSION,
+            torch_version=torch.__version__,
+            code_hash=get_backend_code_hash(package_name),
+        )
+        ia_sam_converter.write_manifest(manifest)
+
+    return artifact_path
+
+
+def find_fast_checkpoint(sam_checkpoint, backend, device, quantized=False):
+    """Find a converted checkpoint that is valid for a source checkpoint.
+
+    Only the manifest is read; the source checkpoint is not hashed again.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        backend (dict): SAM backend information
+        device (torch.device): target device
+        quantized (bool, optional): int8 dynamic quantized artifact. Defaults to False.
+
+    Returns:
+        dict or None: manifest entry with the artifact "path" added
+    """
+    if backend["predictor"] is None or not os.path.isfile(ia_sam_converter.manifest_path):
+        return None
+
+    manifest = ia_sam_converter.read_manifest()
+    source_hash = manifest["sources"].get(get_source_key(sam_checkpoint), None)
+    if source_hash is None:
+        return None
+    entry = manifest["artifacts"].get(source_hash, {}).get(get_artifact_key(device, quantized), None)
+    if entry is None:
+        return None
+
+    if (entry.get("format_version") != IASamConverter.FORMAT_VERSION or
+            entry.get("torch_version") != torch.__version__ or
+            entry.get("code_hash") != get_backend_code_hash(get_backend_package(backend))):
+        ia_logging.info(f"Converted checkpoint of {os.path.basename(sam_checkpoint)} is outdated, please convert again")
+        return None
+
+    artifact_path = os.path.join(ia_sam_converter.fast_checkpoints_dir, entry["file"])
+    if not os.path.isfile(artifact_path):
+        return None
+
+    return dict(entry, path=artifact_path)
+
+
+def load_fast_checkpoint(artifact_path):
+    """Load a converted checkpoint.
+
+    Args:
+        artifact_path (str): converted checkpoint path
+
+    Returns:
+        torch.nn.Module: SAM model
+    """
+    load_kwargs = dict(map_location=torch.device("cpu"))
+    load_parameters = inspect.signature(torch.load).parameters
+    if "mmap" in load_parameters:
+        load_kwargs["mmap"] = True
+    if "weights_only" in load_parameters:
+        load_kwargs["weights_only"] = False
+    sam = torch.load(artifact_path, **load_kwargs)
+    register_encoder_dtype_hooks(sam)
+    return sam
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert SAM checkpoints in the models directory into fast checkpoints")
+    parser.add_argument("sam_model_ids", nargs="*", help="SAM model IDs to convert (default: all downloaded)")
+    parser.add_argument("--device", default=None, help="Target device type, e.g. cuda or cpu (default: SAM device)")
+    parser.add_argument("--sam-cpu", action="store_true", help="Convert for running Segment Anything on CPU.")
+    parser.add_argument("--sam-int8", action="store_true", help="Convert with int8 dynamic quantization (CPU only).")
+    args = parser.parse_args()
+
+    from ia_config import IAConfig
+    from ia_sam_manager import get_sam_backend, get_sam_device
+    from ia_ui_items import get_sam_model_ids
+
+    IAConfig.global_args.update(sam_cpu=args.sam_cpu, sam_int8=args.sam_int8)
+
+    sam_model_ids = args.sam_model_ids if len(args.sam_model_ids) > 0 else get_sam_model_ids()
+    for sam_model_id in sam_model_ids:
+        sam_checkpoint = os.path.join(ia_file_manager.models_dir, sam_model_id)
+        if not os.path.isfile(sam_checkpoint):
+            continue
+        device = torch.device(args.device) if args.device is not None else get_sam_device(sam_checkpoint)
+        quantized = args.sam_int8 and device.type == "cpu"
+        artifact_path = convert_sam_checkpoint(sam_checkpoint, get_sam_backend(sam_checkpoint), device, quantized)
+        if artifact_path is not None:
+            ia_logging.info(f"Converted {sam_model_id} -> {artifact_path}")
+
+
+if __name__ == "__main__":
+    main()
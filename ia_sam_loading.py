@@ -0,0 +1,111 @@
+import inspect
+from contextlib import contextmanager
+from typing import Any, Dict
+
+import torch
+from torch.overrides import TorchFunctionMode
+
+_INIT_FUNCTION_NAMES = (
+    "uniform_",
+    "normal_",
+    "trunc_normal_",
+    "constant_",
+    "ones_",
+    "zeros_",
+    "xavier_uniform_",
+    "xavier_normal_",
+    "kaiming_uniform_",
+    "kaiming_normal_",
+)
+# Initializers reimplemented outside torch.nn.init (e.g. timm's trunc_normal_)
+# end up in these in-place random fills
+_SKIPPED_FUNCTIONS = frozenset(
+    [getattr(torch.nn.init, name) for name in _INIT_FUNCTION_NAMES if hasattr(torch.nn.init, name)] +
+    [torch.Tensor.uniform_, torch.Tensor.normal_]
+)
+
+
+class SkipInitMode(TorchFunctionMode):
+    """Torch function mode that turns parameter initializers into no-ops.
+
+    Torch function modes are thread-local, so modules built by other threads
+    at the same time are initialized as usual.
+    """
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = {} if kwargs is None else kwargs
+        if func in _SKIPPED_FUNCTIONS:
+            return args[0] if len(args) > 0 else kwargs["tensor"]
+        return func(*args, **kwargs)
+
+
+@contextmanager
+def skip_init(enabled=True):
+    """Skip random parameter initialization while building a model whose weights are loaded afterwards.
+
+    Parameters stay allocated but are never written, so their pages are not
+    touched before the real weights are assigned.
+
+    Args:
+        enabled (bool, optional): skip initialization. Defaults to True.
+    """
+    if not enabled:
+        yield
+        return
+    with SkipInitMode():
+        yield
+
+
+def load_checkpoint(checkpoint, map_location=None) -> Dict[str, torch.Tensor]:
+    """Load a checkpoint state dict, memory-mapped when supported (torch>=2.1).
+
+    Memory-mapped tensors are backed by the page cache instead of being read
+    into a fresh heap copy.
+
+    Args:
+        checkpoint (str): checkpoint path
+        map_location (Any, optional): map_location of torch.load. Defaults to None.
+
+    Returns:
+        dict: state dict
+    """
+    load_kwargs = dict(map_location=map_location)
+    if "mmap" in inspect.signature(torch.load).parameters:
+        load_kwargs["mmap"] = True
+    try:
+        return torch.load(checkpoint, **load_kwargs)
+    except RuntimeError:
+        if not load_kwargs.pop("mmap", False):
+            raise
+        # Legacy (non-zipfile) checkpoints cannot be memory-mapped
+        return torch.load(checkpoint, **load_kwargs)
+
+
+def load_state_dict(model: torch.nn.Module, state_dict: Dict[str, torch.Tensor], strict=True) -> Any:
+    """Load a state dict into a model built with skip_init.
+
+    Tensors are assigned to the model without copying when supported
+    (torch>=2.1). Modules with parameters missing from a non-strict load are
+    initialized as usual.
+
+    Args:
+        model (torch.nn.Module): model
+        state_dict (dict): state dict
+        strict (bool, optional): strict of load_state_dict. Defaults to True.
+
+    Returns:
+        Any: missing and unexpected keys
+    """
+    if "assign" in inspect.signature(model.load_state_dict).parameters:
+        incompatible_keys = model.load_state_dict(state_dict, strict=strict, assign=True)
+    else:
+        incompatible_keys = model.load_state_dict(state_dict, strict=strict)
+
+    missing_keys = set(incompatible_keys.missing_keys)
+    if len(missing_keys) > 0:
+        for name, module in model.named_modules():
+            prefix = name + "." if name else ""
+            own_keys = {prefix + n for n, _ in module.named_parameters(recurse=False)}
+            if own_keys & missing_keys and hasattr(module, "reset_parameters"):
+                module.reset_parameters()
+    return incompatible_keys
@@ -1,71 +1,472 @@
+import importlib
 import os
 import platform
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
 
 import torch
 
-from fast_sam import FastSamAutomaticMaskGenerator, fast_sam_model_registry
 from ia_check_versions import ia_check_versions
 from ia_config import IAConfig
 from ia_devices import devices
 from ia_logging import ia_logging
-from mobile_sam import SamAutomaticMaskGenerator as SamAutomaticMaskGeneratorMobile
-from mobile_sam import SamPredictor as SamPredictorMobile
-from mobile_sam import sam_model_registry as sam_model_registry_mobile
-from segment_anything_fb import SamAutomaticMaskGenerator, SamPredictor, sam_model_registry
-from segment_anything_hq import SamAutomaticMaskGenerator as SamAutomaticMaskGeneratorHQ
-from segment_anything_hq import SamPredictor as SamPredictorHQ
-from segment_anything_hq import sam_model_registry as sam_model_registry_hq
+from ia_sam_autotune import ia_sam_autotune
+from ia_sam_converter import convert_sam_checkpoint, find_fast_checkpoint, load_fast_checkpoint
+from ia_sam_loading import load_checkpoint, load_state_dict, skip_init
+from ia_sam_onnx import load_sam_onnx
+from ia_sam_precision import apply_sam_precision, get_autocast_dtype
+from ia_sam_shared_encoder import IMAGE_ENCODER_PREFIX, shared_encoder_registry
 
 
-def get_sam_mask_generator(sam_checkpoint, anime_style_chk=False):
+class SamModelCache:
+    """Process-wide LRU cache of loaded SAM models.
+
+    Models are keyed by (checkpoint, device, dtype). Entries are evicted in
+    least-recently-used order when the total size of the models placed on the
+    same kind of device exceeds its budget (RAM for CPU, VRAM otherwise).
+    The most recently used model is always kept, even if it exceeds the budget.
+
+    Models that are still referenced elsewhere (e.g. by a predictor) are also
+    tracked weakly, so an evicted model that is still alive is handed out again
+    instead of being loaded a second time.
+    """
+
+    DEFAULT_RAM_BUDGET_MB = 8192
+    DEFAULT_VRAM_BUDGET_MB = 8192
+
+    def __init__(self):
+        self._models = OrderedDict()
+        self._live_models = weakref.WeakValueDictionary()
+        self._loading = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_budget_mb(device_type):
+        """Get the cache budget for a device type.
+
+        Args:
+            device_type (str): torch device type
+
+        Returns:
+            int: cache budget in MB
+        """
+        if device_type == "cpu":
+            budget_mb = IAConfig.global_args.get("sam_cache_ram_mb", None)
+            return SamModelCache.DEFAULT_RAM_BUDGET_MB if budget_mb is None else int(budget_mb)
+        else:
+            budget_mb = IAConfig.global_args.get("sam_cache_vram_mb", None)
+            return SamModelCache.DEFAULT_VRAM_BUDGET_MB if budget_mb is None else int(budget_mb)
+
+    @staticmethod
+    def get_model_size(model, checkpoint, seen_tensors=None):
+        """Get the memory footprint of a model.
+
+        Args:
+            model (Any): loaded model
+            checkpoint (str): checkpoint path, used when the model is not a torch module
+            seen_tensors (set, optional): data pointers of tensors already counted, updated in place
+
+        Returns:
+            int: size in bytes
+        """
+        seen_tensors = set() if seen_tensors is None else seen_tensors
+        module = model if isinstance(model, torch.nn.Module) else getattr(getattr(model, "model", None), "model", None)
+        if isinstance(module, torch.nn.Module):
+            size = 0
+            for tensor in list(module.parameters()) + list(module.buffers()):
+                if tensor.data_ptr() not in seen_tensors:
+                    seen_tensors.add(tensor.data_ptr())
+                    size += tensor.numel() * tensor.element_size()
+            return size
+        return os.path.getsize(checkpoint) if os.path.isfile(checkpoint) else 0
+
+    def get_total_size(self, keys):
+        """Get the memory footprint of cached models, counting shared tensors once.
+
+        Args:
+            keys (list): cache keys
+
+        Returns:
+            int: size in bytes
+        """
+        seen_tensors = set()
+        return sum(self.get_model_size(self._models[k], k[0], seen_tensors) for k in keys)
+
+    def get(self, key, loader):
+        """Get a model from the cache, loading it on a miss.
+
+        The loader runs outside the cache lock, so models that are already
+        cached are handed out while another model loads. Concurrent callers
+        for the same key wait for a single load.
+
+        Args:
+            key (tuple): (checkpoint, device, dtype)
+            loader (Callable[[], Any]): function that loads the model
+
+        Returns:
+            Any: loaded model
+        """
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key]
+
+            model = self._live_models.get(key, None)
+            if model is not None:
+                self.hits += 1
+                self._models[key] = model
+                self._evict(torch.device(key[1]).type)
+                return model
+
+            future = self._loading.get(key, None)
+            if future is None:
+                self.misses += 1
+                future = self._loading[key] = Future()
+                is_loading = True
+            else:
+                self.hits += 1
+                is_loading = False
+
+        if not is_loading:
+            return future.result()
+
+        try:
+            model = loader()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._loading[key]
+            self._live_models[key] = model
+            self._models[key] = model
+            self._evict(torch.device(key[1]).type)
+        future.set_result(model)
+        return model
+
+    def _evict(self, device_type):
+        budget = self.get_budget_mb(device_type) * 1024 * 1024
+        keys = [k for k in self._models.keys() if torch.device(k[1]).type == device_type]
+        while len(keys) > 1 and self.get_total_size(keys) > budget:
+            key = keys.pop(0)
+            del self._models[key]
+            self.evictions += 1
+            ia_logging.info(f"Evicted SAM model from cache: {os.path.basename(key[0])} ({key[1]})")
+
+    def clear(self):
+        """Remove all models from the cache."""
+        with self._lock:
+            self._models.clear()
+
+    def stats(self):
+        """Get cache counters.
+
+        Returns:
+            dict: hits, misses, evictions, number of entries and total size in MB
+        """
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                entries=len(self._models),
+                size_mb=self.get_total_size(list(self._models.keys())) / (1024 * 1024),
+            )
+
+
+sam_model_cache = SamModelCache()
+
+
+# Backends are matched in order against the checkpoint file name; the package of
+# a backend is only imported the first time one of its checkpoints is used.
+SAM_BACKENDS = [
+    dict(pattern="_hq_", package="segment_anything_hq", model_registry="sam_model_registry",
+         mask_generator="SamAutomaticMaskGenerator", predictor="SamPredictor",
+         model_type=lambda sam_basename: sam_basename[7:12], points_per_batch=32),
+    dict(pattern="FastSAM", package="fast_sam", model_registry="fast_sam_model_registry",
+         mask_generator="FastSamAutomaticMaskGenerator", predictor=None,
+         model_type=lambda sam_basename: os.path.splitext(sam_basename)[0], points_per_batch=None),
+    dict(pattern="mobile_sam", package="mobile_sam", model_registry="sam_model_registry",
+         mask_generator="SamAutomaticMaskGenerator", predictor="SamPredictor",
+         model_type=lambda sam_basename: "vit_t", points_per_batch=64),
+    dict(pattern="", package="segment_anything_fb", model_registry="sam_model_registry",
+         mask_generator="SamAutomaticMaskGenerator", predictor="SamPredictor",
+         model_type=lambda sam_basename: sam_basename[4:9], points_per_batch=64),
+]
+
+
+def get_sam_backend(sam_checkpoint):
+    """Get SAM backend information from the checkpoint name.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        dict: model_type, model_registry, mask_generator, predictor and points_per_batch
+    """
+    sam_basename = os.path.basename(sam_checkpoint)
+    sam_backend = next(sam_backend for sam_backend in SAM_BACKENDS if sam_backend["pattern"] in sam_basename)
+
+    package = importlib.import_module(sam_backend["package"])
+    return dict(
+        model_type=sam_backend["model_type"](sam_basename),
+        model_registry=getattr(package, sam_backend["model_registry"]),
+        mask_generator=getattr(package, sam_backend["mask_generator"]),
+        predictor=getattr(package, sam_backend["predictor"]) if sam_backend["predictor"] is not None else None,
+        points_per_batch=sam_backend["points_per_batch"],
+    )
+
+
+def get_sam_device(sam_checkpoint):
+    """Get the device SAM runs on.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        torch.device: device
+    """
+    if platform.system() == "Darwin":
+        if "FastSAM" in os.path.basename(sam_checkpoint) or not ia_check_versions.torch_mps_is_available:
+            return torch.device("cpu")
+        else:
+            return torch.device("mps")
+    else:
+        if IAConfig.global_args.get("sam_cpu", False):
+            ia_logging.info("SAM is running on CPU... (the option has been selected)")
+            return devices.cpu
+        else:
+            return devices.device
+
+
+def set_sam_attn_impl(sam, attn_impl):
+    """Set the attention implementation of the ViT image encoder of a SAM model.
+
+    Args:
+        sam (torch.nn.Module): SAM model
+        attn_impl (str): "eager" or "sdpa"
+
+    Returns:
+        bool: True if the attention implementation was set
+    """
+    if attn_impl == "sdpa" and not hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+        ia_logging.warning("scaled_dot_product_attention is not available, SAM runs with eager attention")
+        return False
+
+    modules = [module for module in sam.modules() if hasattr(module, "attn_impl")]
+    for module in modules:
+        module.attn_impl = attn_impl
+    return len(modules) > 0
+
+
+def build_sam_model(sam_checkpoint, backend, device, dtype):
+    """Build a SAM model from its checkpoint, attaching an identical image encoder if one is loaded.
+
+    The encoder is matched by a fingerprint of the checkpoint before the model
+    is built, so a shared encoder is neither initialized nor read from disk.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+        backend (dict): SAM backend
+        device (torch.device): device the model will be placed on
+        dtype (str): dtype of the model cache key
+
+    Returns:
+        tuple: SAM model and its shared encoder key, None if the encoder cannot be shared
+    """
+    build_sam = backend["model_registry"][backend["model_type"]]
+    if backend["predictor"] is None:
+        return build_sam(checkpoint=sam_checkpoint), None
+
+    state_dict = load_checkpoint(sam_checkpoint, map_location="cpu")
+    encoder_key = (shared_encoder_registry.get_fingerprint(sam_checkpoint, state_dict), str(device), dtype)
+    if shared_encoder_registry.find(encoder_key):
+        with skip_init():
+            sam = build_sam(checkpoint=None)
+        sam.image_encoder = torch.nn.Identity()
+        load_state_dict(sam, {k: v for k, v in state_dict.items() if not k.startswith(IMAGE_ENCODER_PREFIX)}, strict=False)
+        if shared_encoder_registry.attach(sam, encoder_key):
+            return sam, encoder_key
+
+    del state_dict
+    return build_sam(checkpoint=sam_checkpoint), encoder_key
+
+
+def get_sam_variant(sam_checkpoint):
+    """Get how a SAM model is run with the current options.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        dict: backend, device, use_int8, use_onnx, quantized, fast_checkpoint, autocast_dtype
+            and dtype, a string naming the precision and runtime of the model
+    """
+    backend = get_sam_backend(sam_checkpoint)
+    device = get_sam_device(sam_checkpoint)
+    use_int8 = device.type == "cpu" and backend["predictor"] is not None and IAConfig.global_args.get("sam_int8", False)
+    use_onnx = device.type == "cpu" and backend["predictor"] is not None and IAConfig.global_args.get("sam_onnx", False)
+    if use_onnx and not ia_check_versions.onnxruntime_is_available:
+        ia_logging.warning("onnx and onnxruntime are not installed, SAM runs on PyTorch")
+        use_onnx = False
+    quantized = use_int8 and not use_onnx
+    fast_checkpoint = find_fast_checkpoint(sam_checkpoint, backend, device, quantized) if not use_onnx else None
+    if use_onnx:
+        dtype = "onnx-int8" if use_int8 else "onnx-float32"
+    else:
+        dtype = "qint8" if quantized else (fast_checkpoint["dtype"] if fast_checkpoint is not None else "float32")
+    autocast_dtype = get_autocast_dtype(device) if dtype == "float32" and backend["predictor"] is not None else None
+    if autocast_dtype is not None:
+        dtype = f"{dtype}-autocast-{str(autocast_dtype).replace('torch.', '')}"
+
+    return dict(backend=backend, device=device, use_int8=use_int8, use_onnx=use_onnx, quantized=quantized,
+                fast_checkpoint=fast_checkpoint, autocast_dtype=autocast_dtype, dtype=dtype)
+
+
+def get_sam_model(sam_checkpoint):
+    """Get SAM model from the model cache.
+
+    The returned instance is shared by every mask generator and predictor built
+    for the same checkpoint, device and dtype.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        Sam or FastSAM or None: SAM model
+    """
+    if not os.path.isfile(sam_checkpoint):
+        return None
+
+    variant = get_sam_variant(sam_checkpoint)
+    backend, device, dtype = variant["backend"], variant["device"], variant["dtype"]
+    use_int8, use_onnx, quantized = variant["use_int8"], variant["use_onnx"], variant["quantized"]
+    fast_checkpoint, autocast_dtype = variant["fast_checkpoint"], variant["autocast_dtype"]
+
+    def load_sam_model():
+        encoder_key = None
+        if use_onnx:
+            ia_logging.info(f"Loading SAM model {os.path.basename(sam_checkpoint)}")
+            sam = backend["model_registry"][backend["model_type"]](checkpoint=sam_checkpoint)
+            try:
+                sam = load_sam_onnx(sam, sam_checkpoint, backend, quantized=use_int8)
+            except Exception as e:
+                ia_logging.warning(f"Failed to run SAM on onnxruntime, falling back to PyTorch: {e}")
+                sam = backend["model_registry"][backend["model_type"]](checkpoint=sam_checkpoint)
+        elif quantized:
+            artifact_path = fast_checkpoint["path"] if fast_checkpoint is not None else None
+            if artifact_path is None:
+                ia_logging.info(f"Quantizing SAM model {os.path.basename(sam_checkpoint)} to int8 (first run only)")
+                artifact_path = convert_sam_checkpoint(sam_checkpoint, backend, device, quantized=True)
+            ia_logging.info(f"Loading int8 SAM model {os.path.basename(artifact_path)}")
+            sam = load_fast_checkpoint(artifact_path)
+        elif fast_checkpoint is not None:
+            ia_logging.info(f"Loading converted SAM model {fast_checkpoint['file']}")
+            sam = load_fast_checkpoint(fast_checkpoint["path"])
+        else:
+            ia_logging.info(f"Loading SAM model {os.path.basename(sam_checkpoint)}")
+            sam, encoder_key = build_sam_model(sam_checkpoint, backend, device, dtype)
+        sam.to(device=device)
+        if encoder_key is not None:
+            shared_encoder_registry.register(sam, encoder_key)
+        apply_sam_precision(sam, autocast_dtype)
+        attn_memory_mb = IAConfig.global_args.get("sam_attn_memory_mb", None)
+        if attn_memory_mb is not None and hasattr(sam, "image_encoder") and hasattr(sam.image_encoder, "set_attn_memory_limit"):
+            ia_logging.info(f"Limiting the attention maps of the SAM image encoder to {attn_memory_mb} MB")
+            sam.image_encoder.set_attn_memory_limit(attn_memory_mb)
+        attn_impl = IAConfig.global_args.get("sam_attn_impl", None)
+        if attn_impl is not None and not use_onnx and set_sam_attn_impl(sam, attn_impl):
+            ia_logging.info(f"SAM image encoder uses {attn_impl} attention")
+        return sam
+
+    return sam_model_cache.get((os.path.realpath(sam_checkpoint), str(device), dtype), load_sam_model)
+
+
+def get_sam_cache_stats():
+    """Get SAM model cache counters.
+
+    Returns:
+        dict: hits, misses, evictions, number of entries and total size in MB
+    """
+    return sam_model_cache.stats()
+
+
+def get_sam_autotune_settings(sam_checkpoint):
+    """Get the autotuned CPU settings of a SAM model.
+
+    Settings are stored per machine and model variant (dtype and runtime) by
+    `python ia_sam_autotune.py` and only used when SAM runs on CPU.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+
+    Returns:
+        dict or None: num_threads, interop_threads and points_per_batch
+    """
+    if not IAConfig.global_args.get("sam_autotune", True) or get_sam_device(sam_checkpoint).type != "cpu":
+        return None
+
+    return ia_sam_autotune.get_settings(sam_checkpoint, get_sam_variant(sam_checkpoint)["dtype"])
+
+
+@contextmanager
+def sam_autotune_threads(sam_checkpoint):
+    """Run SAM with the autotuned CPU thread counts of a model, restoring the previous ones afterwards.
+
+    Args:
+        sam_checkpoint (str): SAM checkpoint path
+    """
+    with ia_sam_autotune.threads(get_sam_autotune_settings(sam_checkpoint)):
+        yield
+
+
+def get_sam_mask_generator(sam_checkpoint, anime_style_chk=False, preview_size=None):
     """Get SAM mask generator.
 
     Args:
         sam_checkpoint (str): SAM checkpoint path
+        anime_style_chk (bool, optional): anime style check. Defaults to False.
+        preview_size (int, optional): input size of the image encoder for a fast
+            preview pass, e.g. 512 or 768. Defaults to None (full resolution).
 
     Returns:
         SamAutomaticMaskGenerator or None: SAM mask generator
     """
-    # model_type = "vit_h"
-    if "_hq_" in os.path.basename(sam_checkpoint):
-        model_type = os.path.basename(sam_checkpoint)[7:12]
-        sam_model_registry_local = sam_model_registry_hq
-        SamAutomaticMaskGeneratorLocal = SamAutomaticMaskGeneratorHQ
-        points_per_batch = 32
-    elif "FastSAM" in os.path.basename(sam_checkpoint):
-        model_type = os.path.splitext(os.path.basename(sam_checkpoint))[0]
-        sam_model_registry_local = fast_sam_model_registry
-        SamAutomaticMaskGeneratorLocal = FastSamAutomaticMaskGenerator
-        points_per_batch = None
-    elif "mobile_sam" in os.path.basename(sam_checkpoint):
-        model_type = "vit_t"
-        sam_model_registry_local = sam_model_registry_mobile
-        SamAutomaticMaskGeneratorLocal = SamAutomaticMaskGeneratorMobile
-        points_per_batch = 64
-    else:
-        model_type = os.path.basename(sam_checkpoint)[4:9]
-        sam_model_registry_local = sam_model_registry
-        SamAutomaticMaskGeneratorLocal = SamAutomaticMaskGenerator
-        points_per_batch = 64
+    backend = get_sam_backend(sam_checkpoint)
 
     pred_iou_thresh = 0.88 if not anime_style_chk else 0.83
     stability_score_thresh = 0.95 if not anime_style_chk else 0.9
 
-    if os.path.isfile(sam_checkpoint):
-        sam = sam_model_registry_local[model_type](checkpoint=sam_checkpoint)
-        if platform.system() == "Darwin":
-            if "FastSAM" in os.path.basename(sam_checkpoint) or not ia_check_versions.torch_mps_is_available:
-                sam.to(device=torch.device("cpu"))
-            else:
-                sam.to(device=torch.device("mps"))
-        else:
-            if IAConfig.global_args.get("sam_cpu", False):
-                ia_logging.info("SAM is running on CPU... (the option has been selected)")
-                sam.to(device=devices.cpu)
-            else:
-                sam.to(device=devices.device)
-        sam_mask_generator = SamAutomaticMaskGeneratorLocal(
-            model=sam, points_per_batch=points_per_batch, pred_iou_thresh=pred_iou_thresh, stability_score_thresh=stability_score_thresh)
+    # Only the predictor based generators can run the image encoder at a reduced size
+    kwargs = {}
+    if preview_size is not None and backend["predictor"] is not None:
+        kwargs["target_length"] = preview_size
+    mask_filter_resolution = IAConfig.global_args.get("sam_mask_filter_resolution", None)
+    if mask_filter_resolution is not None and backend["predictor"] is not None:
+        kwargs["mask_filter_resolution"] = mask_filter_resolution
+    mask_nms_thresh = IAConfig.global_args.get("sam_mask_nms_thresh", None)
+    if mask_nms_thresh is not None and backend["predictor"] is not None:
+        kwargs["mask_nms_thresh"] = mask_nms_thresh
+
+    points_per_batch = backend["points_per_batch"]
+    autotune_settings = get_sam_autotune_settings(sam_checkpoint)
+    if points_per_batch is not None and autotune_settings is not None:
+        points_per_batch = autotune_settings.get("points_per_batch", points_per_batch)
+
+    sam = get_sam_model(sam_checkpoint)
+    if sam is not None:
+        sam_mask_generator = backend["mask_generator"](
+            model=sam, points_per_batch=points_per_batch, pred_iou_thresh=pred_iou_thresh, stability_score_thresh=stability_score_thresh,
+            **kwargs)
     else:
         sam_mask_generator = None
 
@@ -81,36 +482,13 @@ def get_sam_predictor(sam_checkpoint):
     Returns:
         SamPredictor or None: SAM predictor
     """
-    # model_type = "vit_h"
-    if "_hq_" in os.path.basename(sam_checkpoint):
-        model_type = os.path.basename(sam_checkpoint)[7:12]
-        sam_model_registry_local = sam_model_registry_hq
-        SamPredictorLocal = SamPredictorHQ
-    elif "FastSAM" in os.path.basename(sam_checkpoint):
+    backend = get_sam_backend(sam_checkpoint)
+    if backend["predictor"] is None:
         raise NotImplementedError("FastSAM predictor is not implemented yet.")
-    elif "mobile_sam" in os.path.basename(sam_checkpoint):
-        model_type = "vit_t"
-        sam_model_registry_local = sam_model_registry_mobile
-        SamPredictorLocal = SamPredictorMobile
-    else:
-        model_type = os.path.basename(sam_checkpoint)[4:9]
-        sam_model_registry_local = sam_model_registry
-        SamPredictorLocal = SamPredictor
-
-    if os.path.isfile(sam_checkpoint):
-        sam = sam_model_registry_local[model_type](checkpoint=sam_checkpoint)
-        if platform.system() == "Darwin":
-            if "FastSAM" in os.path.basename(sam_checkpoint) or not ia_check_versions.torch_mps_is_available:
-                sam.to(device=torch.device("cpu"))
-            else:
-                sam.to(device=torch.device("mps"))
-        else:
-            if IAConfig.global_args.get("sam_cpu", False):
-                ia_logging.info("SAM is running on CPU... (the option has been selected)")
-                sam.to(device=devices.cpu)
-            else:
-                sam.to(device=devices.device)
-        sam_predictor = SamPredictorLocal(sam)
+
+    sam = get_sam_model(sam_checkpoint)
+    if sam is not None:
+        sam_predictor = backend["predictor"](sam)
     else:
         sam_predictor = None
 
@@ -0,0 +1,365 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import threading
+
+import torch
+from torch import nn
+
+from ia_file_manager import ia_file_manager
+from ia_logging import ia_logging
+from ia_sam_converter import get_backend_code_hash, get_backend_package, get_source_key
+
+
+class IASamOnnx:
+    DIR_NAME = "onnx"
+    MANIFEST_NAME = "manifest.json"
+    OPSET_VERSION = 17
+    # Bump when the export itself changes (e.g. its dynamic axes)
+    EXPORT_VERSION = 2
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+
+    @property
+    def onnx_dir(self) -> str:
+        """Get ONNX models directory.
+
+        Returns:
+            str: ONNX models directory
+        """
+        onnx_dir = os.path.join(ia_file_manager.models_dir, IASamOnnx.DIR_NAME)
+        if not os.path.isdir(onnx_dir):
+            os.makedirs(onnx_dir, exist_ok=True)
+        return onnx_dir
+
+    def get_model_dir(self, sam_checkpoint: str, backend: dict) -> str:
+        """Get the directory of the ONNX models exported from a SAM checkpoint.
+
+        The directory name changes when the checkpoint, the backend code or the
+        export settings change, so stale exports are not used. Large encoders are
+        stored with their weights in external data files next to the model.
+
+        Args:
+            sam_checkpoint (str): SAM checkpoint path
+            backend (dict): SAM backend information
+
+        Returns:
+            str: ONNX model directory
+        """
+        package_name = get_backend_package(backend)
+        export_key = ":".join([
+            get_source_key(sam_checkpoint),
+            get_backend_code_hash(package_name),
+            str(IASamOnnx.OPSET_VERSION),
+            str(IASamOnnx.EXPORT_VERSION),
+        ])
+        stem = os.path.splitext(os.path.basename(sam_checkpoint))[0]
+        return os.path.join(self.onnx_dir, f"{stem}-{hashlib.sha256(export_key.encode()).hexdigest()[:12]}")
+
+    def read_manifest(self, model_dir: str) -> dict:
+        """Read the manifest of an exported model directory.
+
+        Args:
+            model_dir (str): ONNX model directory
+
+        Returns:
+            dict or None: file names of the exported models, None if the export is incomplete
+        """
+        manifest_path = os.path.join(model_dir, IASamOnnx.MANIFEST_NAME)
+        if not os.path.isfile(manifest_path):
+            return None
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            ia_logging.warning(f"Failed to read {manifest_path}: {e}")
+            return None
+
+    def write_manifest(self, model_dir: str, manifest: dict) -> None:
+        """Write the manifest of an exported model directory.
+
+        Args:
+            model_dir (str): ONNX model directory
+            manifest (dict): file names of the exported models
+        """
+        manifest_path = os.path.join(model_dir, IASamOnnx.MANIFEST_NAME)
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+
+ia_sam_onnx = IASamOnnx()
+
+
+def returns_interm(sam):
+    return sam.mask_decoder.__class__.__name__ == "MaskDecoderHQ"
+
+
+def export_sam_onnx(sam, sam_checkpoint, backend):
+    """Export the image encoder and the mask decoder of a SAM model to ONNX.
+
+    Args:
+        sam (torch.nn.Module): SAM model on CPU
+        sam_checkpoint (str): SAM checkpoint path
+        backend (dict): SAM backend information
+
+    Returns:
+        dict: paths of the "encoder" and "decoder" models
+    """
+    package_name = get_backend_package(backend)
+    onnx_utils = importlib.import_module(f"{package_name}.utils.onnx")
+    hq = returns_interm(sam)
+    sam.eval()
+
+    # The traced graph has a fixed input size, so the eager attention is exported
+    for module in sam.image_encoder.modules():
+        if hasattr(module, "attn_impl"):
+            module.attn_impl = "eager"
+
+    model_dir = ia_sam_onnx.get_model_dir(sam_checkpoint, backend)
+    os.makedirs(model_dir, exist_ok=True)
+    encoder_path = os.path.join(model_dir, "encoder.onnx")
+    decoder_path = os.path.join(model_dir, "decoder.onnx")
+    ia_logging.info(f"Exporting {os.path.basename(sam_checkpoint)} to ONNX ({model_dir})")
+
+    img_size = sam.image_encoder.img_size
+    image = torch.zeros((1, 3, img_size, img_size), dtype=torch.float32)
+    image_encoder = onnx_utils.SamOnnxImageEncoder(sam)
+    with torch.no_grad():
+        encoder_outputs = image_encoder(image)
+    encoder_output_names = ["image_embeddings", "interm_embeddings"] if hq else ["image_embeddings"]
+    encoder_dynamic_axes = {"image": {0: "batch"}, "image_embeddings": {0: "batch"}}
+    if hq:
+        # The intermediate embeddings are stacked along axis 0, so their batch axis is 1
+        encoder_dynamic_axes["interm_embeddings"] = {1: "batch"}
+    torch.onnx.export(
+        image_encoder,
+        (image,),
+        encoder_path,
+        input_names=["image"],
+        output_names=encoder_output_names,
+        dynamic_axes=encoder_dynamic_axes,
+        opset_version=IASamOnnx.OPSET_VERSION,
+        do_constant_folding=True,
+    )
+
+    image_embeddings = encoder_outputs[0] if hq else encoder_outputs
+    point_coords = torch.randint(low=0, high=img_size, size=(2, 1, 2), dtype=torch.float32)
+    point_labels = torch.ones((2, 1), dtype=torch.int64)
+    with torch.no_grad():
+        sparse_embeddings, dense_embeddings = sam.prompt_encoder(points=(point_coords, point_labels), boxes=None, masks=None)
+    decoder_inputs = dict(
+        image_embeddings=image_embeddings,
+        image_pe=sam.prompt_encoder.get_dense_pe(),
+        sparse_prompt_embeddings=sparse_embeddings,
+        dense_prompt_embeddings=dense_embeddings,
+    )
+    if hq:
+        decoder_inputs["interm_embedding"] = encoder_outputs[1][0]
+    torch.onnx.export(
+        onnx_utils.SamOnnxMaskDecoder(sam),
+        tuple(decoder_inputs.values()),
+        decoder_path,
+        input_names=list(decoder_inputs.keys()),
+        output_names=["masks", "iou_predictions"],
+        dynamic_axes={
+            "sparse_prompt_embeddings": {0: "num_prompts", 1: "num_tokens"},
+            "dense_prompt_embeddings": {0: "num_prompts"},
+            "masks": {0: "num_prompts"},
+            "iou_predictions": {0: "num_prompts"},
+        },
+        opset_version=IASamOnnx.OPSET_VERSION,
+        do_constant_folding=True,
+    )
+
+    return dict(encoder=encoder_path, decoder=decoder_path)
+
+
+def quantize_onnx_model(model_path):
+    """Quantize the weights of an ONNX model to int8 with onnxruntime dynamic quantization.
+
+    Args:
+        model_path (str): fp32 ONNX model path
+
+    Returns:
+        str: int8 ONNX model path
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized_path = os.path.splitext(model_path)[0] + ".int8.onnx"
+    quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8, use_external_data_format=True)
+    return quantized_path
+
+
+def get_sam_onnx_paths(sam, sam_checkpoint, backend, quantized=False):
+    """Get the ONNX models of a SAM checkpoint, exporting them on first use.
+
+    Args:
+        sam (torch.nn.Module): SAM model on CPU
+        sam_checkpoint (str): SAM checkpoint path
+        backend (dict): SAM backend information
+        quantized (bool, optional): int8 weights. Defaults to False.
+
+    Returns:
+        dict: paths of the "encoder" and "decoder" models
+    """
+    model_dir = ia_sam_onnx.get_model_dir(sam_checkpoint, backend)
+    variant = "int8" if quantized else "fp32"
+    with ia_sam_onnx.lock:
+        manifest = ia_sam_onnx.read_manifest(model_dir) or {}
+        if "fp32" not in manifest:
+            paths = export_sam_onnx(sam, sam_checkpoint, backend)
+            manifest["fp32"] = {k: os.path.basename(v) for k, v in paths.items()}
+            ia_sam_onnx.write_manifest(model_dir, manifest)
+        if variant not in manifest:
+            ia_logging.info(f"Quantizing the ONNX models of {os.path.basename(sam_checkpoint)} to int8")
+            manifest[variant] = {k: os.path.basename(quantize_onnx_model(os.path.join(model_dir, v)))
+                                 for k, v in manifest["fp32"].items()}
+            ia_sam_onnx.write_manifest(model_dir, manifest)
+    return {k: os.path.join(model_dir, v) for k, v in manifest[variant].items()}
+
+
+def create_onnx_session(model_path):
+    """Create an onnxruntime session on the CPU provider with all graph optimizations.
+
+    Args:
+        model_path (str): ONNX model path
+
+    Returns:
+        onnxruntime.InferenceSession: session
+    """
+    import onnxruntime as ort
+
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_options.intra_op_num_threads = torch.get_num_threads()
+    return ort.InferenceSession(model_path, sess_options=sess_options, providers=["CPUExecutionProvider"])
+
+
+def to_numpy(x):
+    return x.detach().to(device="cpu", dtype=torch.float32).contiguous().numpy()
+
+
+class OnnxImageEncoder(nn.Module):
+    """Image encoder running an exported ONNX model on onnxruntime.
+
+    It has no absolute positional embedding to resample, so predictors always
+    encode images at img_size.
+    """
+
+    def __init__(self, session, img_size, return_interm):
+        super().__init__()
+        self.session = session
+        self.img_size = img_size
+        self.return_interm = return_interm
+        self.pos_embed = None
+
+    def forward(self, x):
+        outputs = self.session.run(None, {"image": to_numpy(x)})
+        features = torch.from_numpy(outputs[0]).to(x.device)
+        if self.return_interm:
+            return features, list(torch.from_numpy(outputs[1]).to(x.device).unbind(0))
+        return features
+
+
+class OnnxMaskDecoder(nn.Module):
+    """Mask decoder running an exported ONNX model on onnxruntime.
+
+    The exported graph returns all mask tokens; the mask selection of
+    MaskDecoder.forward and MaskDecoderHQ.forward is applied here.
+    """
+
+    def __init__(self, session, num_mask_tokens, hq):
+        super().__init__()
+        self.session = session
+        self.num_mask_tokens = num_mask_tokens
+        self.hq = hq
+
+    def forward(
+        self,
+        image_embeddings,
+        image_pe,
+        sparse_prompt_embeddings,
+        dense_prompt_embeddings,
+        multimask_output,
+        hq_token_only=False,
+        interm_embeddings=None,
+    ):
+        inputs = dict(
+            image_embeddings=to_numpy(image_embeddings),
+            image_pe=to_numpy(image_pe),
+            sparse_prompt_embeddings=to_numpy(sparse_prompt_embeddings),
+            dense_prompt_embeddings=to_numpy(dense_prompt_embeddings),
+        )
+        if self.hq:
+            inputs["interm_embedding"] = to_numpy(interm_embeddings[0])
+        masks, iou_pred = (torch.from_numpy(output).to(image_embeddings.device) for output in self.session.run(None, inputs))
+
+        if not self.hq:
+            mask_slice = slice(1, None) if multimask_output else slice(0, 1)
+            return masks[:, mask_slice, :, :], iou_pred[:, mask_slice]
+
+        if multimask_output:
+            mask_slice = slice(1, self.num_mask_tokens - 1)
+            iou_pred, max_iou_idx = torch.max(iou_pred[:, mask_slice], dim=1)
+            iou_pred = iou_pred.unsqueeze(1)
+            masks_multi = masks[:, mask_slice, :, :]
+            masks_sam = masks_multi[torch.arange(masks_multi.size(0)), max_iou_idx].unsqueeze(1)
+        else:
+            iou_pred = iou_pred[:, 0:1]
+            masks_sam = masks[:, 0:1]
+        masks_hq = masks[:, self.num_mask_tokens - 1:self.num_mask_tokens]
+        masks = masks_hq if hq_token_only else masks_sam + masks_hq
+        return masks, iou_pred
+
+
+def load_sam_onnx(sam, sam_checkpoint, backend, quantized=False):
+    """Replace the image encoder and the mask decoder of a SAM model with onnxruntime sessions.
+
+    The prompt encoder and the pre- and postprocessing keep running in torch.
+
+    Args:
+        sam (torch.nn.Module): SAM model on CPU
+        sam_checkpoint (str): SAM checkpoint path
+        backend (dict): SAM backend information
+        quantized (bool, optional): int8 weights. Defaults to False.
+
+    Returns:
+        torch.nn.Module: SAM model
+    """
+    paths = get_sam_onnx_paths(sam, sam_checkpoint, backend, quantized)
+    ia_logging.info(f"Loading ONNX SAM model {os.path.basename(os.path.dirname(paths['encoder']))} ({'int8' if quantized else 'fp32'})")
+    hq = returns_interm(sam)
+    sam.image_encoder = OnnxImageEncoder(create_onnx_session(paths["encoder"]), sam.image_encoder.img_size, hq)
+    sam.mask_decoder = OnnxMaskDecoder(create_onnx_session(paths["decoder"]), sam.mask_decoder.num_mask_tokens, hq)
+    return sam
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export SAM checkpoints in the models directory to ONNX for onnxruntime")
+    parser.add_argument("sam_model_ids", nargs="*", help="SAM model IDs to export (default: all downloaded)")
+    parser.add_argument("--sam-int8", action="store_true", help="Also create int8 quantized ONNX models.")
+    args = parser.parse_args()
+
+    from ia_sam_manager import get_sam_backend
+    from ia_ui_items import get_sam_model_ids
+
+    sam_model_ids = args.sam_model_ids if len(args.sam_model_ids) > 0 else get_sam_model_ids()
+    for sam_model_id in sam_model_ids:
+        sam_checkpoint = os.path.join(ia_file_manager.models_dir, sam_model_id)
+        if not os.path.isfile(sam_checkpoint):
+            continue
+        backend = get_sam_backend(sam_checkpoint)
+        if backend["predictor"] is None:
+            ia_logging.info(f"Skipping ONNX export of {sam_model_id} (not supported)")
+            continue
+        sam = backend["model_registry"][backend["model_type"]](checkpoint=sam_checkpoint)
+        paths = get_sam_onnx_paths(sam, sam_checkpoint, backend, args.sam_int8)
+        ia_logging.info(f"Exported {sam_model_id} -> {os.path.dirname(paths['encoder'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import os
+import platform
+from functools import lru_cache
+
+import torch
+from torch import nn
+
+from ia_config import IAConfig
+from ia_logging import ia_logging
+
+SAM_PRECISIONS = ["fp32", "auto", "bf16", "fp16"]
+
+
+@lru_cache(maxsize=None)
+def cpu_supports_bf16():
+    """Check if the CPU has native bf16 instructions (AVX512-BF16 or AMX-BF16).
+
+    Returns:
+        bool: True if bf16 autocast is faster than fp32 on this CPU
+    """
+    try:
+        if hasattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported") and not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+            return False
+    except Exception:
+        pass
+
+    if platform.system() == "Linux" and os.path.isfile("/proc/cpuinfo"):
+        with open("/proc/cpuinfo", "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = line.split(":", 1)[1].split()
+                    return "avx512_bf16" in flags or "amx_bf16" in flags
+    return False
+
+
+def get_autocast_dtype(device, precision=None):
+    """Get the autocast dtype of the SAM image encoder for a device and precision option.
+
+    "auto" uses fp16 on CUDA and bf16 on CPUs with native bf16 support.
+    Unsupported combinations fall back to fp32.
+
+    Args:
+        device (torch.device): device SAM runs on
+        precision (str, optional): one of SAM_PRECISIONS. Defaults to the --sam-precision option.
+
+    Returns:
+        torch.dtype or None: autocast dtype, None for fp32
+    """
+    if precision is None:
+        precision = IAConfig.global_args.get("sam_precision", None) or "fp32"
+    device_type = torch.device(device).type
+
+    if precision == "auto":
+        if device_type == "cuda":
+            return torch.float16
+        if device_type == "cpu" and cpu_supports_bf16():
+            return torch.bfloat16
+        return None
+    elif precision == "bf16":
+        if device_type == "cuda" and not torch.cuda.is_bf16_supported():
+            ia_logging.warning("bf16 is not supported on this GPU, SAM runs in fp32")
+            return None
+        if device_type not in ["cuda", "cpu"]:
+            ia_logging.warning(f"bf16 autocast is not supported on {device_type}, SAM runs in fp32")
+            return None
+        return torch.bfloat16
+    elif precision == "fp16":
+        if device_type not in ["cuda", "mps"]:
+            ia_logging.warning(f"fp16 autocast is not supported on {device_type}, SAM runs in fp32")
+            return None
+        return torch.float16
+    return None
+
+
+def _cast_to_float32(output):
+    if torch.is_tensor(output):
+        return output.float() if output.is_floating_point() else output
+    elif isinstance(output, (list, tuple)):
+        return type(output)(_cast_to_float32(item) for item in output)
+    return output
+
+
+class AutocastImageEncoder(nn.Module):
+    """Runs an image encoder under torch.autocast and returns fp32 embeddings.
+
+    Only the image encoder is wrapped, so the prompt encoder, the mask decoder
+    and the mask postprocessing (stability score, pred_iou_thresh filtering)
+    keep running in fp32.
+    """
+
+    def __init__(self, core, dtype):
+        super().__init__()
+        self.core = core
+        self.autocast_dtype = dtype
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            if name == "core":
+                raise
+            return getattr(self.core, name)
+
+    def forward(self, x):
+        device_type = x.device.type
+        with torch.autocast(device_type=device_type, dtype=self.autocast_dtype):
+            outputs = self.core(x)
+        return _cast_to_float32(outputs)
+
+
+def apply_sam_precision(sam, autocast_dtype):
+    """Run the image encoder of a SAM model under autocast.
+
+    Args:
+        sam (torch.nn.Module): SAM model
+        autocast_dtype (torch.dtype or None): autocast dtype, None for fp32
+
+    Returns:
+        bool: True if the precision policy was applied
+    """
+    if autocast_dtype is None or not hasattr(sam, "image_encoder") or isinstance(sam.image_encoder, AutocastImageEncoder):
+        return False
+
+    # Converted fp16/bf16 and int8 encoders already run in reduced precision
+    param = next(sam.image_encoder.parameters(), None)
+    if param is None or param.dtype != torch.float32:
+        return False
+
+    sam.image_encoder = AutocastImageEncoder(sam.image_encoder, autocast_dtype)
+    ia_logging.info(f"SAM image encoder runs in {str(autocast_dtype).replace('torch.', '')} autocast, mask decoder in fp32")
+    return True
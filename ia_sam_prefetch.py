@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import torch
+
+from ia_logging import ia_logging
+from ia_sam_manager import get_sam_model
+
+
+class SamPrefetcher:
+    """Loads SAM models into the model cache and warms them up in the background.
+
+    The first Segment Anything run otherwise pays for loading the checkpoint,
+    kernel selection and allocator growth. A prefetch is started when the model
+    is selected or an image is uploaded, and the time it took is reported as
+    saved latency when the model is first used. Warmups are not started while
+    a foreground run is active, so they do not compete with it for the device.
+    """
+
+    WARMUP_IMAGE_SIZE = 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._results = {}
+        self._warmed_models = weakref.WeakSet()
+        self._foreground_runs = 0
+
+    @contextmanager
+    def foreground(self):
+        """Mark a foreground Segment Anything run, no background warmup is started during it."""
+        with self._lock:
+            self._foreground_runs += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground_runs -= 1
+
+    def prefetch(self, sam_checkpoint):
+        """Start loading and warming up a SAM model in a background thread.
+
+        Args:
+            sam_checkpoint (str): SAM checkpoint path
+
+        Returns:
+            bool: True if a prefetch was started
+        """
+        if not os.path.isfile(sam_checkpoint):
+            return False
+
+        with self._lock:
+            thread = self._threads.get(sam_checkpoint, None)
+            if thread is not None and thread.is_alive():
+                return False
+            thread = threading.Thread(target=self._run, args=(sam_checkpoint,), daemon=True)
+            self._threads[sam_checkpoint] = thread
+            thread.start()
+        return True
+
+    def _run(self, sam_checkpoint):
+        try:
+            start_time = time.perf_counter()
+            sam = get_sam_model(sam_checkpoint)
+            load_time = time.perf_counter() - start_time
+
+            with self._lock:
+                foreground_running = self._foreground_runs > 0
+            start_time = time.perf_counter()
+            warmed_up = self.warmup(sam) if not foreground_running else False
+            warmup_time = time.perf_counter() - start_time
+        except Exception as e:
+            ia_logging.warning(f"Failed to prefetch {os.path.basename(sam_checkpoint)}: {e}")
+            return
+
+        if load_time + warmup_time < 0.01:
+            return
+        ia_logging.info(f"Prefetched {os.path.basename(sam_checkpoint)}: load {load_time:.2f}s" +
+                        (f", warmup {warmup_time:.2f}s" if warmed_up else ""))
+        with self._lock:
+            self._results[sam_checkpoint] = dict(load_time=load_time, warmup_time=warmup_time)
+
+    def warmup(self, sam):
+        """Run one image encoder forward pass at the input resolution of the model.
+
+        Args:
+            sam (Any): SAM model
+
+        Returns:
+            bool: True if the model was warmed up
+        """
+        if not isinstance(sam, torch.nn.Module) or not hasattr(sam, "image_encoder") or sam in self._warmed_models:
+            return False
+
+        # ONNX image encoders have no parameters, the prompt encoder is on the same device
+        param = next(sam.parameters())
+        img_size = getattr(sam.image_encoder, "img_size", SamPrefetcher.WARMUP_IMAGE_SIZE)
+        with torch.no_grad():
+            x = torch.zeros((1, 3, img_size, img_size), dtype=torch.float32, device=param.device)
+            sam.image_encoder(x)
+        if param.device.type == "cuda":
+            torch.cuda.synchronize(param.device)
+        self._warmed_models.add(sam)
+        return True
+
+    def wait(self, sam_checkpoint):
+        """Wait for a running prefetch of a SAM model and log the first-run latency it saved.
+
+        Args:
+            sam_checkpoint (str): SAM checkpoint path
+        """
+        with self._lock:
+            thread = self._threads.get(sam_checkpoint, None)
+
+        start_time = time.perf_counter()
+        if thread is not None:
+            thread.join()
+        wait_time = time.perf_counter() - start_time
+
+        with self._lock:
+            result = self._results.pop(sam_checkpoint, None)
+        if result is not None:
+            saved_time = max(0.0, result["load_time"] + result["warmup_time"] - wait_time)
+            ia_logging.info(f"Prefetch of {os.path.basename(sam_checkpoint)} saved {saved_time:.2f}s of first-run latency" +
+                            (f" (waited {wait_time:.2f}s)" if wait_time >= 0.01 else ""))
+
+
+sam_prefetcher = SamPrefetcher()
@@ -0,0 +1,251 @@
+import hashlib
+import os
+import threading
+import weakref
+
+import torch
+from torch import nn
+
+from ia_logging import ia_logging
+
+
+IMAGE_ENCODER_PREFIX = "image_encoder."
+
+
+def get_encoder_fingerprint(state_dict, samples_per_tensor=1024):
+    """Get a fingerprint of the image encoder weights of a checkpoint state dict.
+
+    Every tensor contributes its name, shape, dtype and its first values. The
+    sample is contiguous, so about one page per tensor of a memory-mapped
+    checkpoint is read.
+
+    Args:
+        state_dict (dict): state dict of a SAM or SAM-HQ model
+        samples_per_tensor (int, optional): number of sampled values per tensor. Defaults to 1024.
+
+    Returns:
+        str or None: hex digest, None if the state dict has no image encoder
+    """
+    sha256 = hashlib.sha256()
+    num_tensors = 0
+    with torch.no_grad():
+        for name in sorted(state_dict.keys()):
+            if not name.startswith(IMAGE_ENCODER_PREFIX):
+                continue
+            tensor = state_dict[name]
+            sha256.update(f"{name}:{tuple(tensor.shape)}:{tensor.dtype}".encode("utf-8"))
+            sample = tensor.reshape(-1)[:samples_per_tensor]
+            sha256.update(sample.float().cpu().numpy().tobytes())
+            num_tensors += 1
+    return sha256.hexdigest() if num_tensors > 0 else None
+
+
+class SharedEncoderState:
+    """Image embeddings of the last input, shared by all views of an encoder."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.input = None
+        self.input_version = None
+        self.outputs = None
+
+    def is_last_input(self, x):
+        """Check whether x holds the last encoded input.
+
+        The same tensor, or a view of its storage, is recognized by identity
+        and version counter. Each predictor preprocesses the image into its own
+        tensor, so other tensors are compared on their device, without copying
+        them to the host.
+        """
+        if self.input is None:
+            return False
+        if x.data_ptr() == self.input.data_ptr() and x.stride() == self.input.stride():
+            return x.shape == self.input.shape and x._version == self.input_version
+        return x.shape == self.input.shape and x.dtype == self.input.dtype and x.device == self.input.device and \
+            bool(torch.equal(x, self.input))
+
+    def clear(self):
+        with self.lock:
+            self.input = None
+            self.input_version = None
+            self.outputs = None
+
+
+class SharedImageEncoder(nn.Module):
+    """View of an image encoder shared between SAM and SAM-HQ models.
+
+    The wrapped ViT encoder is computed once per input image; SAM views return the
+    image embeddings, SAM-HQ views also return the intermediate embeddings of the
+    global attention blocks. The embeddings of the last input are kept, so an image
+    encoded for one model is reused by the other.
+    """
+
+    def __init__(self, core, state, return_interm):
+        super().__init__()
+        self.core = core
+        self.state = state
+        self.return_interm = return_interm
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            if name == "core":
+                raise
+            return getattr(self.core, name)
+
+    def _encode(self, x):
+        # Other threads may run the shared core at the same time, only collect the outputs of this one
+        thread_id = threading.get_ident()
+        interm_embeddings = []
+
+        def hook(module, args, output):
+            if threading.get_ident() == thread_id:
+                interm_embeddings.append(output)
+
+        handles = [blk.register_forward_hook(hook) for blk in self.core.blocks if blk.window_size == 0]
+        try:
+            outputs = self.core(x)
+        finally:
+            for handle in handles:
+                handle.remove()
+        features = outputs[0] if isinstance(outputs, (list, tuple)) else outputs
+        # Reduced precision encoders return fp32 features, keep the intermediate embeddings in the same dtype
+        interm_embeddings = [x.to(features.dtype) for x in interm_embeddings]
+        return features, interm_embeddings
+
+    def _apply(self, fn, *args, **kwargs):
+        # The core is shared with other models, so moving or casting one model must not move it under the others
+        return self
+
+    def forward(self, x):
+        cacheable = x.shape[0] == 1
+        outputs = None
+        if cacheable:
+            with self.state.lock:
+                if self.state.is_last_input(x):
+                    outputs = self.state.outputs
+
+        # Encode without holding the lock, so a background warmup does not block a foreground run
+        if outputs is None:
+            outputs = self._encode(x)
+            if cacheable:
+                with self.state.lock:
+                    self.state.input = x.detach()
+                    self.state.input_version = x._version
+                    self.state.outputs = outputs
+
+        features, interm_embeddings = outputs
+
+        if self.return_interm:
+            return features, interm_embeddings
+        else:
+            return features
+
+
+class SharedEncoderRegistry:
+    """Registry of loaded ViT image encoders keyed by checkpoint weights, device and dtype.
+
+    Encoders are matched by a fingerprint of the checkpoint before a model is
+    loaded, so a model whose encoder is already loaded skips building and
+    loading it. SAM-HQ keeps the image encoder of SAM frozen, so SAM and
+    SAM-HQ checkpoints of the same ViT share it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._fingerprints = {}
+
+    @staticmethod
+    def is_shareable(sam):
+        image_encoder = sam.image_encoder
+        if isinstance(image_encoder, SharedImageEncoder):
+            return False
+        return hasattr(image_encoder, "blocks") and hasattr(image_encoder, "neck") and hasattr(image_encoder, "pos_embed")
+
+    @staticmethod
+    def returns_interm(sam):
+        return sam.mask_decoder.__class__.__name__ == "MaskDecoderHQ"
+
+    def get_fingerprint(self, sam_checkpoint, state_dict):
+        """Get the image encoder fingerprint of a checkpoint, cached by path, size and mtime.
+
+        Args:
+            sam_checkpoint (str): SAM checkpoint path
+            state_dict (dict): state dict of the checkpoint
+
+        Returns:
+            str or None: hex digest, None if the checkpoint has no image encoder
+        """
+        stat = os.stat(sam_checkpoint)
+        cache_key = (os.path.realpath(sam_checkpoint), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if cache_key in self._fingerprints:
+                return self._fingerprints[cache_key]
+        fingerprint = get_encoder_fingerprint(state_dict)
+        with self._lock:
+            self._fingerprints[cache_key] = fingerprint
+        return fingerprint
+
+    def _get_entry(self, key):
+        self._entries = {k: v for k, v in self._entries.items() if v["core"]() is not None}
+        return self._entries.get(key, None)
+
+    def find(self, key):
+        """Check whether an image encoder is loaded for a key.
+
+        Args:
+            key (tuple): (fingerprint, device, dtype)
+
+        Returns:
+            bool: True if a loaded encoder can be attached
+        """
+        with self._lock:
+            return key[0] is not None and self._get_entry(key) is not None
+
+    def register(self, sam, key):
+        """Register the image encoder of a newly loaded model for sharing.
+
+        Args:
+            sam (torch.nn.Module): newly loaded SAM or SAM-HQ model
+            key (tuple): (fingerprint, device, dtype)
+        """
+        if key[0] is None or not self.is_shareable(sam):
+            return
+
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is None:
+                self._entries[key] = dict(core=weakref.ref(sam.image_encoder), state=SharedEncoderState(), models=weakref.WeakSet([sam]))
+
+    def attach(self, sam, key):
+        """Attach the loaded image encoder of a key to a model built without its encoder weights.
+
+        Args:
+            sam (torch.nn.Module): SAM or SAM-HQ model
+            key (tuple): (fingerprint, device, dtype)
+
+        Returns:
+            bool: True if the encoder is shared with another model
+        """
+        with self._lock:
+            entry = self._get_entry(key)
+            core = entry["core"]() if entry is not None else None
+            if core is None:
+                return False
+
+            for other_sam in entry["models"]:
+                # The encoder of the first model may since have been wrapped, e.g. by AutocastImageEncoder
+                if other_sam.image_encoder is core:
+                    other_sam.image_encoder = SharedImageEncoder(core, entry["state"], self.returns_interm(other_sam))
+                elif getattr(other_sam.image_encoder, "core", None) is core:
+                    other_sam.image_encoder.core = SharedImageEncoder(core, entry["state"], self.returns_interm(other_sam))
+            sam.image_encoder = SharedImageEncoder(core, entry["state"], self.returns_interm(sam))
+            entry["models"].add(sam)
+
+        ia_logging.info("Sharing the image encoder with an already loaded model")
+        return True
+
+
+shared_encoder_registry = SharedEncoderRegistry()
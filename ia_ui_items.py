@@ -1,4 +1,4 @@
-from huggingface_hub import scan_cache_dir
+from ia_file_manager import ia_inp_model_index
 
 
 def get_sampler_names():
@@ -37,16 +37,12 @@ def get_sam_model_ids():
     return sam_model_ids
 
 
-inp_list_from_cache = None
-
-
 def get_inp_model_ids():
     """Get inpainting model ids list.
 
     Returns:
         list: model ids list
     """
-    global inp_list_from_cache
     model_ids = [
         "stabilityai/stable-diffusion-2-inpainting",
         "Uminosachi/dreamshaper_8Inpainting",
@@ -56,17 +52,8 @@ def get_inp_model_ids():
         "runwayml/stable-diffusion-inpainting",
         "invisiblecat/Uber_Realistic_Porn_Merge_V1.3_inpainting",
     ]
-    if inp_list_from_cache is not None and isinstance(inp_list_from_cache, list):
-        model_ids.extend(inp_list_from_cache)
-        return model_ids
     try:
-        hf_cache_info = scan_cache_dir()
-        inpaint_repos = []
-        for repo in hf_cache_info.repos:
-            if repo.repo_type == "model" and "inpaint" in repo.repo_id.lower() and repo.repo_id not in model_ids:
-                inpaint_repos.append(repo.repo_id)
-        inp_list_from_cache = sorted(inpaint_repos, reverse=True, key=lambda x: x.split("/")[-1])
-        model_ids.extend(inp_list_from_cache)
+        model_ids.extend([repo_id for repo_id in ia_inp_model_index.get_repo_ids() if repo_id not in model_ids])
         return model_ids
     except Exception:
         return model_ids
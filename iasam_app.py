@@ -3,6 +3,9 @@ import argparse
 import gc
 import os
 import platform
+import time
+
+startup_start_time = time.perf_counter()
 
 if platform.system() == "Darwin":
     os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
@@ -15,17 +18,10 @@ import cv2
 import gradio as gr
 import numpy as np
 import torch
-from diffusers import (DDIMScheduler, EulerAncestralDiscreteScheduler, EulerDiscreteScheduler,
-                       KDPM2AncestralDiscreteScheduler, KDPM2DiscreteScheduler,
-                       StableDiffusionInpaintPipeline)
-from lama_cleaner.model_manager import ModelManager
-from lama_cleaner.schema import Config, HDStrategy, LDMSampler, SDSampler
 from PIL import Image, ImageFilter
 from PIL.PngImagePlugin import PngInfo
 from torch.hub import download_url_to_file
-from torchvision import transforms
 
-import inpalib
 from ia_check_versions import ia_check_versions
 from ia_config import IAConfig, get_ia_config_index, set_ia_config, setup_ia_config_ini
 from ia_devices import devices
@@ -38,6 +34,21 @@ from ia_ui_items import (get_cleaner_model_ids, get_inp_model_ids, get_padding_m
 
 print("platform:", platform.system())
 
+
+def log_startup_phase(phase_name):
+    """Log the time spent in a startup phase and since the start of the app.
+
+    Args:
+        phase_name (str): name of the phase that just finished
+    """
+    global startup_phase_time
+    now = time.perf_counter()
+    ia_logging.info(f"Startup: {phase_name} took {now - startup_phase_time:.2f}s (total {now - startup_start_time:.2f}s)")
+    startup_phase_time = now
+
+
+startup_phase_time = startup_start_time
+
 reload_javascript()
 
 if find_spec("xformers") is not None:
@@ -49,6 +60,19 @@ parser = argparse.ArgumentParser(description="Inpaint Anything")
 parser.add_argument("--save-seg", action="store_true", help="Save the segmentation image generated by SAM.")
 parser.add_argument("--offline", action="store_true", help="Execute inpainting using an offline network.")
 parser.add_argument("--sam-cpu", action="store_true", help="Perform the Segment Anything operation on CPU.")
+parser.add_argument("--sam-int8", action="store_true", help="Use int8 dynamic quantization for Segment Anything on CPU.")
+parser.add_argument("--sam-onnx", action="store_true",
+                    help="Run the Segment Anything image encoder and mask decoder on onnxruntime when it runs on CPU.")
+parser.add_argument("--sam-precision", choices=["fp32", "auto", "bf16", "fp16"], default="fp32",
+                    help="Precision of the Segment Anything image encoder (autocast). The mask decoder always runs in fp32.")
+parser.add_argument("--sam-attn-memory-mb", type=int, default=None,
+                    help="Memory ceiling in MB for attention maps of the Segment Anything image encoder.")
+parser.add_argument("--sam-mask-filter-resolution", choices=["original", "input", "low_res"], default="original",
+                    help="Resolution at which Segment Anything masks are filtered before upscaling to the image size.")
+parser.add_argument("--sam-mask-nms-thresh", type=float, default=0.0,
+                    help="Mask IoU threshold for removing duplicate Segment Anything masks (0 disables it).")
+parser.add_argument("--sam-cache-ram-mb", type=int, default=None, help="Memory budget in MB for SAM models cached in RAM.")
+parser.add_argument("--sam-cache-vram-mb", type=int, default=None, help="Memory budget in MB for SAM models cached in VRAM.")
 args = parser.parse_args()
 IAConfig.global_args.update(args.__dict__)
 
@@ -105,9 +129,18 @@ def save_mask_image(mask_image, save_mask_chk=False):
         Image.fromarray(mask_image).save(save_name)
 
 
+def prefetch_sam_model(sam_model_id):
+    import inpalib
+    from ia_sam_prefetch import sam_prefetcher
+
+    if sam_model_id is not None and inpalib.sam_file_exists(sam_model_id):
+        sam_prefetcher.prefetch(inpalib.sam_file_path(sam_model_id))
+
+
 @clear_cache_decorator
-def input_image_upload(input_image, sam_image, sel_mask):
+def input_image_upload(input_image, sam_image, sel_mask, sam_model_id=None):
     global sam_dict
+    prefetch_sam_model(sam_model_id)
     sam_dict["orig_image"] = input_image
     sam_dict["pad_mask"] = None
 
@@ -172,15 +205,19 @@ def run_padding(input_image, pad_scale_width, pad_scale_height, pad_lr_barance,
 
 
 @clear_cache_decorator
-def run_sam(input_image, sam_model_id, sam_image, anime_style_chk=False):
+def run_sam(input_image, sam_model_id, sam_image, anime_style_chk=False, sam_preview_size="Off", sam_refine_chk=True):
+    import inpalib
+
     global sam_dict
     if not inpalib.sam_file_exists(sam_model_id):
         ret_sam_image = None if sam_image is None else gr.update()
-        return ret_sam_image, f"{sam_model_id} not found, please download"
+        yield ret_sam_image, f"{sam_model_id} not found, please download"
+        return
 
     if input_image is None:
         ret_sam_image = None if sam_image is None else gr.update()
-        return ret_sam_image, "Input image not found"
+        yield ret_sam_image, "Input image not found"
+        return
 
     set_ia_config(IAConfig.KEYS.SAM_MODEL_ID, sam_model_id, IAConfig.SECTIONS.USER)
 
@@ -190,37 +227,56 @@ def run_sam(input_image, sam_model_id, sam_image, anime_style_chk=False):
 
     ia_logging.info(f"input_image: {input_image.shape} {input_image.dtype}")
 
-    try:
-        sam_masks = inpalib.generate_sam_masks(input_image, sam_model_id, anime_style_chk)
-        sam_masks = inpalib.sort_masks_by_area(sam_masks)
-        sam_masks = inpalib.insert_mask_to_sam_masks(sam_masks, sam_dict["pad_mask"])
+    # A reduced resolution preview pass is shown first, optionally followed by the full resolution pass
+    preview_size = None if sam_preview_size in [None, "Off"] else int(sam_preview_size)
+    sam_passes = [preview_size] if preview_size is not None else []
+    if preview_size is None or sam_refine_chk:
+        sam_passes.append(None)
 
-        seg_image = inpalib.create_seg_color_image(input_image, sam_masks)
+    for pass_idx, pass_size in enumerate(sam_passes):
+        is_last_pass = pass_idx == len(sam_passes) - 1
+        try:
+            sam_masks = inpalib.generate_sam_masks(input_image, sam_model_id, anime_style_chk, pass_size)
+            sam_masks = inpalib.sort_masks_by_area(sam_masks)
+            sam_masks = inpalib.insert_mask_to_sam_masks(sam_masks, sam_dict["pad_mask"])
 
-        sam_dict["sam_masks"] = sam_masks
+            seg_image = inpalib.create_seg_color_image(input_image, sam_masks)
 
-    except Exception as e:
-        print(traceback.format_exc())
-        ia_logging.error(str(e))
-        ret_sam_image = None if sam_image is None else gr.update()
-        return ret_sam_image, "Segment Anything failed"
+            sam_dict["sam_masks"] = sam_masks
 
-    if IAConfig.global_args.get("save_seg", False):
-        save_name = "_".join([ia_file_manager.savename_prefix, os.path.splitext(sam_model_id)[0]]) + ".png"
-        save_name = os.path.join(ia_file_manager.outputs_dir, save_name)
-        Image.fromarray(seg_image).save(save_name)
+        except Exception as e:
+            print(traceback.format_exc())
+            ia_logging.error(str(e))
+            if pass_idx > 0:
+                yield gr.update(), "Segment Anything failed, showing preview"
+                return
+            ret_sam_image = None if sam_image is None else gr.update()
+            yield ret_sam_image, "Segment Anything failed"
+            return
 
-    if sam_image is None:
-        return seg_image, "Segment Anything complete"
-    else:
-        if sam_image["image"].shape == seg_image.shape and np.all(sam_image["image"] == seg_image):
-            return gr.update(), "Segment Anything complete"
+        if is_last_pass and IAConfig.global_args.get("save_seg", False):
+            save_name = "_".join([ia_file_manager.savename_prefix, os.path.splitext(sam_model_id)[0]]) + ".png"
+            save_name = os.path.join(ia_file_manager.outputs_dir, save_name)
+            Image.fromarray(seg_image).save(save_name)
+
+        status = "Segment Anything complete" if pass_size is None else f"Segment Anything preview ({pass_size}px) complete"
+        if not is_last_pass:
+            status += ", refining at full resolution..."
+
+        if pass_idx > 0:
+            yield gr.update(value=seg_image), status
+        elif sam_image is None:
+            yield seg_image, status
+        elif sam_image["image"].shape == seg_image.shape and np.all(sam_image["image"] == seg_image):
+            yield gr.update(), status
         else:
-            return gr.update(value=seg_image), "Segment Anything complete"
+            yield gr.update(value=seg_image), status
 
 
 @clear_cache_decorator
 def select_mask(input_image, sam_image, invert_chk, ignore_black_chk, sel_mask):
+    import inpalib
+
     global sam_dict
     if sam_dict["sam_masks"] is None or sam_image is None:
         ret_sel_mask = None if sel_mask is None else gr.update()
@@ -329,6 +385,8 @@ def add_mask(input_image, sel_mask):
 
 
 def auto_resize_to_pil(input_image, mask_image):
+    from torchvision import transforms
+
     init_image = Image.fromarray(input_image).convert("RGB")
     mask_image = Image.fromarray(mask_image).convert("RGB")
     assert init_image.size == mask_image.size, "The sizes of the image and mask do not match"
@@ -358,6 +416,10 @@ def auto_resize_to_pil(input_image, mask_image):
 @clear_cache_decorator
 def run_inpaint(input_image, sel_mask, prompt, n_prompt, ddim_steps, cfg_scale, seed, inp_model_id, save_mask_chk, composite_chk,
                 sampler_name="DDIM", iteration_count=1):
+    from diffusers import (DDIMScheduler, EulerAncestralDiscreteScheduler, EulerDiscreteScheduler,
+                           KDPM2AncestralDiscreteScheduler, KDPM2DiscreteScheduler,
+                           StableDiffusionInpaintPipeline)
+
     global sam_dict
     if input_image is None or sam_dict["mask_image"] is None or sel_mask is None:
         ia_logging.error("The image or mask does not exist")
@@ -503,6 +565,9 @@ def run_inpaint(input_image, sel_mask, prompt, n_prompt, ddim_steps, cfg_scale,
 
 @clear_cache_decorator
 def run_cleaner(input_image, sel_mask, cleaner_model_id, cleaner_save_mask_chk):
+    from lama_cleaner.model_manager import ModelManager
+    from lama_cleaner.schema import Config, HDStrategy, LDMSampler, SDSampler
+
     global sam_dict
     if input_image is None or sam_dict["mask_image"] is None or sel_mask is None:
         ia_logging.error("The image or mask does not exist")
@@ -643,6 +708,11 @@ def on_ui_tabs():
                     with gr.Column():
                         anime_style_chk = gr.Checkbox(label="Anime Style (Up Detection, Down mask Quality)", elem_id="anime_style_chk",
                                                       show_label=True, interactive=True)
+                        with gr.Row():
+                            sam_preview_size = gr.Radio(label="Preview pass (reduced resolution)", elem_id="sam_preview_size",
+                                                        choices=["Off", "512", "768"], value="Off", show_label=True, interactive=True)
+                            sam_refine_chk = gr.Checkbox(label="Refine preview at full resolution", elem_id="sam_refine_chk", value=True,
+                                                         show_label=True, interactive=True)
                     with gr.Column():
                         sam_btn = gr.Button("Run Segment Anything", elem_id="sam_btn", variant="primary", interactive=False)
 
@@ -762,11 +832,12 @@ def on_ui_tabs():
                         add_mask_btn = gr.Button("Add mask by sketch", elem_id="add_mask_btn")
 
             load_model_btn.click(download_model, inputs=[sam_model_id], outputs=[status_text])
-            input_image.upload(input_image_upload, inputs=[input_image, sam_image, sel_mask], outputs=[sam_image, sel_mask, sam_btn]).then(
+            sam_model_id.change(prefetch_sam_model, inputs=[sam_model_id], outputs=None, queue=False)
+            input_image.upload(input_image_upload, inputs=[input_image, sam_image, sel_mask, sam_model_id], outputs=[sam_image, sel_mask, sam_btn]).then(
                 fn=None, inputs=None, outputs=None, _js="inpaintAnything_initSamSelMask")
             padding_btn.click(run_padding, inputs=[input_image, pad_scale_width, pad_scale_height, pad_lr_barance, pad_tb_barance, padding_mode],
                               outputs=[input_image, status_text])
-            sam_btn.click(run_sam, inputs=[input_image, sam_model_id, sam_image, anime_style_chk], outputs=[sam_image, status_text]).then(
+            sam_btn.click(run_sam, inputs=[input_image, sam_model_id, sam_image, anime_style_chk, sam_preview_size, sam_refine_chk], outputs=[sam_image, status_text]).then(
                 fn=None, inputs=None, outputs=None, _js="inpaintAnything_clearSamMask")
             select_btn.click(select_mask, inputs=[input_image, sam_image, invert_chk, ignore_black_chk, sel_mask], outputs=[sel_mask]).then(
                 fn=None, inputs=None, outputs=None, _js="inpaintAnything_clearSelMask")
@@ -798,5 +869,10 @@ def on_ui_tabs():
     return [(inpaint_anything_interface, "Inpaint Anything", "inpaint_anything")]
 
 
+log_startup_phase("imports")
 block, _, _ = on_ui_tabs()[0]
-block.launch(share=True)
+log_startup_phase("UI build")
+block.launch(share=True, prevent_thread_lock=True)
+log_startup_phase("launch")
+ia_logging.info(f"Time to UI ready: {time.perf_counter() - startup_start_time:.2f}s")
+block.block_thread()
@@ -1,7 +1,7 @@
 import copy
 import os
 import sys
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
 
 import cv2
 import numpy as np
@@ -15,7 +15,8 @@ if inpa_basedir not in sys.path:
 from ia_file_manager import ia_file_manager  # noqa: E402
 from ia_get_dataset_colormap import create_pascal_label_colormap  # noqa: E402
 from ia_logging import ia_logging  # noqa: E402
-from ia_sam_manager import get_sam_mask_generator  # noqa: E402
+from ia_sam_manager import get_sam_mask_generator, sam_autotune_threads  # noqa: E402
+from ia_sam_prefetch import sam_prefetcher  # noqa: E402
 from ia_ui_items import get_sam_model_ids  # noqa: E402
 
 
@@ -72,6 +73,7 @@ def check_inputs_generate_sam_masks(
         input_image: Union[np.ndarray, Image.Image],
         sam_id: str,
         anime_style_chk: bool = False,
+        preview_size: Optional[int] = None,
         ) -> None:
     """Check generate SAM masks inputs.
 
@@ -79,6 +81,7 @@ def check_inputs_generate_sam_masks(
         input_image (Union[np.ndarray, Image.Image]): input image
         sam_id (str): SAM ID
         anime_style_chk (bool): anime style check
+        preview_size (Optional[int]): preview input size of the image encoder
 
     Returns:
         None
@@ -92,6 +95,9 @@ def check_inputs_generate_sam_masks(
     if anime_style_chk is None or not isinstance(anime_style_chk, bool):
         raise ValueError("Invalid anime style check")
 
+    if preview_size is not None and (not isinstance(preview_size, int) or preview_size <= 0 or preview_size % 16 != 0):
+        raise ValueError("Invalid preview size")
+
 
 def convert_input_image(input_image: Union[np.ndarray, Image.Image]) -> np.ndarray:
     """Convert input image.
@@ -118,6 +124,7 @@ def generate_sam_masks(
         input_image: Union[np.ndarray, Image.Image],
         sam_id: str,
         anime_style_chk: bool = False,
+        preview_size: Optional[int] = None,
         ) -> List[Dict[str, Any]]:
     """Generate SAM masks.
 
@@ -125,18 +132,23 @@ def generate_sam_masks(
         input_image (Union[np.ndarray, Image.Image]): input image
         sam_id (str): SAM ID
         anime_style_chk (bool): anime style check
+        preview_size (Optional[int]): run the image encoder at this input size (e.g. 512 or 768)
+            for a fast, lower quality preview. None for full resolution.
 
     Returns:
         List[Dict[str, Any]]: SAM masks
     """
-    check_inputs_generate_sam_masks(input_image, sam_id, anime_style_chk)
+    check_inputs_generate_sam_masks(input_image, sam_id, anime_style_chk, preview_size)
     input_image = convert_input_image(input_image)
 
     sam_checkpoint = sam_file_path(sam_id)
-    sam_mask_generator = get_sam_mask_generator(sam_checkpoint, anime_style_chk)
-    ia_logging.info(f"{sam_mask_generator.__class__.__name__} {sam_id}")
+    with sam_prefetcher.foreground(), sam_autotune_threads(sam_checkpoint):
+        sam_prefetcher.wait(sam_checkpoint)
+        sam_mask_generator = get_sam_mask_generator(sam_checkpoint, anime_style_chk, preview_size)
+        ia_logging.info(f"{sam_mask_generator.__class__.__name__} {sam_id}" +
+                        (f" (preview {preview_size})" if preview_size is not None else ""))
 
-    sam_masks = sam_mask_generator.generate(input_image)
+        sam_masks = sam_mask_generator.generate(input_image)
 
     if anime_style_chk:
         for sam_mask in sam_masks:
@@ -10,37 +10,42 @@ from functools import partial
 
 from .modeling import ImageEncoderViT, MaskDecoder, PromptEncoder, Sam, TwoWayTransformer, TinyViT
 
+from ia_sam_loading import load_checkpoint, load_state_dict, skip_init
 
-def build_sam_vit_h(checkpoint=None):
+
+def build_sam_vit_h(checkpoint=None, attn_impl="eager"):
     return _build_sam(
         encoder_embed_dim=1280,
         encoder_depth=32,
         encoder_num_heads=16,
         encoder_global_attn_indexes=[7, 15, 23, 31],
         checkpoint=checkpoint,
+        attn_impl=attn_impl,
     )
 
 
 build_sam = build_sam_vit_h
 
 
-def build_sam_vit_l(checkpoint=None):
+def build_sam_vit_l(checkpoint=None, attn_impl="eager"):
     return _build_sam(
         encoder_embed_dim=1024,
         encoder_depth=24,
         encoder_num_heads=16,
         encoder_global_attn_indexes=[5, 11, 17, 23],
         checkpoint=checkpoint,
+        attn_impl=attn_impl,
     )
 
 
-def build_sam_vit_b(checkpoint=None):
+def build_sam_vit_b(checkpoint=None, attn_impl="eager"):
     return _build_sam(
         encoder_embed_dim=768,
         encoder_depth=12,
         encoder_num_heads=12,
         encoder_global_attn_indexes=[2, 5, 8, 11],
         checkpoint=checkpoint,
+        attn_impl=attn_impl,
     )
 
 
@@ -49,48 +54,49 @@ def build_sam_vit_t(checkpoint=None):
     image_size = 1024
     vit_patch_size = 16
     image_embedding_size = image_size // vit_patch_size
-    mobile_sam = Sam(
-            image_encoder=TinyViT(
-                img_size=1024, in_chans=3, num_classes=1000,
-                embed_dims=[64, 128, 160, 320],
-                depths=[2, 2, 6, 2],
-                num_heads=[2, 4, 5, 10],
-                window_sizes=[7, 7, 14, 7],
-                mlp_ratio=4.,
-                drop_rate=0.,
-                drop_path_rate=0.0,
-                use_checkpoint=False,
-                mbconv_expand_ratio=4.0,
-                local_conv_size=3,
-                layer_lr_decay=0.8
-            ),
-            prompt_encoder=PromptEncoder(
-                embed_dim=prompt_embed_dim,
-                image_embedding_size=(image_embedding_size, image_embedding_size),
-                input_image_size=(image_size, image_size),
-                mask_in_chans=16,
-            ),
-            mask_decoder=MaskDecoder(
-                    num_multimask_outputs=3,
-                    transformer=TwoWayTransformer(
-                        depth=2,
-                        embedding_dim=prompt_embed_dim,
-                        mlp_dim=2048,
-                        num_heads=8,
-                    ),
-                    transformer_dim=prompt_embed_dim,
-                    iou_head_depth=3,
-                    iou_head_hidden_dim=256,
+    with skip_init(checkpoint is not None):
+        mobile_sam = Sam(
+                image_encoder=TinyViT(
+                    img_size=1024, in_chans=3, num_classes=1000,
+                    embed_dims=[64, 128, 160, 320],
+                    depths=[2, 2, 6, 2],
+                    num_heads=[2, 4, 5, 10],
+                    window_sizes=[7, 7, 14, 7],
+                    mlp_ratio=4.,
+                    drop_rate=0.,
+                    drop_path_rate=0.0,
+                    use_checkpoint=False,
+                    mbconv_expand_ratio=4.0,
+                    local_conv_size=3,
+                    layer_lr_decay=0.8
                 ),
-            pixel_mean=[123.675, 116.28, 103.53],
-            pixel_std=[58.395, 57.12, 57.375],
-        )
+                prompt_encoder=PromptEncoder(
+                    embed_dim=prompt_embed_dim,
+                    image_embedding_size=(image_embedding_size, image_embedding_size),
+                    input_image_size=(image_size, image_size),
+                    mask_in_chans=16,
+                ),
+                mask_decoder=MaskDecoder(
+                        num_multimask_outputs=3,
+                        transformer=TwoWayTransformer(
+                            depth=2,
+                            embedding_dim=prompt_embed_dim,
+                            mlp_dim=2048,
+                            num_heads=8,
+                        ),
+                        transformer_dim=prompt_embed_dim,
+                        iou_head_depth=3,
+                        iou_head_hidden_dim=256,
+                    ),
+                pixel_mean=[123.675, 116.28, 103.53],
+                pixel_std=[58.395, 57.12, 57.375],
+            )
 
-    mobile_sam.eval()
     if checkpoint is not None:
-        with open(checkpoint, "rb") as f:
-            state_dict = torch.load(f)
-        mobile_sam.load_state_dict(state_dict)
+        state_dict = load_checkpoint(checkpoint)
+        load_state_dict(mobile_sam, state_dict)
+    # eval() also computes the eval-mode attention biases from the loaded weights
+    mobile_sam.eval()
     return mobile_sam
 
 
@@ -109,50 +115,52 @@ def _build_sam(
     encoder_num_heads,
     encoder_global_attn_indexes,
     checkpoint=None,
+    attn_impl="eager",
 ):
     prompt_embed_dim = 256
     image_size = 1024
     vit_patch_size = 16
     image_embedding_size = image_size // vit_patch_size
-    sam = Sam(
-        image_encoder=ImageEncoderViT(
-            depth=encoder_depth,
-            embed_dim=encoder_embed_dim,
-            img_size=image_size,
-            mlp_ratio=4,
-            norm_layer=partial(torch.nn.LayerNorm, eps=1e-6),
-            num_heads=encoder_num_heads,
-            patch_size=vit_patch_size,
-            qkv_bias=True,
-            use_rel_pos=True,
-            global_attn_indexes=encoder_global_attn_indexes,
-            window_size=14,
-            out_chans=prompt_embed_dim,
-        ),
-        prompt_encoder=PromptEncoder(
-            embed_dim=prompt_embed_dim,
-            image_embedding_size=(image_embedding_size, image_embedding_size),
-            input_image_size=(image_size, image_size),
-            mask_in_chans=16,
-        ),
-        mask_decoder=MaskDecoder(
-            num_multimask_outputs=3,
-            transformer=TwoWayTransformer(
-                depth=2,
-                embedding_dim=prompt_embed_dim,
-                mlp_dim=2048,
-                num_heads=8,
+    with skip_init(checkpoint is not None):
+        sam = Sam(
+            image_encoder=ImageEncoderViT(
+                depth=encoder_depth,
+                embed_dim=encoder_embed_dim,
+                img_size=image_size,
+                mlp_ratio=4,
+                norm_layer=partial(torch.nn.LayerNorm, eps=1e-6),
+                num_heads=encoder_num_heads,
+                patch_size=vit_patch_size,
+                qkv_bias=True,
+                use_rel_pos=True,
+                global_attn_indexes=encoder_global_attn_indexes,
+                window_size=14,
+                out_chans=prompt_embed_dim,
+                attn_impl=attn_impl,
             ),
-            transformer_dim=prompt_embed_dim,
-            iou_head_depth=3,
-            iou_head_hidden_dim=256,
-        ),
-        pixel_mean=[123.675, 116.28, 103.53],
-        pixel_std=[58.395, 57.12, 57.375],
-    )
-    sam.eval()
+            prompt_encoder=PromptEncoder(
+                embed_dim=prompt_embed_dim,
+                image_embedding_size=(image_embedding_size, image_embedding_size),
+                input_image_size=(image_size, image_size),
+                mask_in_chans=16,
+            ),
+            mask_decoder=MaskDecoder(
+                num_multimask_outputs=3,
+                transformer=TwoWayTransformer(
+                    depth=2,
+                    embedding_dim=prompt_embed_dim,
+                    mlp_dim=2048,
+                    num_heads=8,
+                ),
+                transformer_dim=prompt_embed_dim,
+                iou_head_depth=3,
+                iou_head_hidden_dim=256,
+            ),
+            pixel_mean=[123.675, 116.28, 103.53],
+            pixel_std=[58.395, 57.12, 57.375],
+        )
     if checkpoint is not None:
-        with open(checkpoint, "rb") as f:
-            state_dict = torch.load(f)
-        sam.load_state_dict(state_dict)
+        state_dict = load_checkpoint(checkpoint)
+        load_state_dict(sam, state_dict)
+    sam.eval()
     return sam
@@ -142,3 +142,46 @@ class SamOnnxModel(nn.Module):
             return upscaled_masks, scores, stability_scores, areas, masks
 
         return upscaled_masks, scores, masks
+
+
+class SamOnnxImageEncoder(nn.Module):
+    """
+    This model should not be called directly, but is used in ONNX export of the
+    image encoder. It takes a preprocessed (normalized and padded) image.
+    """
+
+    def __init__(self, model: Sam) -> None:
+        super().__init__()
+        self.image_encoder = model.image_encoder
+
+    @torch.no_grad()
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        return self.image_encoder(image)
+
+
+class SamOnnxMaskDecoder(nn.Module):
+    """
+    This model should not be called directly, but is used in ONNX export of the
+    mask decoder. It takes the outputs of the prompt encoder and returns the
+    masks and IoU predictions of all mask tokens; the multimask selection of
+    MaskDecoder.forward is left to the caller.
+    """
+
+    def __init__(self, model: Sam) -> None:
+        super().__init__()
+        self.mask_decoder = model.mask_decoder
+
+    @torch.no_grad()
+    def forward(
+        self,
+        image_embeddings: torch.Tensor,
+        image_pe: torch.Tensor,
+        sparse_prompt_embeddings: torch.Tensor,
+        dense_prompt_embeddings: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.mask_decoder.predict_masks(
+            image_embeddings=image_embeddings,
+            image_pe=image_pe,
+            sparse_prompt_embeddings=sparse_prompt_embeddings,
+            dense_prompt_embeddings=dense_prompt_embeddings,
+        )
@@ -1,15 +1,126 @@
+from typing import Callable
+
 import torch
 from torchvision.ops.boxes import box_iou
 
 
-def nms(bboxes: torch.Tensor, scores: torch.Tensor, iou_threshold: float) -> torch.Tensor:
-    order = torch.argsort(-scores).to(bboxes.device)
-    indices = torch.arange(bboxes.shape[0]).to(bboxes.device)
-    keep = torch.ones_like(indices, dtype=torch.bool).to(bboxes.device)
-    for i in indices:
-        if keep[i]:
-            bbox = bboxes[order[i]]
-            iou = box_iou(bbox[None, ...], (bboxes[order[i + 1:]]) * keep[i + 1:][..., None])
-            overlapped = torch.nonzero(iou > iou_threshold)
-            keep[overlapped + i + 1] = 0
+def _resolve_block(suppression: torch.Tensor, candidates: torch.Tensor) -> torch.Tensor:
+    """Greedy NMS within a block of boxes in score order.
+
+    suppression[i, j] is True if box i overlaps box j above the threshold, and
+    candidates marks the boxes not suppressed by earlier blocks. Box j is kept
+    if no kept box before it suppresses it. Each box only depends on earlier
+    ones, so iterating this rule from all candidates reaches the greedy result
+    as its fixed point.
+    """
+    suppression = torch.triu(suppression, diagonal=1)
+    keep = candidates
+    while True:
+        next_keep = candidates & ~(suppression & keep[:, None]).any(dim=0)
+        if torch.equal(next_keep, keep):
+            return keep
+        keep = next_keep
+
+
+def _greedy_nms(
+    order: torch.Tensor,
+    suppresses: Callable[[torch.Tensor, torch.Tensor], torch.Tensor],
+    tile_size: int,
+) -> torch.Tensor:
+    """Greedy NMS over indices in score order, computing overlaps in tiles.
+
+    suppresses(a, b) returns the (len(a), len(b)) matrix of index pairs that
+    overlap above the threshold.
+    """
+    keep = torch.zeros(len(order), dtype=torch.bool, device=order.device)
+    kept = order[:0]
+    for start in range(0, len(order), tile_size):
+        block = order[start:start + tile_size]
+        candidates = torch.ones(len(block), dtype=torch.bool, device=order.device)
+        for kept_start in range(0, len(kept), tile_size):
+            candidates &= ~suppresses(kept[kept_start:kept_start + tile_size], block).any(dim=0)
+        block_keep = _resolve_block(suppresses(block, block), candidates)
+        keep[start:start + tile_size] = block_keep
+        kept = torch.cat([kept, block[block_keep]])
     return order[keep]
+
+
+def nms(bboxes: torch.Tensor, scores: torch.Tensor, iou_threshold: float, tile_size: int = 1024) -> torch.Tensor:
+    """Non-maximum suppression by box IoU, with the same result as torchvision.ops.nms.
+
+    Args:
+        bboxes (torch.Tensor): boxes in XYXY format, shape (N, 4)
+        scores (torch.Tensor): scores, shape (N,)
+        iou_threshold (float): boxes with a higher IoU than a kept box are discarded
+        tile_size (int, optional): boxes compared at once. Defaults to 1024.
+
+    Returns:
+        torch.Tensor: indices of the kept boxes in decreasing score order
+    """
+    # Stable like torchvision, so boxes with equal scores are visited in the same order
+    order = torch.sort(scores, descending=True, stable=True).indices.to(bboxes.device)
+
+    def suppresses(a, b):
+        return box_iou(bboxes[a], bboxes[b]) > iou_threshold
+
+    return _greedy_nms(order, suppresses, tile_size)
+
+
+def _popcount(x: torch.Tensor) -> torch.Tensor:
+    """Number of set bits of each int64 word (SWAR bit counting)."""
+    x = x - ((x >> 1) & 0x5555555555555555)
+    x = (x & 0x3333333333333333) + ((x >> 2) & 0x3333333333333333)
+    x = (x + (x >> 4)) & 0x0F0F0F0F0F0F0F0F
+    return (x * 0x0101010101010101) >> 56
+
+
+def _unpack_bits(packed: torch.Tensor) -> torch.Tensor:
+    """Unpack uint8 rows of shape (N, B) to float32 0/1 rows of shape (N, 8 * B)."""
+    shifts = torch.arange(8, dtype=torch.uint8, device=packed.device)
+    return ((packed[..., None] >> shifts) & 1).reshape(len(packed), -1).to(torch.float32)
+
+
+def mask_nms(
+    packed_masks: torch.Tensor,
+    scores: torch.Tensor,
+    iou_threshold: float,
+    tile_size: int = 64,
+    chunk_bytes: int = 2 ** 13,
+) -> torch.Tensor:
+    """Non-maximum suppression by mask IoU over bit-packed masks.
+
+    Box NMS only compares bounding boxes, so it keeps duplicate masks whose
+    boxes differ and cannot tell apart different masks with the same box.
+
+    Intersections are computed as matrix products of the unpacked masks, a
+    chunk of pixels at a time. Every chunk sum is an integer below 2 ** 24,
+    so it is exact in float32.
+
+    Args:
+        packed_masks (torch.Tensor): uint8 masks packed with np.packbits, all
+            in the same layout, shape (N, ...)
+        scores (torch.Tensor): scores, shape (N,)
+        iou_threshold (float): masks with a higher IoU than a kept mask are discarded
+        tile_size (int, optional): masks compared at once. Defaults to 64.
+        chunk_bytes (int, optional): packed bytes of each mask unpacked at once,
+            bounds the temporary memory. Defaults to 2 ** 13.
+
+    Returns:
+        torch.Tensor: indices of the kept masks in decreasing score order
+    """
+    packed_masks = packed_masks.reshape(len(packed_masks), -1)
+    padding = -packed_masks.shape[1] % 8
+    words = torch.nn.functional.pad(packed_masks, (0, padding)) if padding > 0 else packed_masks
+    areas = _popcount(words.contiguous().view(torch.int64)).sum(dim=1)
+    order = torch.sort(scores, descending=True, stable=True).indices.to(packed_masks.device)
+
+    def suppresses(a, b):
+        intersections = torch.zeros((len(a), len(b)), dtype=torch.int64, device=packed_masks.device)
+        for start in range(0, packed_masks.shape[1], chunk_bytes):
+            a_bits = _unpack_bits(packed_masks[a, start:start + chunk_bytes])
+            b_bits = _unpack_bits(packed_masks[b, start:start + chunk_bytes])
+            intersections += (a_bits @ b_bits.T).to(torch.int64)
+        unions = areas[a, None] + areas[None, b] - intersections
+        return intersections > iou_threshold * unions
+
+    return _greedy_nms(order, suppresses, tile_size)
@@ -4,6 +4,7 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import cv2  # type: ignore
 import numpy as np
 import torch
 from torch.nn import functional as F
@@ -18,17 +19,30 @@ class ResizeLongestSide:
     Resizes images to the longest side 'target_length', as well as provides
     methods for resizing coordinates and boxes. Provides methods for
     transforming both numpy array and batched torch tensors.
+
+    Arguments:
+      target_length (int): The length of the longest side after resizing.
+      use_cv2 (bool): If True, apply_image resizes with cv2 (INTER_AREA when
+        shrinking, INTER_LINEAR when enlarging), which avoids the round trip
+        through PIL but does not match its antialiased bilinear resize
+        exactly. If False, apply_image resizes with PIL as before.
     """
 
-    def __init__(self, target_length: int) -> None:
+    def __init__(self, target_length: int, use_cv2: bool = False) -> None:
         self.target_length = target_length
+        self.use_cv2 = use_cv2
 
     def apply_image(self, image: np.ndarray) -> np.ndarray:
         """
         Expects a numpy array with shape HxWxC in uint8 format.
         """
         target_size = self.get_preprocess_shape(image.shape[0], image.shape[1], self.target_length)
-        return np.array(resize(to_pil_image(image), target_size))
+        if not self.use_cv2:
+            return np.array(resize(to_pil_image(image), target_size))
+
+        interpolation = cv2.INTER_AREA if target_size[0] < image.shape[0] else cv2.INTER_LINEAR
+        resized = cv2.resize(np.ascontiguousarray(image), target_size[::-1], interpolation=interpolation)
+        return resized[:, :, None] if resized.ndim == 2 else resized
 
     def apply_coords(self, coords: np.ndarray, original_size: Tuple[int, ...]) -> np.ndarray:
         """
@@ -9,7 +9,8 @@ import torch
 
 from segment_anything.modeling import Sam
 
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from .utils.transforms import ResizeLongestSide
 
@@ -18,6 +19,7 @@ class SamPredictor:
     def __init__(
         self,
         sam_model: Sam,
+        use_cv2_resize: bool = False,
     ) -> None:
         """
         Uses SAM to calculate the image embedding for an image, and then
@@ -25,16 +27,20 @@ class SamPredictor:
 
         Arguments:
           sam_model (Sam): The model to use for mask prediction.
+          use_cv2_resize (bool): If True, images are resized with cv2 instead
+            of PIL. This is faster, but the resized pixels differ slightly
+            from the PIL resize the model was trained with.
         """
         super().__init__()
         self.model = sam_model
-        self.transform = ResizeLongestSide(sam_model.image_encoder.img_size)
+        self.transform = ResizeLongestSide(sam_model.image_encoder.img_size, use_cv2=use_cv2_resize)
         self.reset_image()
 
     def set_image(
         self,
         image: np.ndarray,
         image_format: str = "RGB",
+        target_length: Optional[int] = None,
     ) -> None:
         """
         Calculates the image embeddings for the provided image, allowing
@@ -44,6 +50,10 @@ class SamPredictor:
           image (np.ndarray): The image for calculating masks. Expects an
             image in HWC uint8 format, with pixel values in [0, 255].
           image_format (str): The color format of the image, in ['RGB', 'BGR'].
+          target_length (int or None): Long side the image is resized to for a
+            reduced resolution (preview) encoding, e.g. 512 or 768. Must be a
+            multiple of the patch size. Ignored if the image encoder does not
+            support it. If None, image_encoder.img_size is used.
         """
         assert image_format in [
             "RGB",
@@ -53,17 +63,20 @@ class SamPredictor:
             image = image[..., ::-1]
 
         # Transform the image to the form expected by the model
-        input_image = self.transform.apply_image(image)
+        target_length = self.get_target_length(target_length)
+        input_image = self.get_transform(target_length).apply_image(image)
         input_image_torch = torch.as_tensor(input_image, device=self.device)
-        input_image_torch = input_image_torch.permute(2, 0, 1).contiguous()[None, :, :, :]
+        # preprocess copies into a new buffer, so the permuted view needs no contiguous copy
+        input_image_torch = input_image_torch.permute(2, 0, 1)[None, :, :, :]
 
-        self.set_torch_image(input_image_torch, image.shape[:2])
+        self.set_torch_image(input_image_torch, image.shape[:2], target_length)
 
     @torch.no_grad()
     def set_torch_image(
         self,
         transformed_image: torch.Tensor,
         original_image_size: Tuple[int, ...],
+        target_length: Optional[int] = None,
     ) -> None:
         """
         Calculates the image embeddings for the provided image, allowing
@@ -75,20 +88,153 @@ class SamPredictor:
             1x3xHxW, which has been transformed with ResizeLongestSide.
           original_image_size (tuple(int, int)): The size of the image
             before transformation, in (H, W) format.
+          target_length (int or None): The long side the image was resized
+            to, if it differs from image_encoder.img_size.
         """
+        target_length = self.get_target_length(target_length)
         assert (
             len(transformed_image.shape) == 4
             and transformed_image.shape[1] == 3
-            and max(*transformed_image.shape[2:]) == self.model.image_encoder.img_size
-        ), f"set_torch_image input must be BCHW with long side {self.model.image_encoder.img_size}."
+            and max(*transformed_image.shape[2:]) == target_length
+        ), f"set_torch_image input must be BCHW with long side {target_length}."
         self.reset_image()
 
         self.original_size = original_image_size
         self.input_size = tuple(transformed_image.shape[-2:])
-        input_image = self.model.preprocess(transformed_image)
+        self.target_length = target_length
+        input_image = self.model.preprocess(transformed_image, target_length)
         self.features = self.model.image_encoder(input_image)
         self.is_image_set = True
 
+    @torch.no_grad()
+    def encode_images(
+        self,
+        images: List[np.ndarray],
+        image_format: str = "RGB",
+        target_length: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Calculates the image embeddings for several images in a single batched
+        forward of the image encoder. Each returned entry can be passed to
+        'set_features' to predict masks for that image.
+
+        Arguments:
+          images (list(np.ndarray)): The images for calculating masks, each in
+            HWC uint8 format, with pixel values in [0, 255].
+          image_format (str): The color format of the images, in ['RGB', 'BGR'].
+          target_length (int or None): Long side the images are resized to for
+            a reduced resolution (preview) encoding. See 'set_image'.
+
+        Returns:
+          (list(dict)): For each image, the 'features', 'original_size' and
+            'input_size' to pass to 'set_features'.
+        """
+        return list(self.iter_encode_images(images, image_format, target_length, batch_size=max(1, len(images))))
+
+    @torch.no_grad()
+    def iter_encode_images(
+        self,
+        images: List[np.ndarray],
+        image_format: str = "RGB",
+        target_length: Optional[int] = None,
+        batch_size: int = 1,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Calculates the image embeddings like 'encode_images', one batch of images
+        at a time. The next batch is resized, normalized and padded on a worker
+        thread while the image encoder runs the current batch.
+
+        Arguments:
+          images (list(np.ndarray)): The images for calculating masks, each in
+            HWC uint8 format, with pixel values in [0, 255].
+          image_format (str): The color format of the images, in ['RGB', 'BGR'].
+          target_length (int or None): Long side the images are resized to for
+            a reduced resolution (preview) encoding. See 'set_image'.
+          batch_size (int): The number of images per image encoder forward.
+
+        Returns:
+          (iterator(dict)): The entries of 'encode_images', in the order of images.
+        """
+        assert image_format in [
+            "RGB",
+            "BGR",
+        ], f"image_format must be in ['RGB', 'BGR'], is {image_format}."
+        target_length = self.get_target_length(target_length)
+        batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+        if len(batches) == 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_batch = executor.submit(self._prepare_images, batches[0], image_format, target_length)
+            for i in range(len(batches)):
+                input_images, image_infos = next_batch.result()
+                if i + 1 < len(batches):
+                    next_batch = executor.submit(self._prepare_images, batches[i + 1], image_format, target_length)
+                yield from self._encode_prepared_images(input_images, image_infos)
+                del input_images
+
+    @torch.no_grad()
+    def _prepare_images(
+        self,
+        images: List[np.ndarray],
+        image_format: str,
+        target_length: int,
+    ) -> Tuple[torch.Tensor, List[Dict[str, Any]]]:
+        transform = self.get_transform(target_length)
+        input_images = []
+        image_infos = []
+        for image in images:
+            if image_format != self.model.image_format:
+                image = image[..., ::-1]
+            input_image = transform.apply_image(image)
+            input_image_torch = torch.as_tensor(input_image, device=self.device).permute(2, 0, 1)[None, :, :, :]
+            input_images.append(self.model.preprocess(input_image_torch, target_length))
+            image_infos.append(dict(
+                original_size=image.shape[:2],
+                input_size=tuple(input_image_torch.shape[-2:]),
+                target_length=target_length,
+            ))
+        input_images = input_images[0] if len(input_images) == 1 else torch.cat(input_images, dim=0)
+        return input_images, image_infos
+
+    def _encode_prepared_images(
+        self,
+        input_images: torch.Tensor,
+        image_infos: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        features = self.model.image_encoder(input_images)
+        for i, image_info in enumerate(image_infos):
+            image_info["features"] = features[i:i + 1]
+        return image_infos
+
+    def set_features(
+        self,
+        features: torch.Tensor,
+        original_size: Tuple[int, ...],
+        input_size: Tuple[int, ...],
+        target_length: Optional[int] = None,
+    ) -> None:
+        """
+        Sets precomputed image embeddings, e.g. from 'encode_images', allowing
+        masks to be predicted with the 'predict' method.
+
+        Arguments:
+          features (torch.Tensor): The image embeddings with shape 1xCxHxW.
+          original_size (tuple(int, int)): The size of the image before
+            transformation, in (H, W) format.
+          input_size (tuple(int, int)): The size of the image after
+            ResizeLongestSide, in (H, W) format.
+          target_length (int or None): The long side the image was resized
+            to, if it differs from image_encoder.img_size.
+        """
+        self.reset_image()
+
+        self.original_size = original_size
+        self.input_size = input_size
+        self.target_length = self.get_target_length(target_length)
+        self.features = features
+        self.is_image_set = True
+
     def predict(
         self,
         point_coords: Optional[np.ndarray] = None,
@@ -111,7 +257,7 @@ class SamPredictor:
             model, in XYXY format.
           mask_input (np.ndarray): A low resolution mask input to the model, typically
             coming from a previous prediction iteration. Has form 1xHxW, where
-            for SAM, H=W=256.
+            for SAM, H=W=256 (target_length / 4 for a preview encoding).
           multimask_output (bool): If true, the model will return three masks.
             For ambiguous input prompts (such as a single click), this will often
             produce better masks than a single prediction. If only a single
@@ -174,6 +320,7 @@ class SamPredictor:
         mask_input: Optional[torch.Tensor] = None,
         multimask_output: bool = True,
         return_logits: bool = False,
+        upscale_masks: bool = True,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         Predict masks for the given input prompts, using the currently set image.
@@ -200,10 +347,13 @@ class SamPredictor:
             input prompts, multimask_output=False can give better results.
           return_logits (bool): If true, returns un-thresholded masks logits
             instead of a binary mask.
+          upscale_masks (bool): If false, the masks are not upscaled to the
+            original image size and None is returned in their place, so the
+            low res logits can be filtered before upscaling.
 
         Returns:
-          (torch.Tensor): The output masks in BxCxHxW format, where C is the
-            number of masks, and (H, W) is the original image size.
+          (torch.Tensor or None): The output masks in BxCxHxW format, where C
+            is the number of masks, and (H, W) is the original image size.
           (torch.Tensor): An array of shape BxC containing the model's
             predictions for the quality of each mask.
           (torch.Tensor): An array of shape BxCxHxW, where C is the number
@@ -219,23 +369,28 @@ class SamPredictor:
             points = None
 
         # Embed prompts
+        image_embedding_size = tuple(self.features.shape[-2:])
         sparse_embeddings, dense_embeddings = self.model.prompt_encoder(
             points=points,
             boxes=boxes,
             masks=mask_input,
+            image_embedding_size=image_embedding_size,
         )
 
         # Predict masks
         low_res_masks, iou_predictions = self.model.mask_decoder(
             image_embeddings=self.features,
-            image_pe=self.model.prompt_encoder.get_dense_pe(),
+            image_pe=self.model.prompt_encoder.get_dense_pe(image_embedding_size),
             sparse_prompt_embeddings=sparse_embeddings,
             dense_prompt_embeddings=dense_embeddings,
             multimask_output=multimask_output,
         )
 
+        if not upscale_masks:
+            return None, iou_predictions, low_res_masks
+
         # Upscale the masks to the original image resolution
-        masks = self.model.postprocess_masks(low_res_masks, self.input_size, self.original_size)
+        masks = self.model.postprocess_masks(low_res_masks, self.input_size, self.original_size, self.target_length)
 
         if not return_logits:
             masks = masks > self.model.mask_threshold
@@ -259,10 +414,39 @@ class SamPredictor:
     def device(self) -> torch.device:
         return self.model.device
 
+    @property
+    def supports_target_length(self) -> bool:
+        """
+        Whether the image encoder can run at a reduced resolution, which needs
+        a resampled absolute positional embedding (ViT encoders).
+        """
+        return getattr(self.model.image_encoder, "pos_embed", None) is not None
+
+    def get_target_length(self, target_length: Optional[int] = None) -> int:
+        """
+        Returns the long side images are resized to, falling back to
+        image_encoder.img_size if target_length is None or not supported.
+        """
+        img_size = self.model.image_encoder.img_size
+        if target_length is None or target_length >= img_size or not self.supports_target_length:
+            return img_size
+        return int(target_length)
+
+    def get_transform(self, target_length: int) -> ResizeLongestSide:
+        """
+        Returns the image transform for a target length. Prompts are always
+        transformed with self.transform, since the prompt encoder normalizes
+        coordinates by its own input size, which matches any target length.
+        """
+        if target_length == self.transform.target_length:
+            return self.transform
+        return ResizeLongestSide(target_length, use_cv2=self.transform.use_cv2)
+
     def reset_image(self) -> None:
         """Resets the currently set image."""
         self.is_image_set = False
         self.features = None
+        self.target_length = None
         self.orig_h = None
         self.orig_w = None
         self.input_h = None
@@ -17,6 +17,10 @@ class MaskData:
     """
     A structure for storing masks and their related data in batched format.
     Implements basic filtering and concatenation.
+
+    Tensor and array columns are stored in buffers that grow by doubling
+    their capacity, so concatenating many batches copies each row a constant
+    number of times. Reading a column returns a view of its valid rows.
     """
 
     def __init__(self, **kwargs) -> None:
@@ -25,54 +29,116 @@ class MaskData:
                 v, (list, np.ndarray, torch.Tensor)
             ), "MaskData only supports list, numpy arrays, and torch tensors."
         self._stats = dict(**kwargs)
+        # Number of valid rows of the columns stored in a growable buffer
+        self._lengths: Dict[str, int] = {}
 
     def __setitem__(self, key: str, item: Any) -> None:
         assert isinstance(
             item, (list, np.ndarray, torch.Tensor)
         ), "MaskData only supports list, numpy arrays, and torch tensors."
         self._stats[key] = item
+        self._lengths.pop(key, None)
 
     def __delitem__(self, key: str) -> None:
         del self._stats[key]
+        self._lengths.pop(key, None)
 
     def __getitem__(self, key: str) -> Any:
-        return self._stats[key]
+        v = self._stats[key]
+        if key in self._lengths:
+            return v[: self._lengths[key]]
+        return v
 
     def items(self) -> ItemsView[str, Any]:
-        return self._stats.items()
+        return {k: self[k] for k in self._stats}.items()
 
     def filter(self, keep: torch.Tensor) -> None:
-        for k, v in self._stats.items():
+        # Convert the keep mask once per device and format, not once per column
+        keep = torch.as_tensor(keep)
+        keep_by_device: Dict[torch.device, torch.Tensor] = {}
+        keep_np = None
+        keep_list = None
+        for k, v in self.items():
             if v is None:
                 self._stats[k] = None
             elif isinstance(v, torch.Tensor):
-                self._stats[k] = v[torch.as_tensor(keep, device=v.device)]
+                if v.device not in keep_by_device:
+                    keep_by_device[v.device] = keep.to(v.device)
+                self._stats[k] = v[keep_by_device[v.device]]
             elif isinstance(v, np.ndarray):
-                self._stats[k] = v[keep.detach().cpu().numpy()]
-            elif isinstance(v, list) and keep.dtype == torch.bool:
-                self._stats[k] = [a for i, a in enumerate(v) if keep[i]]
+                if keep_np is None:
+                    keep_np = keep.detach().cpu().numpy()
+                self._stats[k] = v[keep_np]
             elif isinstance(v, list):
-                self._stats[k] = [v[i] for i in keep]
+                if keep_list is None:
+                    keep_list = keep.detach().cpu().tolist()
+                if keep.dtype == torch.bool:
+                    self._stats[k] = [a for a, keep_a in zip(v, keep_list) if keep_a]
+                else:
+                    self._stats[k] = [v[i] for i in keep_list]
             else:
                 raise TypeError(f"MaskData key {k} has an unsupported type {type(v)}.")
+            self._lengths.pop(k, None)
 
     def cat(self, new_stats: "MaskData") -> None:
         for k, v in new_stats.items():
             if k not in self._stats or self._stats[k] is None:
-                self._stats[k] = deepcopy(v)
-            elif isinstance(v, torch.Tensor):
-                self._stats[k] = torch.cat([self._stats[k], v], dim=0)
-            elif isinstance(v, np.ndarray):
-                self._stats[k] = np.concatenate([self._stats[k], v], axis=0)
+                # Batches are not reused after they are concatenated, so the
+                # first one is taken over without a copy
+                self._stats[k] = list(v) if isinstance(v, list) else v
+                self._lengths.pop(k, None)
+            elif isinstance(v, (torch.Tensor, np.ndarray)):
+                self._append(k, v)
             elif isinstance(v, list):
-                self._stats[k] = self._stats[k] + deepcopy(v)
+                self._stats[k].extend(v)
             else:
                 raise TypeError(f"MaskData key {k} has an unsupported type {type(v)}.")
 
+    def _append(self, key: str, v: Any) -> None:
+        buffer = self._stats[key]
+        length = self._lengths.get(key, len(buffer))
+        if isinstance(v, torch.Tensor):
+            compatible = (
+                isinstance(buffer, torch.Tensor)
+                and buffer.dtype == v.dtype
+                and buffer.device == v.device
+                and buffer.shape[1:] == v.shape[1:]
+            )
+        else:
+            compatible = (
+                isinstance(buffer, np.ndarray)
+                and buffer.dtype == v.dtype
+                and buffer.shape[1:] == v.shape[1:]
+            )
+        if not compatible:
+            # Let torch.cat and np.concatenate promote or reject mixed columns
+            if isinstance(v, torch.Tensor):
+                self._stats[key] = torch.cat([buffer[:length], v], dim=0)
+            else:
+                self._stats[key] = np.concatenate([buffer[:length], v], axis=0)
+            self._lengths.pop(key, None)
+            return
+
+        new_length = length + len(v)
+        if new_length > len(buffer):
+            # Buffers are always newly allocated here, so columns handed in by
+            # the caller are never written to
+            capacity = max(new_length, 2 * len(buffer))
+            if isinstance(buffer, torch.Tensor):
+                grown = buffer.new_empty((capacity, *buffer.shape[1:]))
+            else:
+                grown = np.empty((capacity, *buffer.shape[1:]), dtype=buffer.dtype)
+            grown[:length] = buffer[:length]
+            buffer = grown
+            self._stats[key] = buffer
+        buffer[length:new_length] = v
+        self._lengths[key] = new_length
+
     def to_numpy(self) -> None:
-        for k, v in self._stats.items():
+        for k, v in self.items():
             if isinstance(v, torch.Tensor):
                 self._stats[k] = v.detach().cpu().numpy()
+                self._lengths.pop(k, None)
 
 
 def is_box_near_crop_edge(
@@ -104,51 +170,117 @@ def batch_iterator(batch_size: int, *args) -> Generator[List[Any], None, None]:
         yield [arg[b * batch_size: (b + 1) * batch_size] for arg in args]
 
 
+def mask_to_rle_counts_pytorch(tensor: torch.Tensor) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes a batch of masks to uncompressed RLE counts in a single pass.
+    Returns the counts of all masks as one flat array and the offsets of
+    each mask in it, so the counts of mask i are
+    counts[offsets[i]:offsets[i + 1]].
+    """
+    b, h, w = tensor.shape
+    device = tensor.device
+
+    # Compute change indices in fortran order without a transposed copy of the
+    # masks: changes inside each column, and between the last pixel of a column
+    # and the first one of the next column. Only the changes are sorted by mask
+    # and then by position.
+    in_column = (tensor[:, 1:, :] ^ tensor[:, :-1, :]).nonzero()
+    across_columns = (tensor[:, -1, :-1] ^ tensor[:, 0, 1:]).nonzero()
+    change_keys = torch.cat([
+        in_column[:, 0] * (h * w) + in_column[:, 2] * h + in_column[:, 1],
+        across_columns[:, 0] * (h * w) + across_columns[:, 1] * h + (h - 1),
+    ])
+    del in_column, across_columns
+    change_keys = torch.sort(change_keys).values
+    change_indices = torch.stack([change_keys // (h * w), change_keys % (h * w)], dim=1)
+    del change_keys
+
+    # Each mask has one run per change plus the last one, and a leading
+    # zero count if it starts with a foreground pixel
+    num_runs = torch.bincount(change_indices[:, 0], minlength=b) + 1
+    lead = tensor[:, 0, 0].to(torch.int64)
+    num_counts = num_runs + lead
+    offsets = torch.zeros(b + 1, dtype=torch.int64, device=device)
+    offsets[1:] = num_counts.cumsum(0)
+
+    # Run ends: the change positions, and h*w closing the last run of each
+    # mask. Every earlier mask shifts the changes by its closing run.
+    run_ends = torch.full((int(num_runs.sum()),), h * w, dtype=torch.int64, device=device)
+    run_ends[torch.arange(len(change_indices), device=device) + change_indices[:, 0]] = change_indices[:, 1] + 1
+    run_starts = torch.zeros_like(run_ends)
+    run_starts[1:] = run_ends[:-1]
+    first_runs = num_runs.cumsum(0) - num_runs
+    run_starts[first_runs] = 0
+
+    # Scatter the run lengths behind the leading zeros
+    run_masks = torch.repeat_interleave(torch.arange(b, device=device), num_runs)
+    run_indices = torch.arange(len(run_ends), device=device) - first_runs[run_masks]
+    counts = torch.zeros(int(offsets[-1]), dtype=torch.int64, device=device)
+    counts[offsets[run_masks] + lead[run_masks] + run_indices] = run_ends - run_starts
+
+    return counts.cpu().numpy(), offsets.cpu().numpy()
+
+
 def mask_to_rle_pytorch(tensor: torch.Tensor) -> List[Dict[str, Any]]:
     """
     Encodes masks to an uncompressed RLE, in the format expected by
     pycoco tools.
     """
-    # Put in fortran order and flatten h,w
-    b, h, w = tensor.shape
-    tensor = tensor.permute(0, 2, 1).flatten(1)
-
-    # Compute change indices
-    diff = tensor[:, 1:] ^ tensor[:, :-1]
-    change_indices = diff.nonzero()
-
-    # Encode run length
-    out = []
-    for i in range(b):
-        cur_idxs = change_indices[change_indices[:, 0] == i, 1]
-        cur_idxs = torch.cat(
-            [
-                torch.tensor([0], dtype=cur_idxs.dtype, device=cur_idxs.device),
-                cur_idxs + 1,
-                torch.tensor([h * w], dtype=cur_idxs.dtype, device=cur_idxs.device),
-            ]
-        )
-        btw_idxs = cur_idxs[1:] - cur_idxs[:-1]
-        counts = [] if tensor[i, 0] == 0 else [0]
-        counts.extend(btw_idxs.detach().cpu().tolist())
-        out.append({"size": [h, w], "counts": counts})
-    return out
+    _, h, w = tensor.shape
+    counts, offsets = mask_to_rle_counts_pytorch(tensor)
+    counts = counts.tolist()
+    offsets = offsets.tolist()
+    return [{"size": [h, w], "counts": counts[start:end]} for start, end in zip(offsets[:-1], offsets[1:])]
 
 
 def rle_to_mask(rle: Dict[str, Any]) -> np.ndarray:
     """Compute a binary mask from an uncompressed RLE."""
     h, w = rle["size"]
-    mask = np.empty(h * w, dtype=bool)
-    idx = 0
-    parity = False
-    for count in rle["counts"]:
-        mask[idx: idx + count] = parity
-        idx += count
-        parity ^= True
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    # Runs alternate between background and foreground, starting with background
+    mask = np.repeat(np.arange(len(counts)) % 2 == 1, counts)
     mask = mask.reshape(w, h)
     return mask.transpose()  # Put in C order
 
 
+def rle_to_packed_mask(rle: Dict[str, Any]) -> np.ndarray:
+    """
+    Compute a bit-packed binary mask from an uncompressed RLE. Each row is
+    packed like np.packbits, giving an array of shape H x ceil(W / 8). The
+    packed rows are filled from the runs directly, without decoding the
+    H x W mask first.
+    """
+    h, w = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    # Foreground runs are the odd ones, as [start, end) in column-major order
+    ends = np.cumsum(counts)
+    starts, ends = (ends - counts)[1::2], ends[1::2]
+    nonempty = ends > starts
+    starts, ends = starts[nonempty], ends[nonempty]
+
+    # Split the runs into one [y0, y1) segment per column x they cross
+    first_x, last_x = starts // h, (ends - 1) // h
+    num_segments = last_x - first_x + 1
+    run_idx = np.repeat(np.arange(len(starts)), num_segments)
+    offsets = np.arange(num_segments.sum()) - np.repeat(np.cumsum(num_segments) - num_segments, num_segments)
+    x = first_x[run_idx] + offsets
+    y0 = np.where(offsets == 0, starts[run_idx] % h, 0)
+    y1 = np.where(x == last_x[run_idx], (ends[run_idx] - 1) % h + 1, h)
+
+    # Toggle the bit of column x at both ends of its segments and accumulate
+    # the toggles down the rows. Segments of one column never touch, and
+    # columns sharing a byte have different bits, so no toggle is cancelled.
+    toggles = np.zeros((h + 1, (w + 7) // 8), dtype=np.uint8)
+    bits = (0x80 >> (x % 8)).astype(np.uint8)
+    np.bitwise_xor.at(toggles, (np.concatenate([y0, y1]), np.concatenate([x // 8, x // 8])), np.concatenate([bits, bits]))
+    return np.bitwise_xor.accumulate(toggles[:h], axis=0)
+
+
+def packed_mask_to_mask(packed: np.ndarray, w: int) -> np.ndarray:
+    """Unpack a mask from rle_to_packed_mask to a binary mask of width w."""
+    return np.unpackbits(packed, axis=-1, count=w).astype(bool)
+
+
 def area_from_rle(rle: Dict[str, Any]) -> int:
     return sum(rle["counts"][1::2])
 
@@ -4,10 +4,11 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from torchvision.ops.boxes import batched_nms, box_area  # type: ignore
 
 from .modeling import Sam
@@ -15,9 +16,9 @@ from .predictor import SamPredictor
 from .utils.amg import (MaskData, area_from_rle, batch_iterator, batched_mask_to_box,
                         box_xyxy_to_xywh, build_all_layer_point_grids, calculate_stability_score,
                         coco_encode_rle, generate_crop_boxes, is_box_near_crop_edge,
-                        mask_to_rle_pytorch, remove_small_regions, rle_to_mask, uncrop_boxes_xyxy,
-                        uncrop_masks, uncrop_points)
-from .utils.torch_nms import nms
+                        mask_to_rle_pytorch, remove_small_regions, rle_to_mask, rle_to_packed_mask,
+                        uncrop_boxes_xyxy, uncrop_masks, uncrop_points)
+from .utils.torch_nms import mask_nms, nms
 
 
 class SamAutomaticMaskGenerator:
@@ -37,6 +38,11 @@ class SamAutomaticMaskGenerator:
         point_grids: Optional[List[np.ndarray]] = None,
         min_mask_region_area: int = 0,
         output_mode: str = "binary_mask",
+        crop_encoder_budget_mb: Optional[float] = None,
+        target_length: Optional[int] = None,
+        mask_filter_resolution: str = "original",
+        mask_nms_thresh: float = 0.0,
+        offload_image_encoder: bool = False,
     ) -> None:
         """
         Using a SAM model, generates masks for the entire image.
@@ -78,9 +84,33 @@ class SamAutomaticMaskGenerator:
             to remove disconnected regions and holes in masks with area smaller
             than min_mask_region_area. Requires opencv.
           output_mode (str): The form masks are returned in. Can be 'binary_mask',
-            'uncompressed_rle', or 'coco_rle'. 'coco_rle' requires pycocotools.
-            For large resolutions, 'binary_mask' may consume large amounts of
-            memory.
+            'uncompressed_rle', 'coco_rle', or 'packed'. 'coco_rle' requires
+            pycocotools. For large resolutions, 'binary_mask' may consume large
+            amounts of memory; 'packed' stores the same bitmaps with 8 pixels
+            per byte.
+          crop_encoder_budget_mb (float or None): Memory budget in MB for
+            encoding the crops of a crop layer in one batched image encoder
+            forward. If None, half of the free memory is used on CUDA and
+            half of the available RAM elsewhere (2048 MB without psutil).
+          target_length (int or None): If set (e.g. 512 or 768), crops are
+            encoded at this reduced resolution for a fast preview. Only ViT
+            image encoders support it; others use their full resolution.
+          mask_filter_resolution (str): The resolution the stability score is
+            calculated at. Can be 'original', 'input' (the resized image input
+            to the model) or 'low_res' (the mask decoder output). With 'input'
+            and 'low_res', masks are filtered by predicted IoU and stability
+            before they are upscaled to the original image size, which saves
+            memory and time on large images. Stability scores may differ
+            slightly from 'original' near the threshold.
+          mask_nms_thresh (float): If >0, a final non-maximal suppression by
+            mask IoU removes duplicate masks that box NMS misses, such as
+            different masks with the same box. Compares all mask pairs, so it
+            is slower on large images.
+          offload_image_encoder (bool): If True, the image encoder is moved
+            to the CPU while the masks of a crop are predicted, which saves
+            GPU memory at the cost of moving the encoder back for every crop.
+            Do not use it with a model shared with other generators or
+            predictors.
         """
 
         assert (points_per_side is None) != (
@@ -101,7 +131,13 @@ class SamAutomaticMaskGenerator:
             "binary_mask",
             "uncompressed_rle",
             "coco_rle",
+            "packed",
         ], f"Unknown output_mode {output_mode}."
+        assert mask_filter_resolution in [
+            "original",
+            "input",
+            "low_res",
+        ], f"Unknown mask_filter_resolution {mask_filter_resolution}."
         if output_mode == "coco_rle":
             from pycocotools import mask as mask_utils  # type: ignore # noqa: F401
 
@@ -120,6 +156,11 @@ class SamAutomaticMaskGenerator:
         self.crop_n_points_downscale_factor = crop_n_points_downscale_factor
         self.min_mask_region_area = min_mask_region_area
         self.output_mode = output_mode
+        self.crop_encoder_budget_mb = crop_encoder_budget_mb
+        self.target_length = target_length
+        self.mask_filter_resolution = mask_filter_resolution
+        self.mask_nms_thresh = mask_nms_thresh
+        self.offload_image_encoder = offload_image_encoder
 
     @torch.no_grad()
     def generate(self, image: np.ndarray, multimask_output: bool = True) -> List[Dict[str, Any]]:
@@ -133,8 +174,10 @@ class SamAutomaticMaskGenerator:
            list(dict(str, any)): A list over records for masks. Each record is
              a dict containing the following keys:
                segmentation (dict(str, any) or np.ndarray): The mask. If
-                 output_mode='binary_mask', is an array of shape HW. Otherwise,
-                 is a dictionary containing the RLE.
+                 output_mode='binary_mask', is an array of shape HW. If
+                 output_mode='packed', is a uint8 array of shape H x ceil(W / 8)
+                 with the rows bit-packed; unpack it with packed_mask_to_mask.
+                 Otherwise, is a dictionary containing the RLE.
                bbox (list(float)): The box around the mask, in XYWH format.
                area (int): The area in pixels of the mask.
                predicted_iou (float): The model's own prediction of the mask's
@@ -148,7 +191,11 @@ class SamAutomaticMaskGenerator:
         """
 
         # Generate masks
-        mask_data = self._generate_masks(image, multimask_output)
+        try:
+            mask_data = self._generate_masks(image, multimask_output)
+        finally:
+            # Undo the CPU offloading for the next run
+            self._restore_image_encoder()
 
         # Filter small disconnected regions and holes in masks
         if self.min_mask_region_area > 0:
@@ -158,11 +205,17 @@ class SamAutomaticMaskGenerator:
                 max(self.box_nms_thresh, self.crop_nms_thresh),
             )
 
+        # Remove duplicate masks by mask IoU
+        if self.mask_nms_thresh > 0.0:
+            mask_data = self.postprocess_mask_nms(mask_data, self.mask_nms_thresh, self.predictor.device)
+
         # Encode masks
         if self.output_mode == "coco_rle":
             mask_data["segmentations"] = [coco_encode_rle(rle) for rle in mask_data["rles"]]
         elif self.output_mode == "binary_mask":
             mask_data["segmentations"] = [rle_to_mask(rle) for rle in mask_data["rles"]]
+        elif self.output_mode == "packed":
+            mask_data["segmentations"] = [rle_to_packed_mask(rle) for rle in mask_data["rles"]]
         else:
             mask_data["segmentations"] = mask_data["rles"]
 
@@ -188,11 +241,15 @@ class SamAutomaticMaskGenerator:
             orig_size, self.crop_n_layers, self.crop_overlap_ratio
         )
 
-        # Iterate over image crops
+        # Iterate over image crops, encoding the crops of each layer in batches while
+        # the next batch is preprocessed on a worker thread
         data = MaskData()
-        for crop_box, layer_idx in zip(crop_boxes, layer_idxs):
-            crop_data = self._process_crop(image, crop_box, layer_idx, orig_size, multimask_output)
-            data.cat(crop_data)
+        crop_batch_size = self._get_crop_batch_size()
+        for layer_idx in sorted(set(layer_idxs)):
+            layer_crop_boxes = [crop_box for crop_box, idx in zip(crop_boxes, layer_idxs) if idx == layer_idx]
+            for crop_box, crop_features in self._encode_crops(image, layer_crop_boxes, crop_batch_size):
+                crop_data = self._process_crop(image, crop_box, layer_idx, orig_size, multimask_output, crop_features)
+                data.cat(crop_data)
 
         # Remove duplicate masks between crops
         if len(crop_boxes) > 1:
@@ -217,6 +274,67 @@ class SamAutomaticMaskGenerator:
         data.to_numpy()
         return data
 
+    def _get_default_budget_mb(self) -> float:
+        """Half of the free memory on CUDA, half of the available RAM elsewhere (2048 MB without psutil)."""
+        if self.predictor.device.type == "cuda":
+            free_bytes, _ = torch.cuda.mem_get_info(self.predictor.device)
+            return free_bytes / (1024 * 1024) / 2
+        try:
+            import psutil  # type: ignore
+
+            return psutil.virtual_memory().available / (1024 * 1024) / 2
+        except ImportError:
+            return 2048
+
+    def _get_upscale_chunk_size(self, orig_size: Tuple[int, ...]) -> int:
+        """Number of masks upscaled to the original image size at once within the memory budget."""
+        # Float logits, their threshold, the uncropped mask and the RLE change indices
+        mask_bytes = 8 * orig_size[0] * orig_size[1]
+        return max(1, int(self._get_default_budget_mb() * 1024 * 1024 // mask_bytes))
+
+    def _get_crop_batch_size(self) -> int:
+        """Number of crops of a layer encoded together within the memory budget."""
+        image_encoder = self.predictor.model.image_encoder
+        blocks = getattr(image_encoder, "blocks", None)
+        pos_embed = getattr(image_encoder, "pos_embed", None)
+        if self.crop_n_layers == 0 or blocks is None or pos_embed is None:
+            return 1
+
+        budget_mb = self.crop_encoder_budget_mb
+        if budget_mb is None:
+            budget_mb = self._get_default_budget_mb()
+
+        num_tokens = pos_embed.shape[1] * pos_embed.shape[2]
+        element_size = pos_embed.element_size()
+        # Global attention scores and probabilities dominate, plus the block activations
+        image_bytes = 2 * blocks[0].attn.num_heads * num_tokens**2 * element_size
+        image_bytes += 16 * num_tokens * pos_embed.shape[-1] * element_size
+        return max(1, int(budget_mb * 1024 * 1024 // image_bytes))
+
+    def _encode_crops(
+        self,
+        image: np.ndarray,
+        crop_boxes: List[List[int]],
+        batch_size: int,
+    ) -> Iterator[Tuple[List[int], Optional[Dict[str, Any]]]]:
+        # A single crop is encoded by set_image in _process_crop
+        if len(crop_boxes) == 1:
+            yield crop_boxes[0], None
+            return
+
+        cropped_ims = [image[y0:y1, x0:x1, :] for x0, y0, x1, y1 in crop_boxes]
+        crop_features = self.predictor.iter_encode_images(
+            cropped_ims, target_length=self.target_length, batch_size=batch_size
+        )
+        for crop_box in crop_boxes:
+            self._restore_image_encoder()
+            yield crop_box, next(crop_features)
+
+    def _restore_image_encoder(self) -> None:
+        # The encoder may have been offloaded by a previous crop or run
+        if self.offload_image_encoder:
+            self.predictor.model.image_encoder.to(self.predictor.device)
+
     def _process_crop(
         self,
         image: np.ndarray,
@@ -224,16 +342,21 @@ class SamAutomaticMaskGenerator:
         crop_layer_idx: int,
         orig_size: Tuple[int, ...],
         multimask_output: bool = True,
+        crop_features: Optional[Dict[str, Any]] = None,
     ) -> MaskData:
         # Crop the image and calculate embeddings
         x0, y0, x1, y1 = crop_box
         cropped_im = image[y0:y1, x0:x1, :]
         cropped_im_size = cropped_im.shape[:2]
-        self.predictor.set_image(cropped_im)
+        if crop_features is None:
+            self._restore_image_encoder()
+            self.predictor.set_image(cropped_im, target_length=self.target_length)
+        else:
+            self.predictor.set_features(**crop_features)
 
         # CPU Offloading
-        self.predictor.model.image_encoder.to("cpu")
-        self.predictor.features.to(self.predictor.device)
+        if self.offload_image_encoder:
+            self.predictor.model.image_encoder.to("cpu")
 
         # Get points for this crop
         points_scale = np.array(cropped_im_size)[None, ::-1]
@@ -286,34 +409,45 @@ class SamAutomaticMaskGenerator:
         )
         in_points = torch.as_tensor(transformed_points, device=self.predictor.device)
         in_labels = torch.ones(in_points.shape[0], dtype=torch.int, device=in_points.device)
-        masks, iou_preds, _ = self.predictor.predict_torch(
+        upscale_masks = self.mask_filter_resolution == "original"
+        masks, iou_preds, low_res_masks = self.predictor.predict_torch(
             in_points[:, None, :],
             in_labels[:, None],
             multimask_output=multimask_output,
             return_logits=True,
+            upscale_masks=upscale_masks,
         )
 
         # Serialize predictions and store in MaskData
         data = MaskData(
-            masks=masks.flatten(0, 1),
+            masks=masks.flatten(0, 1) if upscale_masks else low_res_masks.flatten(0, 1),
             iou_preds=iou_preds.flatten(0, 1),
-            points=torch.as_tensor(points.repeat(masks.shape[1], axis=0)),
+            points=torch.as_tensor(points.repeat(iou_preds.shape[1], axis=0)),
         )
-        del masks
+        del masks, low_res_masks
 
         # Filter by predicted IoU
         if self.pred_iou_thresh > 0.0:
             keep_mask = data["iou_preds"] > self.pred_iou_thresh
             data.filter(keep_mask)
 
-        # Calculate stability score
+        # Calculate stability score, at a reduced resolution if requested
+        if self.mask_filter_resolution == "input":
+            data["masks"] = self.predictor.model.upscale_masks(
+                data["masks"][:, None], self.predictor.input_size, self.predictor.target_length
+            )[:, 0]
         data["stability_score"] = calculate_stability_score(
-            data["masks"], self.predictor.model.mask_threshold, self.stability_score_offset
+            self._remove_low_res_padding(data["masks"]),
+            self.predictor.model.mask_threshold,
+            self.stability_score_offset,
         )
         if self.stability_score_thresh > 0.0:
             keep_mask = data["stability_score"] >= self.stability_score_thresh
             data.filter(keep_mask)
 
+        if self.mask_filter_resolution != "original":
+            return self._upscale_and_encode(data, crop_box, orig_size)
+
         # Threshold masks and calculate boxes
         data["masks"] = data["masks"] > self.predictor.model.mask_threshold
         data["boxes"] = batched_mask_to_box(data["masks"])
@@ -330,6 +464,83 @@ class SamAutomaticMaskGenerator:
 
         return data
 
+    def _upscale_and_encode(self, data: MaskData, crop_box: List[int], orig_size: Tuple[int, ...]) -> MaskData:
+        """
+        Upscales the masks remaining after filtering at a reduced resolution
+        to the original image resolution, thresholds them, and compresses them
+        to RLE. Masks are processed in chunks, so only a few of them are held
+        at the original resolution at once, however many pass the filters.
+        """
+        orig_h, orig_w = orig_size
+        masks = data["masks"]
+        del data["masks"]
+
+        boxes, keep, rles = [], [], []
+        chunk_size = self._get_upscale_chunk_size(orig_size)
+        for start in range(0, len(masks), chunk_size):
+            chunk = masks[start:start + chunk_size, None]
+            if self.mask_filter_resolution == "input":
+                chunk = F.interpolate(chunk, self.predictor.original_size, mode="bilinear", align_corners=False)
+            else:
+                chunk = self.predictor.model.postprocess_masks(
+                    chunk,
+                    self.predictor.input_size,
+                    self.predictor.original_size,
+                    self.predictor.target_length,
+                )
+            chunk = chunk[:, 0] > self.predictor.model.mask_threshold
+            boxes.append(batched_mask_to_box(chunk))
+
+            # Filter boxes that touch crop boundaries before compressing to RLE
+            keep.append(~is_box_near_crop_edge(boxes[-1], crop_box, [0, 0, orig_w, orig_h]))
+            rles.extend(mask_to_rle_pytorch(uncrop_masks(chunk[keep[-1]], crop_box, orig_h, orig_w)))
+            del chunk
+
+        if len(boxes) == 0:
+            # Like batched_mask_to_box of an empty batch
+            data["boxes"] = torch.zeros((0, 4), device=masks.device)
+        else:
+            data["boxes"] = torch.cat(boxes)
+            data.filter(torch.cat(keep))
+        data["rles"] = rles
+        return data
+
+    def _remove_low_res_padding(self, masks: torch.Tensor) -> torch.Tensor:
+        """
+        Crops mask decoder outputs to the region of the resized image, so the
+        padding does not count towards the stability score. Masks at any other
+        resolution are returned unchanged.
+        """
+        if self.mask_filter_resolution != "low_res":
+            return masks
+        low_res_h, low_res_w = masks.shape[-2:]
+        img_size = self.predictor.target_length
+        input_h, input_w = self.predictor.input_size
+        h = (input_h * low_res_h + img_size - 1) // img_size
+        w = (input_w * low_res_w + img_size - 1) // img_size
+        return masks[..., :h, :w]
+
+    @staticmethod
+    def postprocess_mask_nms(
+        mask_data: MaskData, nms_thresh: float, device: torch.device
+    ) -> MaskData:
+        """
+        Removes masks whose mask IoU with a mask of higher predicted IoU
+        exceeds nms_thresh. The masks are compared as bit-packed bitmaps.
+
+        Edits mask_data in place.
+        """
+        if len(mask_data["rles"]) == 0:
+            return mask_data
+
+        packed_masks = torch.as_tensor(
+            np.stack([rle_to_packed_mask(rle).reshape(-1) for rle in mask_data["rles"]]), device=device
+        )
+        scores = torch.as_tensor(mask_data["iou_preds"], device=device)
+        keep_by_nms = mask_nms(packed_masks, scores, iou_threshold=nms_thresh)
+        mask_data.filter(keep_by_nms.cpu())
+        return mask_data
+
     @staticmethod
     def postprocess_small_regions(
         mask_data: MaskData, min_area: int, nms_thresh: float
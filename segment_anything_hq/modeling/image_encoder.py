@@ -8,7 +8,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from typing import Optional, Tuple, Type
+from typing import Any, Dict, Optional, Tuple, Type
 
 from .common import LayerNorm2d, MLPBlock
 
@@ -33,6 +33,7 @@ class ImageEncoderViT(nn.Module):
         rel_pos_zero_init: bool = True,
         window_size: int = 0,
         global_attn_indexes: Tuple[int, ...] = (),
+        attn_impl: str = "eager",
     ) -> None:
         """
         Args:
@@ -51,6 +52,7 @@ class ImageEncoderViT(nn.Module):
             rel_pos_zero_init (bool): If True, zero initialize relative positional parameters.
             window_size (int): Window size for window attention blocks.
             global_attn_indexes (list): Indexes for blocks using global attention.
+            attn_impl (str): Attention implementation, "eager" or "sdpa".
         """
         super().__init__()
         self.img_size = img_size
@@ -68,6 +70,8 @@ class ImageEncoderViT(nn.Module):
             self.pos_embed = nn.Parameter(
                 torch.zeros(1, img_size // patch_size, img_size // patch_size, embed_dim)
             )
+        # Resampled pos_embed per patch grid size, reused in eval mode
+        self._pos_embeds: Dict[Tuple[int, int], Tuple[Any, torch.Tensor]] = {}
 
         self.blocks = nn.ModuleList()
         for i in range(depth):
@@ -82,6 +86,7 @@ class ImageEncoderViT(nn.Module):
                 rel_pos_zero_init=rel_pos_zero_init,
                 window_size=window_size if i not in global_attn_indexes else 0,
                 input_size=(img_size // patch_size, img_size // patch_size),
+                attn_impl=attn_impl,
             )
             self.blocks.append(block)
 
@@ -103,10 +108,52 @@ class ImageEncoderViT(nn.Module):
             LayerNorm2d(out_chans),
         )
 
+    def get_pos_embed(self, size: Tuple[int, int]) -> torch.Tensor:
+        """
+        Get the absolute positional embedding for a patch grid size. Inputs smaller
+        than img_size (e.g. 512 or 768 for a preview) use a bicubic resampled copy,
+        cached in eval mode until the weights, their device or their dtype change.
+        Args:
+            size (Tuple): patch grid size (H, W).
+
+        Returns:
+            pos_embed (Tensor): positional embedding with shape (1, H, W, C).
+        """
+        assert self.pos_embed is not None
+        if tuple(self.pos_embed.shape[1:3]) == tuple(size):
+            return self.pos_embed
+
+        use_cache = not self.training and not (torch.is_grad_enabled() and self.pos_embed.requires_grad)
+        version = (self.pos_embed.data_ptr(), self.pos_embed._version, self.pos_embed.dtype, self.pos_embed.device)
+        cached = self._pos_embeds.get(tuple(size), None) if use_cache else None
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        pos_embed = F.interpolate(
+            self.pos_embed.permute(0, 3, 1, 2).float(),
+            size=size,
+            mode="bicubic",
+            align_corners=False,
+        ).permute(0, 2, 3, 1).to(self.pos_embed.dtype)
+        if use_cache:
+            self._pos_embeds[tuple(size)] = (version, pos_embed)
+        return pos_embed
+
+    def set_attn_memory_limit(self, limit_mb: Optional[float]) -> None:
+        """
+        Set a memory ceiling for the attention maps of all blocks. Attention maps larger
+        than the ceiling (e.g. the global attention of a 1024 input) are computed in
+        chunks of queries, which gives the same result with a bounded peak memory.
+        Args:
+            limit_mb (float or None): memory ceiling in MB per attention layer, None for no limit.
+        """
+        for blk in self.blocks:
+            blk.attn.attn_memory_limit_mb = limit_mb
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         x = self.patch_embed(x)
         if self.pos_embed is not None:
-            x = x + self.pos_embed
+            x = x + self.get_pos_embed((x.shape[1], x.shape[2]))
 
         interm_embeddings = []
         for blk in self.blocks:
@@ -134,6 +181,7 @@ class Block(nn.Module):
         rel_pos_zero_init: bool = True,
         window_size: int = 0,
         input_size: Optional[Tuple[int, int]] = None,
+        attn_impl: str = "eager",
     ) -> None:
         """
         Args:
@@ -149,6 +197,7 @@ class Block(nn.Module):
                 use global attention.
             input_size (tuple(int, int) or None): Input resolution for calculating the relative
                 positional parameter size.
+            attn_impl (str): Attention implementation, "eager" or "sdpa".
         """
         super().__init__()
         self.norm1 = norm_layer(dim)
@@ -159,6 +208,7 @@ class Block(nn.Module):
             use_rel_pos=use_rel_pos,
             rel_pos_zero_init=rel_pos_zero_init,
             input_size=input_size if window_size == 0 else (window_size, window_size),
+            attn_impl=attn_impl,
         )
 
         self.norm2 = norm_layer(dim)
@@ -196,6 +246,7 @@ class Attention(nn.Module):
         use_rel_pos: bool = False,
         rel_pos_zero_init: bool = True,
         input_size: Optional[Tuple[int, int]] = None,
+        attn_impl: str = "eager",
     ) -> None:
         """
         Args:
@@ -206,8 +257,16 @@ class Attention(nn.Module):
             rel_pos_zero_init (bool): If True, zero initialize relative positional parameters.
             input_size (tuple(int, int) or None): Input resolution for calculating the relative
                 positional parameter size.
+            attn_impl (str): Attention implementation. "eager" materializes the attention map,
+                "sdpa" uses F.scaled_dot_product_attention with the relative positional
+                embeddings folded into the query and key, so no attention map or bias is
+                materialized. Falls back to "eager" if unavailable.
         """
         super().__init__()
+        assert attn_impl in ("eager", "sdpa"), f"Unknown attention implementation: {attn_impl}"
+        if attn_impl == "sdpa" and not hasattr(F, "scaled_dot_product_attention"):
+            attn_impl = "eager"
+        self.attn_impl = attn_impl
         self.num_heads = num_heads
         head_dim = dim // num_heads
         self.scale = head_dim**-0.5
@@ -223,6 +282,151 @@ class Attention(nn.Module):
             # initialize relative positional embeddings
             self.rel_pos_h = nn.Parameter(torch.zeros(2 * input_size[0] - 1, head_dim))
             self.rel_pos_w = nn.Parameter(torch.zeros(2 * input_size[1] - 1, head_dim))
+        # Gathered Rh/Rw tables per (q_size, k_size), reused in eval mode
+        self.cache_rel_pos = True
+        self._rel_pos_tables: Dict[Tuple[Tuple[int, int], Tuple[int, int]], Tuple[Any, torch.Tensor, torch.Tensor]] = {}
+        # Memory ceiling in MB for the attention map, queries are processed in chunks above it
+        self.attn_memory_limit_mb: Optional[float] = None
+
+    def get_rel_pos_tables(
+        self, q_size: Tuple[int, int], k_size: Tuple[int, int]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Get the relative positional embeddings gathered for the query and key sizes.
+        The tables are cached in eval mode and recomputed when the input resolution,
+        the weights, their device or their dtype change.
+        Args:
+            q_size (Tuple): spatial sequence size of query q with (q_h, q_w).
+            k_size (Tuple): spatial sequence size of key k with (k_h, k_w).
+
+        Returns:
+            Rh (Tensor): gathered embeddings (q_h, k_h, C) for height axis.
+            Rw (Tensor): gathered embeddings (q_w, k_w, C) for width axis.
+        """
+        use_cache = self.cache_rel_pos and not self.training and not (
+            torch.is_grad_enabled() and (self.rel_pos_h.requires_grad or self.rel_pos_w.requires_grad)
+        )
+        if not use_cache:
+            return get_rel_pos(q_size[0], k_size[0], self.rel_pos_h), get_rel_pos(q_size[1], k_size[1], self.rel_pos_w)
+
+        version = tuple(
+            (p.data_ptr(), p._version, p.dtype, p.device) for p in (self.rel_pos_h, self.rel_pos_w)
+        )
+        cached = self._rel_pos_tables.get((q_size, k_size), None)
+        if cached is None or cached[0] != version:
+            Rh = get_rel_pos(q_size[0], k_size[0], self.rel_pos_h)
+            Rw = get_rel_pos(q_size[1], k_size[1], self.rel_pos_w)
+            cached = (version, Rh, Rw)
+            self._rel_pos_tables[(q_size, k_size)] = cached
+        return cached[1], cached[2]
+
+    def get_query_chunk_size(self, batch: int, q_len: int, k_len: int, dtype: torch.dtype) -> int:
+        """
+        Get the number of queries per chunk that keeps the attention map under
+        attn_memory_limit_mb.
+        Args:
+            batch (int): batch size times number of heads.
+            q_len (int): number of queries.
+            k_len (int): number of keys.
+            dtype (torch.dtype): dtype of the attention map.
+
+        Returns:
+            chunk_size (int): queries per chunk, q_len if no chunking is needed.
+        """
+        if self.attn_memory_limit_mb is None:
+            return q_len
+        # The attention logits of a chunk and their softmax are alive together
+        row_bytes = 2 * batch * k_len * torch.finfo(dtype).bits // 8
+        chunk_size = int(self.attn_memory_limit_mb * 1024 * 1024) // row_bytes
+        return max(1, min(q_len, chunk_size))
+
+    def chunked_attention(
+        self,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        B: int,
+        size: Tuple[int, int],
+        chunk_size: int,
+    ) -> torch.Tensor:
+        """
+        Attention over chunks of queries. Every query row is computed with the same
+        operations as the unchunked path, so the output is the same.
+        Args:
+            q, k, v (Tensor): query, key and value with shape (B * nHead, H * W, C).
+            B (int): batch size.
+            size (Tuple): spatial size (H, W).
+            chunk_size (int): queries per chunk.
+
+        Returns:
+            x (Tensor): output with shape (B * nHead, H * W, C).
+        """
+        H, W = size
+        BH, L, _ = q.shape
+        if self.attn_impl == "sdpa":
+            q, k = self.get_sdpa_qk(q, k, size)
+        elif self.use_rel_pos:
+            rel_h, rel_w = get_decomposed_rel_pos(
+                q, self.rel_pos_h, self.rel_pos_w, (H, W), (H, W), self.get_rel_pos_tables((H, W), (H, W))
+            )
+            rel_h = rel_h.reshape(BH, L, H)
+            rel_w = rel_w.reshape(BH, L, W)
+
+        x = q.new_empty(BH, L, v.shape[-1])
+        for start in range(0, L, chunk_size):
+            end = min(start + chunk_size, L)
+            q_chunk = q[:, start:end]
+            if self.attn_impl == "sdpa":
+                x[:, start:end] = self.scaled_dot_product_attention(
+                    q_chunk.reshape(B, self.num_heads, end - start, -1),
+                    k.view(B, self.num_heads, L, -1),
+                    v.view(B, self.num_heads, L, -1),
+                ).reshape(BH, end - start, -1)
+            else:
+                attn = (q_chunk * self.scale) @ k.transpose(-2, -1)
+                if self.use_rel_pos:
+                    attn = (
+                        attn.view(BH, end - start, H, W)
+                        + rel_h[:, start:end, :, None]
+                        + rel_w[:, start:end, None, :]
+                    ).view(BH, end - start, L)
+                x[:, start:end] = attn.softmax(dim=-1) @ v
+        return x
+
+    def get_sdpa_qk(
+        self, q: torch.Tensor, k: torch.Tensor, size: Tuple[int, int]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Get the query and key for F.scaled_dot_product_attention, which scales
+        q @ k^T by the inverse square root of their last dimension.
+        Args:
+            q, k (Tensor): query and key with shape (B * nHead, H * W, C).
+            size (Tuple): spatial size (H, W).
+
+        Returns:
+            q, k (Tensor): query and key whose scaled product equals the logits of the eager path.
+        """
+        if self.use_rel_pos:
+            q, k = get_decomposed_rel_pos_qk(
+                q, k, self.rel_pos_h, self.rel_pos_w, size, size, self.scale, self.get_rel_pos_tables(size, size)
+            )
+            # The fused kernels need a head dim that is a multiple of 8, zero padding keeps q @ k^T
+            pad = -q.shape[-1] % 8
+            q, k = F.pad(q, (0, pad)), F.pad(k, (0, pad))
+            # Undo the scaling of scaled_dot_product_attention, q is already scaled
+            q = q * q.shape[-1] ** 0.5
+        return q, k
+
+    def scaled_dot_product_attention(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor) -> torch.Tensor:
+        """
+        F.scaled_dot_product_attention with v zero padded to the head dim of q and k,
+        as the fused kernels need the same head dim for all of them.
+        """
+        head_dim = v.shape[-1]
+        if q.shape[-1] == head_dim:
+            return F.scaled_dot_product_attention(q, k, v)
+        v = F.pad(v, (0, q.shape[-1] - head_dim))
+        return F.scaled_dot_product_attention(q, k, v)[..., :head_dim].contiguous()
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         B, H, W, _ = x.shape
@@ -231,13 +435,29 @@ class Attention(nn.Module):
         # q, k, v with shape (B * nHead, H * W, C)
         q, k, v = qkv.reshape(3, B * self.num_heads, H * W, -1).unbind(0)
 
-        attn = (q * self.scale) @ k.transpose(-2, -1)
+        chunk_size = self.get_query_chunk_size(B * self.num_heads, H * W, H * W, q.dtype)
+        if chunk_size < H * W:
+            x = self.chunked_attention(q, k, v, B, (H, W), chunk_size)
+        elif self.attn_impl == "sdpa":
+            q, k = self.get_sdpa_qk(q, k, (H, W))
+            # Without an attn_mask, scaled_dot_product_attention can use its fused kernels
+            x = self.scaled_dot_product_attention(
+                q.view(B, self.num_heads, H * W, -1),
+                k.view(B, self.num_heads, H * W, -1),
+                v.view(B, self.num_heads, H * W, -1),
+            )
+        else:
+            attn = (q * self.scale) @ k.transpose(-2, -1)
 
-        if self.use_rel_pos:
-            attn = add_decomposed_rel_pos(attn, q, self.rel_pos_h, self.rel_pos_w, (H, W), (H, W))
+            if self.use_rel_pos:
+                attn = add_decomposed_rel_pos(
+                    attn, q, self.rel_pos_h, self.rel_pos_w, (H, W), (H, W), self.get_rel_pos_tables((H, W), (H, W))
+                )
+
+            attn = attn.softmax(dim=-1)
+            x = attn @ v
 
-        attn = attn.softmax(dim=-1)
-        x = (attn @ v).view(B, self.num_heads, H, W, -1).permute(0, 2, 3, 1, 4).reshape(B, H, W, -1)
+        x = x.view(B, self.num_heads, H, W, -1).permute(0, 2, 3, 1, 4).reshape(B, H, W, -1)
         x = self.proj(x)
 
         return x
@@ -332,6 +552,7 @@ def add_decomposed_rel_pos(
     rel_pos_w: torch.Tensor,
     q_size: Tuple[int, int],
     k_size: Tuple[int, int],
+    rel_pos_tables: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
 ) -> torch.Tensor:
     """
     Calculate decomposed Relative Positional Embeddings from :paper:`mvitv2`.
@@ -343,25 +564,103 @@ def add_decomposed_rel_pos(
         rel_pos_w (Tensor): relative position embeddings (Lw, C) for width axis.
         q_size (Tuple): spatial sequence size of query q with (q_h, q_w).
         k_size (Tuple): spatial sequence size of key k with (k_h, k_w).
+        rel_pos_tables (Tuple or None): precomputed (Rh, Rw) from get_rel_pos, if available.
 
     Returns:
         attn (Tensor): attention map with added relative positional embeddings.
     """
     q_h, q_w = q_size
     k_h, k_w = k_size
-    Rh = get_rel_pos(q_h, k_h, rel_pos_h)
-    Rw = get_rel_pos(q_w, k_w, rel_pos_w)
+    rel_h, rel_w = get_decomposed_rel_pos(q, rel_pos_h, rel_pos_w, q_size, k_size, rel_pos_tables)
+
+    B = q.shape[0]
+    attn = (
+        attn.view(B, q_h, q_w, k_h, k_w) + rel_h[:, :, :, :, None] + rel_w[:, :, :, None, :]
+    ).view(B, q_h * q_w, k_h * k_w)
+
+    return attn
+
+
+def get_decomposed_rel_pos(
+    q: torch.Tensor,
+    rel_pos_h: torch.Tensor,
+    rel_pos_w: torch.Tensor,
+    q_size: Tuple[int, int],
+    k_size: Tuple[int, int],
+    rel_pos_tables: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Calculate the height and width terms of decomposed Relative Positional Embeddings.
+    Args:
+        q (Tensor): query q in the attention layer with shape (B, q_h * q_w, C).
+        rel_pos_h (Tensor): relative position embeddings (Lh, C) for height axis.
+        rel_pos_w (Tensor): relative position embeddings (Lw, C) for width axis.
+        q_size (Tuple): spatial sequence size of query q with (q_h, q_w).
+        k_size (Tuple): spatial sequence size of key k with (k_h, k_w).
+        rel_pos_tables (Tuple or None): precomputed (Rh, Rw) from get_rel_pos, if available.
+
+    Returns:
+        rel_h (Tensor): height term with shape (B, q_h, q_w, k_h).
+        rel_w (Tensor): width term with shape (B, q_h, q_w, k_w).
+    """
+    q_h, q_w = q_size
+    k_h, k_w = k_size
+    if rel_pos_tables is not None:
+        Rh, Rw = rel_pos_tables
+    else:
+        Rh = get_rel_pos(q_h, k_h, rel_pos_h)
+        Rw = get_rel_pos(q_w, k_w, rel_pos_w)
 
     B, _, dim = q.shape
     r_q = q.reshape(B, q_h, q_w, dim)
     rel_h = torch.einsum("bhwc,hkc->bhwk", r_q, Rh)
     rel_w = torch.einsum("bhwc,wkc->bhwk", r_q, Rw)
 
-    attn = (
-        attn.view(B, q_h, q_w, k_h, k_w) + rel_h[:, :, :, :, None] + rel_w[:, :, :, None, :]
-    ).view(B, q_h * q_w, k_h * k_w)
+    return rel_h, rel_w
 
-    return attn
+
+def get_decomposed_rel_pos_qk(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    rel_pos_h: torch.Tensor,
+    rel_pos_w: torch.Tensor,
+    q_size: Tuple[int, int],
+    k_size: Tuple[int, int],
+    scale: float = 1.0,
+    rel_pos_tables: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Fold decomposed Relative Positional Embeddings into the query and key.
+    The height and width terms are appended to the query, and the one-hot row and
+    column of every key position to the key, so that the product of the returned
+    query and key is q @ k^T * scale plus the relative positional terms. Only
+    (B, q_h * q_w, k_h + k_w) extra elements are computed instead of the
+    (B, q_h * q_w, k_h * k_w) attention bias.
+    Args:
+        q (Tensor): query q in the attention layer with shape (B, q_h * q_w, C).
+        k (Tensor): key k in the attention layer with shape (B, k_h * k_w, C).
+        rel_pos_h (Tensor): relative position embeddings (Lh, C) for height axis.
+        rel_pos_w (Tensor): relative position embeddings (Lw, C) for width axis.
+        q_size (Tuple): spatial sequence size of query q with (q_h, q_w).
+        k_size (Tuple): spatial sequence size of key k with (k_h, k_w).
+        scale (float): scale of q @ k^T, the relative positional terms are not scaled.
+        rel_pos_tables (Tuple or None): precomputed (Rh, Rw) from get_rel_pos, if available.
+
+    Returns:
+        q (Tensor): query with shape (B, q_h * q_w, C + k_h + k_w).
+        k (Tensor): key with shape (B, k_h * k_w, C + k_h + k_w).
+    """
+    k_h, k_w = k_size
+    rel_h, rel_w = get_decomposed_rel_pos(q, rel_pos_h, rel_pos_w, q_size, k_size, rel_pos_tables)
+
+    B, q_len, _ = q.shape
+    q = torch.cat([q * scale, rel_h.reshape(B, q_len, k_h).to(q.dtype), rel_w.reshape(B, q_len, k_w).to(q.dtype)], dim=-1)
+    one_hot_h = torch.eye(k_h, dtype=k.dtype, device=k.device)[:, None, :].expand(k_h, k_w, k_h)
+    one_hot_w = torch.eye(k_w, dtype=k.dtype, device=k.device)[None, :, :].expand(k_h, k_w, k_w)
+    one_hot = torch.cat([one_hot_h, one_hot_w], dim=-1).reshape(1, k_h * k_w, k_h + k_w)
+    k = torch.cat([k, one_hot.expand(B, -1, -1)], dim=-1)
+
+    return q, k
 
 
 class PatchEmbed(nn.Module):
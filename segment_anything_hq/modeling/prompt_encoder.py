@@ -59,16 +59,23 @@ class PromptEncoder(nn.Module):
         )
         self.no_mask_embed = nn.Embedding(1, embed_dim)
 
-    def get_dense_pe(self) -> torch.Tensor:
+    def get_dense_pe(self, image_embedding_size: Optional[Tuple[int, int]] = None) -> torch.Tensor:
         """
         Returns the positional encoding used to encode point prompts,
         applied to a dense set of points the shape of the image encoding.
 
+        Arguments:
+          image_embedding_size (tuple(int, int) or None): The spatial size of
+            the image embedding, if it differs from the default (e.g. for
+            a reduced resolution input).
+
         Returns:
           torch.Tensor: Positional encoding with shape
             1x(embed_dim)x(embedding_h)x(embedding_w)
         """
-        return self.pe_layer(self.image_embedding_size).unsqueeze(0)
+        if image_embedding_size is None:
+            image_embedding_size = self.image_embedding_size
+        return self.pe_layer(tuple(image_embedding_size)).unsqueeze(0)
 
     def _embed_points(
         self,
@@ -130,6 +137,7 @@ class PromptEncoder(nn.Module):
         points: Optional[Tuple[torch.Tensor, torch.Tensor]],
         boxes: Optional[torch.Tensor],
         masks: Optional[torch.Tensor],
+        image_embedding_size: Optional[Tuple[int, int]] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         """
         Embeds different types of prompts, returning both sparse and dense
@@ -140,6 +148,8 @@ class PromptEncoder(nn.Module):
             and labels to embed.
           boxes (torch.Tensor or none): boxes to embed
           masks (torch.Tensor or none): masks to embed
+          image_embedding_size (tuple(int, int) or None): The spatial size of
+            the image embedding, if it differs from the default.
 
         Returns:
           torch.Tensor: sparse embeddings for the points and boxes, with shape
@@ -148,6 +158,8 @@ class PromptEncoder(nn.Module):
           torch.Tensor: dense embeddings for the masks, in the shape
             Bx(embed_dim)x(embed_H)x(embed_W)
         """
+        if image_embedding_size is None:
+            image_embedding_size = self.image_embedding_size
         bs = self._get_batch_size(points, boxes, masks)
         sparse_embeddings = torch.empty((bs, 0, self.embed_dim), device=self._get_device())
         if points is not None:
@@ -162,7 +174,7 @@ class PromptEncoder(nn.Module):
             dense_embeddings = self._embed_masks(masks)
         else:
             dense_embeddings = self.no_mask_embed.weight.reshape(1, -1, 1, 1).expand(
-                bs, -1, self.image_embedding_size[0], self.image_embedding_size[1]
+                bs, -1, image_embedding_size[0], image_embedding_size[1]
             )
 
         return sparse_embeddings, dense_embeddings
@@ -8,7 +8,7 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from .image_encoder import ImageEncoderViT
 from .mask_decoder import MaskDecoder
@@ -139,6 +139,7 @@ class Sam(nn.Module):
         masks: torch.Tensor,
         input_size: Tuple[int, ...],
         original_size: Tuple[int, ...],
+        img_size: Optional[int] = None,
     ) -> torch.Tensor:
         """
         Remove padding and upscale masks to the original image size.
@@ -150,29 +151,56 @@ class Sam(nn.Module):
             model, in (H, W) format. Used to remove padding.
           original_size (tuple(int, int)): The original size of the image
             before resizing for input to the model, in (H, W) format.
+          img_size (int or None): The padded input size of the image encoder,
+            if it differs from image_encoder.img_size.
 
         Returns:
           (torch.Tensor): Batched masks in BxCxHxW format, where (H, W)
             is given by original_size.
         """
+        masks = self.upscale_masks(masks, input_size, img_size)
+        masks = F.interpolate(masks, original_size, mode="bilinear", align_corners=False)
+        return masks
+
+    def upscale_masks(
+        self,
+        masks: torch.Tensor,
+        input_size: Tuple[int, ...],
+        img_size: Optional[int] = None,
+    ) -> torch.Tensor:
+        """
+        Upscale masks to the padded input size of the image encoder and
+        remove padding. This is the first step of postprocess_masks.
+
+        Arguments:
+          masks (torch.Tensor): Batched masks from the mask_decoder,
+            in BxCxHxW format.
+          input_size (tuple(int, int)): The size of the image input to the
+            model, in (H, W) format. Used to remove padding.
+          img_size (int or None): The padded input size of the image encoder,
+            if it differs from image_encoder.img_size.
+
+        Returns:
+          (torch.Tensor): Batched masks in BxCxHxW format, where (H, W)
+            is given by input_size.
+        """
+        if img_size is None:
+            img_size = self.image_encoder.img_size
         masks = F.interpolate(
             masks,
-            (self.image_encoder.img_size, self.image_encoder.img_size),
+            (img_size, img_size),
             mode="bilinear",
             align_corners=False,
         )
-        masks = masks[..., : input_size[0], : input_size[1]]
-        masks = F.interpolate(masks, original_size, mode="bilinear", align_corners=False)
-        return masks
+        return masks[..., : input_size[0], : input_size[1]]
 
-    def preprocess(self, x: torch.Tensor) -> torch.Tensor:
+    def preprocess(self, x: torch.Tensor, img_size: Optional[int] = None) -> torch.Tensor:
         """Normalize pixel values and pad to a square input."""
-        # Normalize colors
-        x = (x - self.pixel_mean) / self.pixel_std
-
-        # Pad
+        if img_size is None:
+            img_size = self.image_encoder.img_size
+        # Normalize colors into the top-left of a zero padded buffer, in a single pass
         h, w = x.shape[-2:]
-        padh = self.image_encoder.img_size - h
-        padw = self.image_encoder.img_size - w
-        x = F.pad(x, (0, padw, 0, padh))
-        return x
+        dtype = x.dtype if x.is_floating_point() else self.pixel_mean.dtype
+        padded = torch.zeros((*x.shape[:-2], img_size, img_size), dtype=dtype, device=x.device)
+        padded[..., :h, :w].copy_(x).sub_(self.pixel_mean).div_(self.pixel_std)
+        return padded
@@ -142,3 +142,56 @@ class SamOnnxModel(nn.Module):
             return upscaled_masks, scores, stability_scores, areas, masks
 
         return upscaled_masks, scores, masks
+
+
+class SamOnnxImageEncoder(nn.Module):
+    """
+    This model should not be called directly, but is used in ONNX export of the
+    image encoder. It takes a preprocessed (normalized and padded) image and
+    returns the image embeddings and the intermediate embeddings of the global
+    attention blocks, stacked in one tensor.
+    """
+
+    def __init__(self, model: Sam) -> None:
+        super().__init__()
+        self.image_encoder = model.image_encoder
+
+    @torch.no_grad()
+    def forward(self, image: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        image_embeddings, interm_embeddings = self.image_encoder(image)
+        return image_embeddings, torch.stack(interm_embeddings, dim=0)
+
+
+class SamOnnxMaskDecoder(nn.Module):
+    """
+    This model should not be called directly, but is used in ONNX export of the
+    mask decoder. It takes the outputs of the prompt encoder and the first
+    intermediate embedding of the image encoder, and returns the masks and IoU
+    predictions of all mask tokens; the multimask and HQ token selection of
+    MaskDecoderHQ.forward is left to the caller.
+    """
+
+    def __init__(self, model: Sam) -> None:
+        super().__init__()
+        self.mask_decoder = model.mask_decoder
+
+    @torch.no_grad()
+    def forward(
+        self,
+        image_embeddings: torch.Tensor,
+        image_pe: torch.Tensor,
+        sparse_prompt_embeddings: torch.Tensor,
+        dense_prompt_embeddings: torch.Tensor,
+        interm_embedding: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        vit_features = interm_embedding.permute(0, 3, 1, 2)
+        hq_features = self.mask_decoder.embedding_encoder(image_embeddings) + self.mask_decoder.compress_vit_feat(
+            vit_features
+        )
+        return self.mask_decoder.predict_masks(
+            image_embeddings=image_embeddings,
+            image_pe=image_pe,
+            sparse_prompt_embeddings=sparse_prompt_embeddings,
+            dense_prompt_embeddings=dense_prompt_embeddings,
+            hq_features=hq_features,
+        )
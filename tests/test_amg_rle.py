@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from segment_anything_fb.utils.amg import mask_to_rle_pytorch, packed_mask_to_mask, rle_to_mask, rle_to_packed_mask
+
+
+def previous_mask_to_rle_pytorch(tensor):
+    b, h, w = tensor.shape
+    tensor = tensor.permute(0, 2, 1).flatten(1)
+    diff = tensor[:, 1:] ^ tensor[:, :-1]
+    change_indices = diff.nonzero()
+    out = []
+    for i in range(b):
+        cur_idxs = change_indices[change_indices[:, 0] == i, 1]
+        cur_idxs = torch.cat(
+            [
+                torch.tensor([0], dtype=cur_idxs.dtype, device=cur_idxs.device),
+                cur_idxs + 1,
+                torch.tensor([h * w], dtype=cur_idxs.dtype, device=cur_idxs.device),
+            ]
+        )
+        btw_idxs = cur_idxs[1:] - cur_idxs[:-1]
+        counts = [] if tensor[i, 0] == 0 else [0]
+        counts.extend(btw_idxs.detach().cpu().tolist())
+        out.append({"size": [h, w], "counts": counts})
+    return out
+
+
+def previous_rle_to_mask(rle):
+    h, w = rle["size"]
+    mask = np.empty(h * w, dtype=bool)
+    idx = 0
+    parity = False
+    for count in rle["counts"]:
+        mask[idx: idx + count] = parity
+        idx += count
+        parity ^= True
+    mask = mask.reshape(w, h)
+    return mask.transpose()
+
+
+def create_masks(num_masks, height, width):
+    generator = torch.Generator().manual_seed(0)
+    noise = torch.randn(num_masks, 1, max(1, height // 16), max(1, width // 16), generator=generator)
+    masks = F.interpolate(noise, (height, width), mode="bilinear", align_corners=False)[:, 0] > 0.5
+    # Empty, full and single-pixel masks cover the first and last runs
+    masks[0] = False
+    masks[1] = True
+    masks[2] = False
+    masks[2, 0, 0] = True
+    masks[3] = True
+    masks[3, -1, -1] = False
+    return masks
+
+
+@pytest.mark.parametrize("size", [(1, 1), (7, 13), (64, 48), (120, 97)])
+def test_mask_to_rle_matches_previous_loop(size):
+    masks = create_masks(8, *size)
+    assert mask_to_rle_pytorch(masks) == previous_mask_to_rle_pytorch(masks)
+
+
+def test_mask_to_rle_of_empty_batch():
+    assert mask_to_rle_pytorch(torch.zeros((0, 4, 4), dtype=torch.bool)) == []
+
+
+@pytest.mark.parametrize("size", [(1, 1), (7, 13), (64, 48), (120, 97)])
+def test_rle_to_mask_matches_previous_loop(size):
+    masks = create_masks(8, *size)
+    for mask, rle in zip(masks, mask_to_rle_pytorch(masks)):
+        decoded = rle_to_mask(rle)
+        np.testing.assert_array_equal(decoded, previous_rle_to_mask(rle))
+        np.testing.assert_array_equal(decoded, mask.numpy())
+
+
+@pytest.mark.parametrize("size", [(1, 1), (7, 13), (64, 48), (120, 97)])
+def test_packed_mask_round_trip(size):
+    masks = create_masks(8, *size)
+    for mask, rle in zip(masks, mask_to_rle_pytorch(masks)):
+        packed = rle_to_packed_mask(rle)
+        np.testing.assert_array_equal(packed, np.packbits(mask.numpy(), axis=-1))
+        np.testing.assert_array_equal(packed_mask_to_mask(packed, size[1]), mask.numpy())
@@ -0,0 +1,84 @@
+import configparser
+import os
+import time
+
+import pytest
+
+from ia_config import IAConfig, IAConfigStore, ia_config
+
+
+@pytest.fixture
+def ini_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(IAConfigStore, "FLUSH_DELAY", 60.0)
+    return str(tmp_path / "ia_config.ini")
+
+
+def read_ini(ini_path):
+    config_ini = configparser.ConfigParser(defaults={})
+    config_ini.read(ini_path, encoding="utf-8")
+    return config_ini
+
+
+def test_defaults_are_written_once(ini_path):
+    store = IAConfigStore(ini_path)
+    sam_ids = ia_config.ids_dict[IAConfig.KEYS.SAM_MODEL_ID]
+    assert store.get(IAConfig.KEYS.SAM_MODEL_ID) == sam_ids["list"][sam_ids["index"]]
+    assert not os.path.isfile(ini_path)
+
+    store.flush()
+    assert read_ini(ini_path)[IAConfig.SECTIONS.DEFAULT][IAConfig.KEYS.SAM_MODEL_ID] == sam_ids["list"][sam_ids["index"]]
+
+
+def test_writes_are_debounced(ini_path):
+    store = IAConfigStore(ini_path)
+    store.load()
+    store.flush()
+    mtime_ns = os.stat(ini_path).st_mtime_ns
+
+    for value in ["a.pth", "b.pth", "c.pth"]:
+        store.set(IAConfig.KEYS.SAM_MODEL_ID, value, IAConfig.SECTIONS.USER)
+    assert store.get(IAConfig.KEYS.SAM_MODEL_ID, IAConfig.SECTIONS.USER) == "c.pth"
+    assert os.stat(ini_path).st_mtime_ns == mtime_ns
+
+    store.flush()
+    assert read_ini(ini_path)[IAConfig.SECTIONS.USER][IAConfig.KEYS.SAM_MODEL_ID] == "c.pth"
+    assert not os.path.exists(ini_path + ".tmp")
+
+
+def test_flush_timer_writes_pending_changes(ini_path, monkeypatch):
+    monkeypatch.setattr(IAConfigStore, "FLUSH_DELAY", 0.05)
+    store = IAConfigStore(ini_path)
+    store.set("key", "value", IAConfig.SECTIONS.USER)
+    deadline = time.monotonic() + 5.0
+    while store._dirty and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert read_ini(ini_path)[IAConfig.SECTIONS.USER]["key"] == "value"
+
+
+def test_user_section_falls_back_to_default(ini_path):
+    store = IAConfigStore(ini_path)
+    store.set("key", "default_value")
+    assert store.get("key", IAConfig.SECTIONS.USER) == "default_value"
+    assert store.get("missing_key", IAConfig.SECTIONS.USER) is None
+
+
+def test_file_changed_on_disk_is_reloaded(ini_path):
+    store = IAConfigStore(ini_path)
+    store.set("key", "value", IAConfig.SECTIONS.USER)
+    store.flush()
+
+    config_ini = read_ini(ini_path)
+    config_ini[IAConfig.SECTIONS.USER]["key"] = "edited"
+    with open(ini_path, "w", encoding="utf-8") as f:
+        config_ini.write(f)
+    os.utime(ini_path, ns=(0, store._mtime_ns + 1))
+    assert store.get("key", IAConfig.SECTIONS.USER) == "edited"
+
+
+def test_pending_changes_are_not_overwritten_by_a_reload(ini_path):
+    store = IAConfigStore(ini_path)
+    store.load()
+    store.flush()
+    store.set("key", "pending", IAConfig.SECTIONS.USER)
+    os.utime(ini_path, ns=(0, store._mtime_ns + 1))
+    assert store.get("key", IAConfig.SECTIONS.USER) == "pending"
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import ia_file_manager
+from ia_file_manager import IAInpModelIndex
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "hub"
+    cache_dir.mkdir()
+    models_dir = tmp_path / "models"
+    models_dir.mkdir()
+    monkeypatch.setattr(IAInpModelIndex, "cache_dir", property(lambda self: str(cache_dir)))
+    monkeypatch.setattr(ia_file_manager.ia_file_manager, "_ia_models_dir", str(models_dir))
+    return cache_dir
+
+
+def add_snapshot(cache_dir, repo_id, revision="abc", file_name="model_index.json"):
+    snapshot_dir = cache_dir / ("models--" + repo_id.replace("/", "--")) / "snapshots" / revision
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    (snapshot_dir / file_name).write_text("{}")
+
+
+def test_repos_with_snapshots_are_listed(cache_dir):
+    add_snapshot(cache_dir, "org/a-inpainting")
+    add_snapshot(cache_dir, "org/b-inpainting")
+    add_snapshot(cache_dir, "org/stable-diffusion")
+    (cache_dir / "models--org--c-inpainting").mkdir()
+
+    assert IAInpModelIndex().get_repo_ids() == ["org/b-inpainting", "org/a-inpainting"]
+
+
+def test_snapshot_added_to_existing_repo_is_found(cache_dir):
+    repo_dir = cache_dir / "models--org--a-inpainting"
+    (repo_dir / "snapshots" / "abc").mkdir(parents=True)
+    index = IAInpModelIndex()
+    assert index.get_repo_ids() == []
+
+    cache_mtime_ns = os.stat(cache_dir).st_mtime_ns
+    (repo_dir / "snapshots" / "abc" / "model_index.json").write_text("{}")
+    assert os.stat(cache_dir).st_mtime_ns == cache_mtime_ns
+    assert index.get_repo_ids() == ["org/a-inpainting"]
+
+
+def test_removed_repo_is_dropped(cache_dir):
+    add_snapshot(cache_dir, "org/a-inpainting")
+    index = IAInpModelIndex()
+    assert index.get_repo_ids() == ["org/a-inpainting"]
+
+    os.rename(cache_dir / "models--org--a-inpainting", cache_dir.parent / "removed")
+    assert index.get_repo_ids() == []
+
+
+def test_index_is_persisted(cache_dir):
+    add_snapshot(cache_dir, "org/a-inpainting")
+    IAInpModelIndex().get_repo_ids()
+    assert os.path.isfile(IAInpModelIndex().index_path)
+
+    index = IAInpModelIndex()
+    index._index = index._read_index()
+    assert list(index._index["repos"].keys()) == ["models--org--a-inpainting"]
+    assert index.get_repo_ids() == ["org/a-inpainting"]
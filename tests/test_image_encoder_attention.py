@@ -0,0 +1,25 @@
+import pytest
+import torch
+
+from segment_anything_fb.modeling.image_encoder import Attention
+
+
+def create_attention(attn_impl, size):
+    torch.manual_seed(0)
+    attention = Attention(64, num_heads=4, use_rel_pos=True, input_size=(size, size), attn_impl=attn_impl)
+    with torch.no_grad():
+        attention.rel_pos_h.normal_(std=0.5)
+        attention.rel_pos_w.normal_(std=0.5)
+    return attention.eval()
+
+
+@pytest.mark.parametrize("size", [14, 16])
+@pytest.mark.parametrize("attn_memory_limit_mb", [None, 0.01])
+def test_sdpa_matches_eager(size, attn_memory_limit_mb):
+    eager_attention = create_attention("eager", size)
+    sdpa_attention = create_attention("sdpa", size)
+    sdpa_attention.attn_memory_limit_mb = attn_memory_limit_mb
+
+    x = torch.randn(2, size, size, 64)
+    with torch.no_grad():
+        torch.testing.assert_close(sdpa_attention(x), eager_attention(x), atol=1e-5, rtol=1e-5)
@@ -0,0 +1,107 @@
+from copy import deepcopy
+
+import numpy as np
+import pytest
+import torch
+
+from segment_anything_fb.utils.amg import MaskData
+
+
+class PreviousMaskData:
+    def __init__(self, **kwargs):
+        self._stats = dict(**kwargs)
+
+    def __getitem__(self, key):
+        return self._stats[key]
+
+    def items(self):
+        return self._stats.items()
+
+    def filter(self, keep):
+        for k, v in self._stats.items():
+            if v is None:
+                self._stats[k] = None
+            elif isinstance(v, torch.Tensor):
+                self._stats[k] = v[torch.as_tensor(keep, device=v.device)]
+            elif isinstance(v, np.ndarray):
+                self._stats[k] = v[keep.detach().cpu().numpy()]
+            elif isinstance(v, list) and keep.dtype == torch.bool:
+                self._stats[k] = [a for i, a in enumerate(v) if keep[i]]
+            elif isinstance(v, list):
+                self._stats[k] = [v[i] for i in keep]
+
+    def cat(self, new_stats):
+        for k, v in new_stats.items():
+            if k not in self._stats or self._stats[k] is None:
+                self._stats[k] = deepcopy(v)
+            elif isinstance(v, torch.Tensor):
+                self._stats[k] = torch.cat([self._stats[k], v], dim=0)
+            elif isinstance(v, np.ndarray):
+                self._stats[k] = np.concatenate([self._stats[k], v], axis=0)
+            elif isinstance(v, list):
+                self._stats[k] = self._stats[k] + deepcopy(v)
+
+
+def create_batch(generator, batch_size):
+    counts = torch.randint(1, 100, (batch_size, 8), generator=generator).tolist()
+    return dict(
+        boxes=torch.randint(0, 1024, (batch_size, 4), generator=generator),
+        iou_preds=torch.rand(batch_size, generator=generator),
+        points=torch.rand(batch_size, 2, generator=generator).numpy(),
+        rles=[{"size": [32, 32], "counts": c} for c in counts],
+    )
+
+
+def assert_same_data(previous, current):
+    for k, v in previous.items():
+        if isinstance(v, list):
+            assert current[k] == v
+        else:
+            np.testing.assert_array_equal(np.asarray(current[k]), np.asarray(v))
+
+
+@pytest.mark.parametrize("batch_sizes", [[5], [5, 7, 1, 16, 3], [64] * 20])
+def test_mask_data_matches_previous_class(batch_sizes):
+    generator = torch.Generator().manual_seed(0)
+    batches = [create_batch(generator, batch_size) for batch_size in batch_sizes]
+    previous, current = PreviousMaskData(), MaskData()
+    for i, batch in enumerate(batches):
+        previous.cat(PreviousMaskData(**batch))
+        current.cat(MaskData(**batch))
+        assert_same_data(previous, current)
+        if i % 3 == 2:
+            # Filter in between, so later batches are appended to filtered columns
+            keep = previous["iou_preds"] > 0.3
+            previous.filter(keep)
+            current.filter(keep)
+            assert_same_data(previous, current)
+
+    keep = torch.argsort(previous["iou_preds"], descending=True)[: len(previous["iou_preds"]) // 2]
+    previous.filter(keep)
+    current.filter(keep)
+    assert_same_data(previous, current)
+
+
+def test_mask_data_does_not_write_to_batches():
+    generator = torch.Generator().manual_seed(0)
+    batches = [create_batch(generator, 4) for _ in range(3)]
+    expected = deepcopy(batches)
+
+    data = MaskData()
+    for batch in batches:
+        data.cat(MaskData(**batch))
+    data["boxes"][:] = 0
+    data["points"][:] = 0
+    data["rles"].clear()
+
+    for batch, expected_batch in zip(batches, expected):
+        assert torch.equal(batch["boxes"], expected_batch["boxes"])
+        np.testing.assert_array_equal(batch["points"], expected_batch["points"])
+        assert batch["rles"] == expected_batch["rles"]
+
+
+def test_mask_data_promotes_mixed_columns():
+    data = MaskData(scores=torch.zeros(2, dtype=torch.float16))
+    data.cat(MaskData(scores=torch.ones(3, dtype=torch.float32)))
+    assert data["scores"].dtype == torch.float32
+    assert data["scores"].tolist() == [0, 0, 1, 1, 1]
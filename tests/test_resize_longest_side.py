@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from torchvision.transforms.functional import resize, to_pil_image
+
+from segment_anything_fb.utils.transforms import ResizeLongestSide
+
+
+@pytest.mark.parametrize("size", [(768, 1024), (1536, 2048), (300, 400)])
+def test_default_resize_matches_pil(size):
+    image = np.random.default_rng(0).integers(0, 256, size=(*size, 3), dtype=np.uint8)
+    target_size = ResizeLongestSide.get_preprocess_shape(size[0], size[1], 1024)
+
+    expected = np.array(resize(to_pil_image(image), target_size))
+    np.testing.assert_array_equal(ResizeLongestSide(1024).apply_image(image), expected)
+
+
+@pytest.mark.parametrize("size", [(768, 1024), (1536, 2048), (300, 400)])
+def test_cv2_resize_keeps_shape(size):
+    image = np.random.default_rng(0).integers(0, 256, size=(*size, 3), dtype=np.uint8)
+    target_size = ResizeLongestSide.get_preprocess_shape(size[0], size[1], 1024)
+
+    resized = ResizeLongestSide(1024, use_cv2=True).apply_image(image)
+    assert resized.shape == (*target_size, 3)
+    assert resized.dtype == np.uint8
@@ -0,0 +1,34 @@
+import pytest
+import torch
+
+import ia_config
+from ia_config import IAConfigStore
+from ia_sam_autotune import IASamAutotune
+
+
+@pytest.fixture
+def autotune(tmp_path, monkeypatch):
+    monkeypatch.setattr(IAConfigStore, "FLUSH_DELAY", 60.0)
+    monkeypatch.setattr(ia_config, "ia_config_store", IAConfigStore(str(tmp_path / "ia_config.ini")))
+    return IASamAutotune()
+
+
+def test_settings_are_kept_per_variant(autotune):
+    autotune.save_settings("models/sam_vit_b_01ec64.pth", "float32", dict(num_threads=4, interop_threads=1, points_per_batch=64))
+    autotune.save_settings("models/sam_vit_b_01ec64.pth", "qint8", dict(num_threads=2, interop_threads=1, points_per_batch=32))
+
+    assert autotune.get_settings("models/sam_vit_b_01ec64.pth", "float32")["num_threads"] == 4
+    assert autotune.get_settings("models/sam_vit_b_01ec64.pth", "qint8")["num_threads"] == 2
+    assert autotune.get_settings("models/sam_vit_b_01ec64.pth", "onnx-int8") is None
+
+
+def test_thread_count_is_restored(autotune):
+    num_threads = torch.get_num_threads()
+    with autotune.threads(dict(num_threads=num_threads + 1)):
+        assert torch.get_num_threads() == num_threads + 1
+    assert torch.get_num_threads() == num_threads
+
+    with pytest.raises(RuntimeError):
+        with autotune.threads(dict(num_threads=num_threads + 1)):
+            raise RuntimeError
+    assert torch.get_num_threads() == num_threads
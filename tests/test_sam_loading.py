@@ -0,0 +1,47 @@
+import threading
+
+import torch
+
+from ia_sam_loading import skip_init
+from segment_anything_fb import sam_model_registry
+
+
+def test_skip_init_is_thread_local():
+    entered = threading.Event()
+    release = threading.Event()
+
+    def build_with_skip_init():
+        with skip_init():
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=build_with_skip_init)
+    thread.start()
+    try:
+        assert entered.wait(5)
+        weight = torch.full((1000,), 5.0)
+        torch.nn.init.uniform_(weight, 0.0, 1.0)
+        assert weight.max() <= 1.0
+    finally:
+        release.set()
+        thread.join(5)
+
+    with skip_init():
+        weight = torch.full((1000,), 5.0)
+        torch.nn.init.kaiming_uniform_(weight[None])
+        torch.nn.init.uniform_(weight, 0.0, 1.0)
+        assert torch.all(weight == 5.0)
+
+
+def test_checkpoint_load_matches_state_dict(tmp_path):
+    torch.manual_seed(0)
+    reference = sam_model_registry["vit_b"]()
+    checkpoint = tmp_path / "sam_vit_b_01ec64.pth"
+    torch.save(reference.state_dict(), checkpoint)
+
+    sam = sam_model_registry["vit_b"](checkpoint=str(checkpoint))
+    reference_tensors = dict(reference.named_parameters(), **dict(reference.named_buffers()))
+    tensors = dict(sam.named_parameters(), **dict(sam.named_buffers()))
+    assert reference_tensors.keys() == tensors.keys()
+    for name, tensor in tensors.items():
+        assert torch.equal(tensor, reference_tensors[name]), name
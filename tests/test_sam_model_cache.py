@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+import torch
+
+from ia_sam_manager import SamModelCache
+
+
+def make_key(name):
+    return (f"/models/{name}.pth", "cpu", "float32")
+
+
+def test_concurrent_misses_share_one_load():
+    cache = SamModelCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return torch.nn.Linear(2, 2)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(make_key("a"), loader))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    started.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 4
+    assert all(result is results[0] for result in results)
+    assert cache.stats()["misses"] == 1
+
+
+def test_cached_model_is_not_blocked_by_a_load():
+    cache = SamModelCache()
+    model_a = cache.get(make_key("a"), lambda: torch.nn.Linear(2, 2))
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_loader():
+        started.set()
+        release.wait(5)
+        return torch.nn.Linear(2, 2)
+
+    thread = threading.Thread(target=cache.get, args=(make_key("b"), slow_loader))
+    thread.start()
+    try:
+        assert started.wait(5)
+        result = []
+        reader = threading.Thread(target=lambda: result.append(cache.get(make_key("a"), lambda: None)))
+        reader.start()
+        reader.join(1)
+        assert not reader.is_alive()
+        assert result == [model_a]
+    finally:
+        release.set()
+        thread.join(5)
+
+
+def test_failed_load_is_retried():
+    cache = SamModelCache()
+
+    def failing_loader():
+        raise RuntimeError("broken checkpoint")
+
+    with pytest.raises(RuntimeError):
+        cache.get(make_key("a"), failing_loader)
+    model = cache.get(make_key("a"), lambda: torch.nn.Linear(2, 2))
+    assert isinstance(model, torch.nn.Linear)
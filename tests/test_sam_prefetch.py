@@ -0,0 +1,28 @@
+import torch
+
+import ia_sam_prefetch
+from ia_sam_prefetch import SamPrefetcher
+
+
+class TinySam(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.image_encoder = torch.nn.Conv2d(3, 1, 1)
+        self.image_encoder.img_size = 8
+
+
+def test_warmup_is_skipped_during_a_foreground_run(monkeypatch, tmp_path):
+    sam_checkpoint = tmp_path / "sam_vit_b_01ec64.pth"
+    sam_checkpoint.touch()
+    sam = TinySam()
+    monkeypatch.setattr(ia_sam_prefetch, "get_sam_model", lambda sam_checkpoint: sam)
+
+    prefetcher = SamPrefetcher()
+    with prefetcher.foreground():
+        assert prefetcher.prefetch(str(sam_checkpoint))
+        prefetcher._threads[str(sam_checkpoint)].join()
+    assert sam not in prefetcher._warmed_models
+
+    assert prefetcher.prefetch(str(sam_checkpoint))
+    prefetcher.wait(str(sam_checkpoint))
+    assert sam in prefetcher._warmed_models
@@ -0,0 +1,63 @@
+import torch
+
+from ia_sam_manager import build_sam_model, get_sam_backend
+from ia_sam_shared_encoder import SharedImageEncoder, shared_encoder_registry
+from segment_anything_fb import sam_model_registry
+from segment_anything_hq import sam_model_registry as sam_hq_model_registry
+
+
+def save_checkpoints(tmp_path):
+    torch.manual_seed(0)
+    sam = sam_model_registry["vit_b"]()
+    sam_hq = sam_hq_model_registry["vit_b"]()
+    # SAM-HQ is trained with the image encoder of SAM frozen
+    sam_hq.image_encoder.load_state_dict(sam.image_encoder.state_dict())
+    sam_checkpoint = str(tmp_path / "sam_vit_b_01ec64.pth")
+    sam_hq_checkpoint = str(tmp_path / "sam_hq_vit_b.pth")
+    torch.save(sam.state_dict(), sam_checkpoint)
+    torch.save(sam_hq.state_dict(), sam_hq_checkpoint)
+    return sam_checkpoint, sam_hq_checkpoint, sam_hq
+
+
+def build(sam_checkpoint):
+    sam, encoder_key = build_sam_model(sam_checkpoint, get_sam_backend(sam_checkpoint), torch.device("cpu"), "float32")
+    shared_encoder_registry.register(sam, encoder_key)
+    return sam
+
+
+def test_encoder_is_shared_before_loading(tmp_path):
+    sam_checkpoint, sam_hq_checkpoint, reference_hq = save_checkpoints(tmp_path)
+    sam = build(sam_checkpoint)
+    core = sam.image_encoder
+    sam_hq = build(sam_hq_checkpoint)
+
+    assert isinstance(sam.image_encoder, SharedImageEncoder)
+    assert isinstance(sam_hq.image_encoder, SharedImageEncoder)
+    assert sam.image_encoder.core is core and sam_hq.image_encoder.core is core
+    reference_tensors = reference_hq.state_dict()
+    for name, tensor in sam_hq.mask_decoder.state_dict().items():
+        assert torch.equal(tensor, reference_tensors["mask_decoder." + name]), name
+
+    # Moving one model must not move the encoder of the other
+    sam_hq.to(torch.float64)
+    assert next(core.parameters()).dtype == torch.float32
+
+
+def test_last_input_is_reused(tmp_path):
+    sam_checkpoint, sam_hq_checkpoint, _ = save_checkpoints(tmp_path)
+    sam = build(sam_checkpoint)
+    sam_hq = build(sam_hq_checkpoint)
+
+    calls = []
+    sam.image_encoder.core.register_forward_hook(lambda module, args, output: calls.append(1))
+    x = torch.randn(1, 3, 1024, 1024)
+    with torch.no_grad():
+        features = sam.image_encoder(x)
+        features_hq, interm_embeddings = sam_hq.image_encoder(x.clone())
+        assert len(calls) == 1
+        assert torch.equal(features, features_hq)
+        assert len(interm_embeddings) == sum(blk.window_size == 0 for blk in sam.image_encoder.core.blocks)
+
+        x.add_(1.0)
+        sam.image_encoder(x)
+        assert len(calls) == 2
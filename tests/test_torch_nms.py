@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import torch
+from torchvision.ops import nms as torchvision_nms
+from torchvision.ops.boxes import box_iou
+
+from segment_anything_fb.utils.torch_nms import mask_nms, nms
+
+
+def previous_nms(bboxes, scores, iou_threshold):
+    # The previous per-box loop, with the suppressed positions taken from the
+    # column of nonzero() only (it used to offset both columns)
+    order = torch.argsort(-scores)
+    keep = torch.ones(len(order), dtype=torch.bool)
+    for i in range(len(order)):
+        if keep[i]:
+            iou = box_iou(bboxes[order[i]][None, ...], bboxes[order[i + 1:]] * keep[i + 1:][..., None])
+            keep[torch.nonzero(iou > iou_threshold)[:, 1] + i + 1] = False
+    return order[keep]
+
+
+def create_boxes(num_boxes, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    xy = torch.rand(num_boxes, 2, generator=generator) * 256
+    wh = torch.rand(num_boxes, 2, generator=generator) * 64 + 4
+    scores = torch.rand(num_boxes, generator=generator)
+    return torch.cat([xy, xy + wh], dim=1), scores
+
+
+@pytest.mark.parametrize("num_boxes", [1, 50, 300])
+@pytest.mark.parametrize("tile_size", [7, 1024])
+def test_nms_matches_torchvision_and_previous_loop(num_boxes, tile_size):
+    boxes, scores = create_boxes(num_boxes)
+    keep = nms(boxes, scores, 0.5, tile_size=tile_size)
+    assert torch.equal(keep, torchvision_nms(boxes, scores, 0.5))
+    assert torch.equal(keep, previous_nms(boxes, scores, 0.5))
+
+
+def test_nms_keeps_torchvision_order_of_equal_scores():
+    boxes, _ = create_boxes(300)
+    scores = torch.randint(0, 4, (300,), generator=torch.Generator().manual_seed(1)).float()
+    assert torch.equal(nms(boxes, scores, 0.5, tile_size=16), torchvision_nms(boxes, scores, 0.5))
+
+
+def test_nms_of_no_boxes():
+    assert len(nms(torch.zeros((0, 4)), torch.zeros(0), 0.5)) == 0
+
+
+def reference_mask_nms(masks, scores, iou_threshold):
+    masks = masks.reshape(len(masks), -1).to(torch.float64)
+    intersections = masks @ masks.T
+    areas = masks.sum(dim=1)
+    ious = intersections / (areas[:, None] + areas[None, :] - intersections)
+    keep = []
+    for i in torch.sort(scores, descending=True, stable=True).indices.tolist():
+        if all(ious[i, j] <= iou_threshold for j in keep):
+            keep.append(i)
+    return torch.tensor(keep, dtype=torch.int64)
+
+
+@pytest.mark.parametrize("size", [(31, 45), (64, 64)])
+@pytest.mark.parametrize("tile_size,chunk_bytes", [(5, 16), (64, 2 ** 13)])
+def test_mask_nms_matches_greedy_loop(size, tile_size, chunk_bytes):
+    generator = torch.Generator().manual_seed(0)
+    noise = torch.randn(20, 1, 4, 4, generator=generator)
+    masks = torch.nn.functional.interpolate(noise, size, mode="bilinear", align_corners=False)[:, 0] > 0.3
+    masks = torch.cat([masks, masks ^ (torch.rand(masks.shape, generator=generator) > 0.97)])
+    scores = torch.rand(len(masks), generator=generator)
+    packed = torch.as_tensor(np.packbits(masks.numpy(), axis=-1))
+
+    keep = mask_nms(packed, scores, 0.7, tile_size=tile_size, chunk_bytes=chunk_bytes)
+    assert torch.equal(keep, reference_mask_nms(masks, scores, 0.7))
+    assert len(keep) < len(masks)